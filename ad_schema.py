@@ -0,0 +1,203 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+PLATFORMS = ["Google", "Meta", "X"]
+
+STRING_DTYPE = pd.StringDtype("pyarrow")
+
+AD_COLUMNS = [
+    "Platform",
+    "Advertiser Name",
+    "Ad Id",
+    "Ad Url",
+    "Start Date",
+    "End Date",
+    "Ad Type",
+    "Geography Targeting",
+    "Gender Targeting",
+    "Age Targeting",
+    "Interest Targeting",
+    "Impressions Min",
+    "Impressions Max",
+    "Spend Min",
+    "Spend Max",
+    "Spend",
+]
+
+CATEGORY_COLUMNS = [
+    "Advertiser Name", "Ad Type", "Geography Targeting",
+    "Gender Targeting", "Age Targeting", "Interest Targeting",
+]
+STRING_COLUMNS = ["Ad Id", "Ad Url"]
+DATE_COLUMNS = ["Start Date", "End Date"]
+BOUND_COLUMNS = ["Impressions Min", "Impressions Max", "Spend Min", "Spend Max"]
+
+_BUCKET_NUMBER = re.compile(r"(\d+(?:\.\d+)?)\s*([kKmMbB]?)")
+_SUFFIX = {"": 1, "k": 1_000, "m": 1_000_000, "b": 1_000_000_000}
+
+
+def empty_ads() -> pd.DataFrame:
+    return normalize_ads(pd.DataFrame(), PLATFORMS[0])
+
+
+def normalize_ads(df: pd.DataFrame, platform: str) -> pd.DataFrame:
+    n = len(df)
+    out = {"Platform": pd.Categorical([platform] * n, categories=PLATFORMS)}
+
+    for col in CATEGORY_COLUMNS:
+        out[col] = _category(_column(df, col))
+
+    for col in STRING_COLUMNS:
+        out[col] = _text(_column(df, col))
+
+    for col in DATE_COLUMNS:
+        out[col] = parse_dates(_column(df, col))
+
+    imp_lo, imp_hi = _bounds(df, "Impressions")
+    spend_lo, spend_hi = _bounds(df, "Spend")
+    out["Impressions Min"], out["Impressions Max"] = imp_lo, imp_hi
+    out["Spend Min"], out["Spend Max"] = spend_lo, spend_hi
+
+    raw_spend = _column(df, "Spend")
+    if pd.api.types.is_numeric_dtype(raw_spend.dtype):
+        out["Spend"] = raw_spend.astype("float64")
+    else:
+        lo = spend_lo.astype("float64")
+        out["Spend"] = ((lo + spend_hi.astype("float64")) / 2).fillna(lo)
+
+    return pd.DataFrame(out, columns=AD_COLUMNS).reset_index(drop=True)
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    fields = []
+    for col in AD_COLUMNS:
+        if col in DATE_COLUMNS:
+            fields.append((col, pa.timestamp("ns")))
+        elif col in BOUND_COLUMNS:
+            fields.append((col, pa.int64()))
+        elif col == "Spend":
+            fields.append((col, pa.float64()))
+        else:
+            fields.append((col, pa.string()))
+    return pa.schema(fields)
+
+
+def to_arrow(df: pd.DataFrame):
+    import pyarrow as pa
+
+    schema = arrow_schema()
+    arrays = []
+    for field in schema:
+        values = df[field.name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(STRING_DTYPE)
+        arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _column(df: pd.DataFrame, col: str) -> pd.Series:
+    if col in df.columns:
+        return df[col].reset_index(drop=True)
+    return pd.Series([pd.NA] * len(df), dtype="object")
+
+
+def _category(values: pd.Series) -> pd.Series:
+    values = values.astype("category")
+    if "" in values.cat.categories:
+        values = values.cat.remove_categories([""])
+    return values
+
+
+def _text(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_float_dtype(values.dtype):
+        # numeric ids read from CSV become floats when the column has gaps
+        values = values.astype("Int64")
+    return values.astype(STRING_DTYPE)
+
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+    elif not pd.api.types.is_datetime64_dtype(values.dtype):
+        values = values.replace("", pd.NA)
+        values = pd.to_datetime(values, errors="coerce", utc=True, format="mixed").dt.tz_localize(None)
+    return values.astype("datetime64[ns]")
+
+
+def _bounds(df: pd.DataFrame, col: str):
+    lo_col, hi_col = f"{col} Min", f"{col} Max"
+    if lo_col in df.columns and hi_col in df.columns:
+        return _int_bounds(_column(df, lo_col)), _int_bounds(_column(df, hi_col))
+
+    values = _column(df, col)
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        exact = values.astype("float64")
+        return _int_bounds(np.floor(exact)), _int_bounds(np.ceil(exact))
+
+    if values.map(_is_hashable, na_action="ignore").all():
+        # bucket labels such as Google's "10k-100k" repeat; parse each distinct label once
+        parsed = {v: _parse_range(v) for v in values.dropna().unique()}
+        pairs = values.map(parsed, na_action="ignore")
+    else:
+        pairs = values.map(_parse_range, na_action="ignore")
+    lo = pairs.map(lambda p: p[0], na_action="ignore")
+    hi = pairs.map(lambda p: p[1], na_action="ignore")
+    return _int_bounds(lo), _int_bounds(hi)
+
+
+def _int_bounds(values) -> pd.Series:
+    return pd.to_numeric(pd.Series(values), errors="coerce").round().astype("Int64")
+
+
+def _is_hashable(value) -> bool:
+    return not isinstance(value, (dict, list))
+
+
+def _parse_range(value):
+    if isinstance(value, dict):
+        # Meta Ad Library ranges: {"lower_bound": "100", "upper_bound": "199"}; the top bucket has no upper
+        return _number(value.get("lower_bound")), _number(value.get("upper_bound"))
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value), float(value)
+
+    text = str(value).strip().replace(",", "")
+    numbers = [float(num) * _SUFFIX[suffix.lower()] for num, suffix in _BUCKET_NUMBER.findall(text)]
+    if not numbers:
+        return None, None
+    if text.startswith(("≤", "<")):
+        return 0.0, numbers[0]
+    if text.startswith((">", "≥")):
+        return numbers[0], None
+    return numbers[0], numbers[-1]
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def demographic_buckets(distribution, key: str):
+    # Meta reports delivery as [{"age": "18-24", "gender": "female", "percentage": "0.1"}, ...];
+    # keep the set of buckets reached so the targeting columns stay low-cardinality
+    if isinstance(distribution, dict):
+        distribution = [distribution]
+    if not isinstance(distribution, list):
+        return None
+    buckets = {item.get(key) for item in distribution if isinstance(item, dict)}
+    return ", ".join(sorted(str(b) for b in buckets if b)) or None
+
+
+def format_range(lo, hi) -> str:
+    if pd.isna(lo) and pd.isna(hi):
+        return ""
+    if pd.isna(hi):
+        return f"{int(lo):,}+"
+    if pd.isna(lo) or lo == hi:
+        return f"{int(hi):,}"
+    return f"{int(lo):,}–{int(hi):,}"
@@ -0,0 +1,1100 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from itertools import groupby
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+import http_client
+import metrics
+from ad_schema import PLATFORMS, arrow_schema, demographic_buckets, empty_ads, normalize_ads, parse_dates, to_arrow
+from config import load_config
+from regions import DEFAULT_COUNTRIES, normalize_countries, region_pattern
+from result_cache import RESULT_CACHE_DIR, ResultCache
+from x_ads_scraper import (
+    download_and_extract_csv, expand_geography_search, filter_by_advertiser, find_latest_data_file, standardize_columns,
+)
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_TTL = 86400
+SEARCH_CACHE_MAX_ENTRIES = 256
+# memory the in-process result cache may hold, measured per frame; the least recently used
+# results go first. A single result over SEARCH_CACHE_MAX_ENTRY_BYTES is not kept in memory
+# (it is still on disk).
+SEARCH_CACHE_MAX_BYTES = int(os.environ.get("SEARCH_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+SEARCH_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRY_BYTES", SEARCH_CACHE_MAX_BYTES // 4))
+# platform -> oldest result, in seconds, reused from the shared disk cache (default SEARCH_CACHE_TTL)
+CACHE_MAX_AGE = {}
+# seconds a source's data version (the X snapshot, the BigQuery table's last change) is trusted
+# before it is looked up again; the version is part of every cached result's key
+SOURCE_VERSION_TTL = int(os.environ.get("SOURCE_VERSION_TTL", 600))
+GOOGLE_CREATIVES_TABLE = "bigquery-public-data.google_political_ads.creative_stats"
+META_MAX_PAGES = 10
+META_GRAPH_URL = os.environ.get("META_GRAPH_URL", "https://graph.facebook.com/v17.0")
+META_RATE_LIMIT_WAIT = 60
+META_PAGE_DELAY = 0.5
+# the Ad Library accepts at most this many search_page_ids per request
+META_MAX_PAGE_IDS = 10
+# countries a Meta search covers unless the search names its own
+META_COUNTRIES = normalize_countries(os.environ.get("META_COUNTRIES", "")) or DEFAULT_COUNTRIES
+# Graph requests in flight at once across all Meta searches in the process, countries included
+META_MAX_CONCURRENT = int(os.environ.get("META_MAX_CONCURRENT", 8))
+
+# Narrowing handed to the search itself (pushdown): BigQuery gets spend, advertisers and the
+# date window as query parameters, Meta the selected pages' ids and delivery dates; the rest is
+# applied to the fetched rows, so the result is the broad search filtered locally. None means
+# no bound. since/until is a date window: ads delivering on any day in it, ends inclusive.
+# countries (ISO codes) scopes the search rather than filtering it: Meta is searched in each
+# (META_COUNTRIES when empty), Google keeps ads shown in one of them, X has no country.
+SearchFilters = namedtuple(
+    "SearchFilters", "min_spend max_spend advertisers since until countries",
+    defaults=(None, None, (), None, None, ()),
+)
+
+GOOGLE_COLUMNS = {
+    "screen_name": "Advertiser Name",
+    "tweet_id": "Ad Id",
+    "tweet_url": "Ad Url",
+    "day_of_start_date_adgroup": "Start Date",
+    "day_of_end_date_adgroup": "End Date",
+    "targeting_name": "Ad Type",
+    "geo_targeting": "Geography Targeting",
+    "gender_targeting": "Gender Targeting",
+    "age_targeting": "Age Targeting",
+    "impressions": "Impressions",
+    "spend_min_usd": "Spend Min",
+    "spend_max_usd": "Spend Max",
+    "spend_usd": "Spend",
+}
+
+_settings = None
+_meta_ad_type = None
+# Meta page name -> frozenset of page ids seen in search results, for pushing an advertiser
+# selection down; replaced, never changed in place
+_meta_page_ids = {}
+_meta_page_ids_lock = threading.Lock()
+_settings_lock = threading.Lock()
+_meta_slots = threading.BoundedSemaphore(META_MAX_CONCURRENT)
+# a rate-limit answer to any Meta request holds back every Meta request until then
+_meta_paused_until = 0.0
+_meta_pause_lock = threading.Lock()
+_bq_client = None
+# key -> (expires, value, bytes), least recently used first
+_cache = {}
+_cache_bytes = 0
+_cache_stats = Counter()
+_cache_lock = threading.Lock()
+# key -> Future of the fetch a caller is running for it; concurrent misses wait on that one
+_inflight = {}
+_result_cache = ResultCache(RESULT_CACHE_DIR) if RESULT_CACHE_DIR else None
+# platform -> (trusted until, data version); one lookup per platform at a time, the rest wait for it
+_source_versions = {}
+_source_versions_lock = threading.Lock()
+_source_lookup_locks = {platform: threading.Lock() for platform in PLATFORMS}
+# called with (platform, frame) for every frame fetched from a platform; cache hits are not fetches
+_fetch_listeners = []
+
+
+class MetaAPIError(Exception):
+    pass
+
+
+def configure(meta_token: Optional[str] = None, gcp_service_account: Optional[dict] = None):
+    global _settings, _bq_client
+    with _settings_lock:
+        settings = dict(_settings or load_config())
+        if meta_token:
+            settings["META_TOKEN"] = meta_token
+        if gcp_service_account and dict(gcp_service_account) != settings.get("GCP_SECRETS"):
+            # the app configures on every rerun; only a changed key warrants a new client
+            settings["GCP_SECRETS"] = dict(gcp_service_account)
+            _bq_client = None
+        _settings = settings
+
+
+def _get_settings() -> dict:
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = load_config()
+        return _settings
+
+
+def bigquery_client():
+    global _bq_client
+    with _settings_lock:
+        if _bq_client is None:
+            from google.oauth2 import service_account
+            from google.cloud import bigquery
+
+            credentials = service_account.Credentials.from_service_account_info(
+                (_settings or load_config())["GCP_SECRETS"]
+            )
+            _bq_client = bigquery.Client(credentials=credentials)
+        return _bq_client
+
+
+def search_google(advertiser_name: str, geography: str = "", filters: Optional[SearchFilters] = None) -> pd.DataFrame:
+    from google.cloud import bigquery
+
+    filters = filters or SearchFilters()
+    expanded_geography = region_pattern(geography, filters.countries or DEFAULT_COUNTRIES)
+    # exact advertisers resolved to ids: creative_stats is then looked up by id before the join
+    advertiser_ids = google_advertiser_ids(filters.advertisers) if filters.advertisers else []
+
+    query = """
+    WITH advertiser_base AS (
+      SELECT
+        advertiser_id,
+        advertiser_name
+      FROM `bigquery-public-data.google_political_ads.advertiser_stats`
+      WHERE LOWER(advertiser_name) LIKE LOWER(@advertiser_name)
+        AND (ARRAY_LENGTH(@advertisers) = 0 OR advertiser_name IN UNNEST(@advertisers))
+        AND (ARRAY_LENGTH(@advertiser_ids) = 0 OR advertiser_id IN UNNEST(@advertiser_ids))
+    ),
+
+    creatives AS (
+      SELECT
+        ad_id,
+        advertiser_id,
+        ad_type,
+        ad_url,
+        date_range_start,
+        date_range_end,
+        impressions,
+        spend_range_min_usd,
+        spend_range_max_usd,
+        (spend_range_min_usd + spend_range_max_usd)/2 AS spend_usd,
+        geo_targeting_included,
+        age_targeting,
+        gender_targeting
+      FROM `bigquery-public-data.google_political_ads.creative_stats`
+      WHERE (@geography = "" OR REGEXP_CONTAINS(LOWER(geo_targeting_included), LOWER(@geography)))
+        AND (ARRAY_LENGTH(@advertiser_ids) = 0 OR advertiser_id IN UNNEST(@advertiser_ids))
+        AND (ARRAY_LENGTH(@countries) = 0 OR EXISTS (
+          SELECT 1 FROM UNNEST(SPLIT(regions, ",")) AS region WHERE TRIM(region) IN UNNEST(@countries)
+        ))
+    )
+
+    SELECT
+      a.advertiser_name AS screen_name,
+      c.ad_id AS tweet_id,
+      c.ad_url AS tweet_url,
+      c.date_range_start AS day_of_start_date_adgroup,
+      c.date_range_end AS day_of_end_date_adgroup,
+      c.ad_type AS targeting_name,
+      c.geo_targeting_included AS geo_targeting,
+      c.gender_targeting AS gender_targeting,
+      c.age_targeting AS age_targeting,
+      c.impressions AS impressions,
+      c.spend_range_min_usd AS spend_min_usd,
+      c.spend_range_max_usd AS spend_max_usd,
+      c.spend_usd AS spend_usd
+    FROM advertiser_base a
+    LEFT JOIN creatives c
+      ON a.advertiser_id = c.advertiser_id
+    -- after the join, so an advertiser whose creatives are all filtered out leaves no row of
+    -- nulls; missing spend counts as 0 and missing dates don't exclude, as in apply_filters
+    WHERE (@min_spend IS NULL OR IFNULL(c.spend_usd, 0) >= @min_spend)
+      AND (@max_spend IS NULL OR IFNULL(c.spend_usd, 0) <= @max_spend)
+      AND (@window_start IS NULL OR IFNULL(c.date_range_end, @window_start) >= @window_start)
+      AND (@window_end IS NULL OR IFNULL(c.date_range_start, @window_end) <= @window_end)
+    ORDER BY c.date_range_start DESC
+    """
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter(
+                "advertiser_name", "STRING", f"%{advertiser_name}%"
+            ),
+            bigquery.ScalarQueryParameter(
+                "geography", "STRING", expanded_geography
+            ),
+            bigquery.ArrayQueryParameter("advertisers", "STRING", list(filters.advertisers)),
+            bigquery.ArrayQueryParameter("advertiser_ids", "STRING", advertiser_ids),
+            bigquery.ArrayQueryParameter("countries", "STRING", list(filters.countries)),
+            bigquery.ScalarQueryParameter("min_spend", "FLOAT64", filters.min_spend),
+            bigquery.ScalarQueryParameter("max_spend", "FLOAT64", filters.max_spend),
+            bigquery.ScalarQueryParameter("window_start", "DATE", filters.since),
+            bigquery.ScalarQueryParameter("window_end", "DATE", filters.until),
+        ]
+    )
+
+    metrics.incr("api_calls", platform="Google")
+    query_job = bigquery_client().query(query, job_config=job_config)
+    rows = query_job.result()
+    metrics.incr("bigquery_bytes", query_job.total_bytes_processed or 0)
+
+    df = pd.DataFrame([dict(row) for row in rows])
+
+    df = df.rename(columns=GOOGLE_COLUMNS)
+
+    return normalize_ads(df, "Google")
+
+
+def google_advertisers() -> pd.DataFrame:
+    # every advertiser id and name: a small table, cached like a search
+    return _cached(("Google advertisers",), _fetch_google_advertisers)
+
+
+def _fetch_google_advertisers() -> pd.DataFrame:
+    query = """
+    SELECT advertiser_id, advertiser_name
+    FROM `bigquery-public-data.google_political_ads.advertiser_stats`
+    """
+    metrics.incr("api_calls", platform="Google")
+    query_job = bigquery_client().query(query)
+    rows = query_job.result()
+    metrics.incr("bigquery_bytes", query_job.total_bytes_processed or 0)
+    return pd.DataFrame([dict(row) for row in rows], columns=["advertiser_id", "advertiser_name"])
+
+
+def google_advertiser_ids(names) -> list:
+    # ids for exact advertiser names, or [] (match by name only) when one isn't known
+    try:
+        advertisers = google_advertisers()
+    except Exception as e:
+        logger.warning(f"Could not load Google advertiser ids: {e}")
+        return []
+    found = advertisers[advertisers["advertiser_name"].isin(list(names))]
+    if set(found["advertiser_name"]) != set(names):
+        return []
+    return sorted(found["advertiser_id"].astype(str).unique())
+
+
+def recent_google(since: date) -> pd.DataFrame:
+    from google.cloud import bigquery
+
+    query = """
+    SELECT
+      a.advertiser_name AS screen_name,
+      c.ad_id AS tweet_id,
+      c.ad_url AS tweet_url,
+      c.date_range_start AS day_of_start_date_adgroup,
+      c.date_range_end AS day_of_end_date_adgroup,
+      c.ad_type AS targeting_name,
+      c.geo_targeting_included AS geo_targeting,
+      c.gender_targeting AS gender_targeting,
+      c.age_targeting AS age_targeting,
+      c.impressions AS impressions,
+      c.spend_range_min_usd AS spend_min_usd,
+      c.spend_range_max_usd AS spend_max_usd,
+      (c.spend_range_min_usd + c.spend_range_max_usd)/2 AS spend_usd
+    FROM `bigquery-public-data.google_political_ads.creative_stats` c
+    JOIN `bigquery-public-data.google_political_ads.advertiser_stats` a
+      ON a.advertiser_id = c.advertiser_id
+    WHERE IFNULL(c.date_range_end, @since) >= @since
+    ORDER BY c.date_range_start DESC
+    """
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("since", "DATE", since)]
+    )
+
+    metrics.incr("api_calls", platform="Google")
+    query_job = bigquery_client().query(query, job_config=job_config)
+    rows = query_job.result()
+    metrics.incr("bigquery_bytes", query_job.total_bytes_processed or 0)
+
+    df = pd.DataFrame([dict(row) for row in rows]).rename(columns=GOOGLE_COLUMNS)
+    return normalize_ads(df, "Google")
+
+
+def search_meta(advertiser_name: str, geography: str = "", filters: Optional[SearchFilters] = None) -> pd.DataFrame:
+    countries = (filters.countries if filters else ()) or META_COUNTRIES
+    if len(countries) == 1:
+        return search_meta_country(advertiser_name, geography, filters, countries[0])
+    # the Ad Library takes one country per search to page through; the countries run at once,
+    # so the slowest one sets the pace. An ad shown in several comes back from each: keep one.
+    with ThreadPoolExecutor(max_workers=len(countries), thread_name_prefix="meta-country") as pool:
+        # carry the caller's metrics.collect() along, or the app's diagnostics see no Meta calls
+        frames = list(pool.map(metrics.carry_collectors(
+            lambda country: search_meta_country(advertiser_name, geography, filters, country),
+        ), countries))
+    ads = pd.concat(frames, ignore_index=True)
+    ids = ads["Ad Id"].fillna("")
+    return normalize_ads(ads[(ids == "") | ~ids.duplicated()], "Meta")
+
+
+def search_meta_country(advertiser_name: str, geography: str, filters: Optional[SearchFilters],
+                        country: str) -> pd.DataFrame:
+    import pyarrow as pa
+
+    base_url = f"{META_GRAPH_URL}/ads_archive"
+    fields = (
+        "id,page_id,page_name,bylines,"
+        "ad_creation_time,ad_delivery_start_time,ad_delivery_stop_time,"
+        "ad_creative_bodies,ad_creative_link_titles,ad_snapshot_url,"
+        "spend,impressions,currency,"
+        "ad_reached_countries,delivery_by_region,publisher_platforms,demographic_distribution"
+    )
+
+    params = {
+        "access_token": _get_settings()["META_TOKEN"],
+        "ad_type": "POLITICAL_AND_ISSUE_ADS",
+        "ad_reached_countries": json.dumps([country]),
+        "fields": fields,
+        "limit": 100,
+        "search_terms": advertiser_name,
+    }
+    # spend has no Ad Library parameter; it is filtered after the fetch
+    page_ids = meta_page_ids(filters.advertisers) if filters and filters.advertisers else None
+    if page_ids:
+        params["search_page_ids"] = json.dumps(page_ids)
+    if filters and filters.since is not None:
+        params["ad_delivery_date_min"] = filters.since.isoformat()
+    if filters and filters.until is not None:
+        params["ad_delivery_date_max"] = filters.until.isoformat()
+
+    url = base_url
+    page_count = 0
+    pages = []
+    geo_pattern = region_pattern(geography, (country,)) if geography else ""
+
+    # each page is converted to Arrow on a worker while the next one is requested
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="meta-pages") as parser:
+        while True:
+            data = _meta_get(url, params)
+
+            if "error" in data:
+                code = data["error"].get("code")
+                if code == 613:
+                    metrics.incr("retries", platform="Meta", reason="rate_limit")
+                    _meta_back_off()
+                    data = _meta_get(url, params)
+                if "error" in data:
+                    raise MetaAPIError(data["error"].get("message"))
+
+            pages.append(parser.submit(meta_page, data.get("data", [])))
+            page_count += 1
+
+            next_url = data.get("paging", {}).get("next")
+            if not next_url or page_count >= META_MAX_PAGES:
+                break
+
+            url = next_url
+            params = {}
+            time.sleep(META_PAGE_DELAY)
+
+        pages = [page.result() for page in pages]
+
+    # pages Arrow couldn't convert take the per-ad path and keep their place in the results
+    frames = []
+    for slow, group in groupby(pages, key=lambda page: isinstance(page, list)):
+        if slow:
+            frames.extend(normalize_ads(_meta_rows_frame(ads, advertiser_name, geo_pattern), "Meta") for ads in group)
+        else:
+            ads = meta_ads_filter(pa.concat_arrays(list(group)), advertiser_name, geo_pattern)
+            _remember_page_ids(ads)
+            frames.append(normalize_ads(meta_ads_frame(ads), "Meta"))
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+def _meta_get(url: str, params: dict) -> dict:
+    # every Meta search shares the request slots and waits out any rate-limit pause
+    while True:
+        wait = _meta_paused_until - time.monotonic()
+        if wait <= 0:
+            break
+        time.sleep(wait)
+    with _meta_slots:
+        metrics.incr("api_calls", platform="Meta")
+        response = http_client.get(url, params=params)
+    # Graph API errors (613 rate limiting included) come with a 4xx status and a JSON error
+    # body; hand those back so the caller can back off, and raise on anything else
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+    if isinstance(data, dict) and "error" in data:
+        return data
+    response.raise_for_status()
+    return data
+
+
+def _meta_back_off():
+    global _meta_paused_until
+    with _meta_pause_lock:
+        _meta_paused_until = max(_meta_paused_until, time.monotonic() + META_RATE_LIMIT_WAIT)
+
+
+def meta_page_ids(advertisers) -> Optional[list]:
+    # ids of the pages behind the selected advertiser names, or None when one was never seen
+    # (or there are too many) and the selection can only be applied after the fetch
+    ids = set()
+    for name in advertisers:
+        known = _meta_page_ids.get(name)
+        if not known:
+            return None
+        ids.update(known)
+    return sorted(ids) if len(ids) <= META_MAX_PAGE_IDS else None
+
+
+def meta_pages() -> dict:
+    # page name -> ids of every Meta page seen in search results so far
+    with _meta_page_ids_lock:
+        pages = list(_meta_page_ids.items())
+    return {name: sorted(ids) for name, ids in pages}
+
+
+def _remember_page_ids(ads):
+    found = {}
+    for name, page_id in zip(ads.field("page_name").to_pylist(), ads.field("page_id").to_pylist()):
+        if name and page_id:
+            found.setdefault(name, set()).add(page_id)
+    # country workers add while the advertiser index reads: the sets are frozen and swapped
+    # in whole, so a reader iterates a set nothing changes
+    with _meta_page_ids_lock:
+        for name, ids in found.items():
+            known = _meta_page_ids.get(name, frozenset())
+            if not ids <= known:
+                _meta_page_ids[name] = known | ids
+
+
+def meta_page(ads: list):
+    # one page of Ad Library results as an Arrow struct array, or the raw list when a field
+    # has a shape the schema doesn't expect
+    import pyarrow as pa
+
+    try:
+        return pa.array(ads, type=_meta_type())
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return ads
+
+
+def meta_ads_filter(ads, advertiser_name: str, geo_pattern: str = ""):
+    # the page-name and region checks search_meta made ad by ad, as two column operations
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    keep = pc.fill_null(pc.match_substring(ads.field("page_name"), advertiser_name, ignore_case=True), False)
+    ads = ads.filter(keep)
+    if not geo_pattern or not len(ads):
+        return ads
+
+    delivery = ads.field("delivery_by_region")
+    regions = pc.fill_null(delivery.values.field("region"), "")
+    try:
+        hits = pc.match_substring_regex(regions, geo_pattern, ignore_case=True).to_numpy(zero_copy_only=False)
+    except pa.ArrowInvalid:
+        # Python-only regex syntax that RE2 rejects
+        pattern = re.compile(geo_pattern, re.IGNORECASE)
+        hits = np.array([pattern.search(r) is not None for r in regions.to_pylist()], dtype=bool)
+    matched = np.zeros(len(ads), dtype=bool)
+    matched[pc.list_parent_indices(delivery).to_numpy()[hits]] = True
+    return ads.filter(pa.array(matched))
+
+
+def meta_ads_frame(ads) -> pd.DataFrame:
+    # the columns search_meta used to build ad by ad, computed once over every page
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    n = len(ads)
+    if not n:
+        return pd.DataFrame()
+    delivery = ads.field("delivery_by_region")
+    regions = pc.fill_null(delivery.values.field("region"), "")
+    demographics = ads.field("demographic_distribution")
+    spend = ads.field("spend")
+    impressions = ads.field("impressions")
+    return pa.table({
+        "Advertiser Name": ads.field("page_name"),
+        "Ad Id": pc.fill_null(ads.field("id"), ""),
+        "Ad Url": pc.fill_null(ads.field("ad_snapshot_url"), ""),
+        "Start Date": ads.field("ad_delivery_start_time"),
+        "End Date": ads.field("ad_delivery_stop_time"),
+        "Ad Type": pa.array(["POLITICAL_AND_ISSUE_ADS"] * n, type=pa.string()),
+        "Geography Targeting": pc.binary_join(pa.ListArray.from_arrays(delivery.offsets, regions), ", "),
+        "Gender Targeting": pa.array(_bucket_labels(demographics, "gender", n), type=pa.string()),
+        "Age Targeting": pa.array(_bucket_labels(demographics, "age", n), type=pa.string()),
+        "Impressions Min": impressions.field("lower_bound"),
+        "Impressions Max": impressions.field("upper_bound"),
+        "Spend Min": spend.field("lower_bound"),
+        "Spend Max": spend.field("upper_bound"),
+    }).to_pandas()
+
+
+def _meta_type():
+    # the fields read from each ad; anything else in the response is ignored
+    global _meta_ad_type
+    if _meta_ad_type is None:
+        import pyarrow as pa
+
+        bounds = pa.struct([("lower_bound", pa.string()), ("upper_bound", pa.string())])
+        _meta_ad_type = pa.struct([
+            ("id", pa.string()),
+            ("page_id", pa.string()),
+            ("page_name", pa.string()),
+            ("ad_snapshot_url", pa.string()),
+            ("ad_delivery_start_time", pa.string()),
+            ("ad_delivery_stop_time", pa.string()),
+            ("spend", bounds),
+            ("impressions", bounds),
+            ("delivery_by_region", pa.list_(pa.struct([("region", pa.string())]))),
+            ("demographic_distribution", pa.list_(pa.struct([("age", pa.string()), ("gender", pa.string())]))),
+        ])
+    return _meta_ad_type
+
+
+def _bucket_labels(distribution, key: str, n: int):
+    # demographic_buckets() for a whole page: the sorted distinct buckets of each ad, joined.
+    # There are only a handful of buckets, so each distinct combination is formatted once.
+    import pyarrow.compute as pc
+
+    encoded = pc.fill_null(distribution.values.field(key), "").dictionary_encode()
+    names = encoded.dictionary.to_pylist()
+    keep = sorted((name, i) for i, name in enumerate(names) if name)
+    if not keep:
+        return [None] * n
+    present = np.zeros((n, len(names)), dtype=bool)
+    present[pc.list_parent_indices(distribution).to_numpy(), encoded.indices.to_numpy()] = True
+    present = present[:, [i for _, i in keep]]
+    if len(keep) < 63:
+        # one bit per bucket: unique() over integers is far cheaper than over rows
+        bits = np.arange(len(keep), dtype=np.int64)
+        combos, inverse = np.unique(present @ (1 << bits), return_inverse=True)
+        combos = (combos[:, None] >> bits & 1).astype(bool)
+    else:
+        combos, inverse = np.unique(present, axis=0, return_inverse=True)
+    labels = [", ".join(keep[j][0] for j in np.flatnonzero(combo)) or None for combo in combos]
+    return np.array(labels, dtype=object)[inverse.ravel()]
+
+
+def _meta_rows_frame(ads: list, advertiser_name: str, geo_pattern: str) -> pd.DataFrame:
+    rows = []
+    for ad in ads:
+        if advertiser_name.lower() not in (ad.get("page_name") or "").lower():
+            continue
+        delivery_by_region = ad.get("delivery_by_region") or []
+        regions = [region.get("region", "") for region in delivery_by_region if isinstance(region, dict)]
+        if geo_pattern and not any(re.search(geo_pattern, region, re.IGNORECASE) for region in regions):
+            continue
+
+        demo = ad.get("demographic_distribution")
+        rows.append({
+            "Advertiser Name": ad.get("page_name") or advertiser_name,
+            "Ad Id": ad.get("id", ""),
+            "Ad Url": ad.get("ad_snapshot_url", ""),
+            "Start Date": ad.get("ad_delivery_start_time", ""),
+            "End Date": ad.get("ad_delivery_stop_time", ""),
+            "Ad Type": "POLITICAL_AND_ISSUE_ADS",
+            "Geography Targeting": ", ".join(regions),
+            "Gender Targeting": demographic_buckets(demo, "gender"),
+            "Age Targeting": demographic_buckets(demo, "age"),
+            "Impressions": ad.get("impressions"),
+            "Spend": ad.get("spend"),
+        })
+    return pd.DataFrame(rows)
+
+
+def x_snapshot() -> pd.DataFrame:
+    # every X search filters the same downloaded disclosure file, so fetch it once per TTL
+    # the raw file stays in memory; the searches filtered from it are cached on disk
+    return _cached(("X snapshot",), lambda: _by_end_date(standardize_columns(download_and_extract_csv())), persist=False)
+
+
+def _by_end_date(df: pd.DataFrame) -> pd.DataFrame:
+    # dates parsed once per download and rows ordered by end date, ads still running last,
+    # so a date window starting on a day is the suffix of the table from its first end date
+    for col in ("Start Date", "End Date"):
+        if col in df.columns:
+            df[col] = parse_dates(df[col])
+    if "End Date" in df.columns:
+        df = df.sort_values("End Date", kind="stable", na_position="last", ignore_index=True)
+    return df
+
+
+def x_snapshot_version() -> Optional[str]:
+    # URL of the newest published file: a few header-only requests, where x_snapshot downloads it
+    url, _ = find_latest_data_file()
+    return url
+
+
+def google_data_version() -> Optional[str]:
+    # when the public dataset was last updated: table metadata, nothing is scanned
+    modified = bigquery_client().get_table(GOOGLE_CREATIVES_TABLE).modified
+    return modified.isoformat() if modified else None
+
+
+# platforms whose data is published in versions; Meta is queried live
+SOURCE_VERSIONS = {
+    "Google": google_data_version,
+    "X": x_snapshot_version,
+}
+
+
+def source_version(platform: str) -> str:
+    # "" when the platform has none, or it could not be looked up yet
+    lookup = SOURCE_VERSIONS.get(platform)
+    if lookup is None:
+        return ""
+    with _source_lookup_locks[platform]:
+        now = time.monotonic()
+        with _source_versions_lock:
+            known = _source_versions.get(platform)
+        if known is not None and known[0] > now:
+            return known[1]
+        try:
+            version = lookup() or ""
+        except Exception as e:
+            logger.warning(f"Could not look up the {platform} data version: {e}")
+            version = known[1] if known else ""
+        with _source_versions_lock:
+            _source_versions[platform] = (now + SOURCE_VERSION_TTL, version)
+    return version
+
+
+def search_x(advertiser_name: str, geography: str = "", filters: Optional[SearchFilters] = None) -> pd.DataFrame:
+    df = x_snapshot()
+
+    if filters and filters.since is not None and "End Date" in df.columns:
+        # NaT sorts last in numpy too, so the running ads stay in the suffix
+        df = df.iloc[np.searchsorted(df["End Date"].to_numpy(), np.datetime64(filters.since), side="left"):]
+    if filters and filters.advertisers and "Advertiser Name" in df.columns:
+        # an exact-name lookup first leaves the substring search only a few rows to scan
+        df = df[df["Advertiser Name"].isin(filters.advertisers)]
+    if advertiser_name:
+        df = filter_by_advertiser(df, advertiser_name)
+
+    if geography and "Geography Targeting" in df.columns:
+        expanded_geo = expand_geography_search(geography)
+        df = df[df["Geography Targeting"].astype(str).str.contains(expanded_geo, case=False, na=False, regex=True)]
+
+    df = normalize_ads(df, "X")
+    return df.sort_values("Start Date", ascending=False)
+
+
+def recent_x(since: date) -> pd.DataFrame:
+    df = normalize_ads(x_snapshot(), "X")
+    ends = df["End Date"]
+    df = df[ends.isna() | (ends >= pd.Timestamp(since))]
+    return df.sort_values("Start Date", ascending=False).reset_index(drop=True)
+
+
+PLATFORM_SEARCHES = {
+    "Google": search_google,
+    "Meta": search_meta,
+    "X": search_x,
+}
+
+# every ad, from any advertiser, still running on or after a date (whenever it started, so an
+# ad published late is included); the notifier matches these against all subscriptions at
+# once. Meta's Ad Library can only be searched by keyword.
+RECENT_ADS = {
+    "Google": recent_google,
+    "X": recent_x,
+}
+
+
+def normalize_query(keyword: str, geography: str = "") -> tuple:
+    return (keyword or "").strip().lower(), (geography or "").strip().lower()
+
+
+def use_result_cache(directory: Optional[str]):
+    # None keeps results in this process only
+    global _result_cache
+    _result_cache = ResultCache(directory) if directory else None
+
+
+def _cached(key: tuple, compute, persist: bool = True):
+    # this process's memory first, then the disk cache shared with other processes. Keys end
+    # with the source's data version, so a new X snapshot or BigQuery update is fetched afresh.
+    key = (*key, source_version(key[0].split()[0]))
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _cache[key] = _cache.pop(key)
+                _cache_stats["hits"] += 1
+                metrics.incr("search_cache", source=key[0], result="hit", tier="memory")
+                return entry[1]
+            _forget(key, "expired")
+        # single flight: the first miss fetches, concurrent misses for the key share its
+        # result or its error instead of starting the same BigQuery job or Meta paging
+        pending = _inflight.get(key)
+        if pending is None:
+            pending = _inflight[key] = Future()
+            leader = True
+        else:
+            leader = False
+
+    if not leader:
+        metrics.incr("search_cache", source=key[0], result="coalesced")
+        return pending.result()
+
+    try:
+        value = _load(key, compute, persist, now)
+    except BaseException as e:
+        pending.set_exception(e)
+        raise
+    else:
+        pending.set_result(value)
+    finally:
+        with _cache_lock:
+            del _inflight[key]
+    return value
+
+
+def _load(key: tuple, compute, persist: bool, now: float):
+    disk = _result_cache if persist else None
+    if disk is not None:
+        path = disk.path(key)
+        found = disk.get(path, CACHE_MAX_AGE.get(key[0].split()[0], SEARCH_CACHE_TTL))
+        if found is not None:
+            value, age = found
+            metrics.incr("search_cache", source=key[0], result="hit", tier="disk")
+            _remember(key, now + SEARCH_CACHE_TTL - age, value)
+            return value
+
+    with _cache_lock:
+        _cache_stats["misses"] += 1
+    metrics.incr("search_cache", source=key[0], result="miss")
+    value = compute()
+    if disk is not None:
+        try:
+            disk.put(path, value)
+        except OSError as e:
+            logger.warning(f"Could not write {key[0]} result to the disk cache: {e}")
+    # a result kept nowhere else (the X snapshot) stays in memory whatever its size
+    _remember(key, now + SEARCH_CACHE_TTL, value, oversize_ok=disk is None)
+    return value
+
+
+def _remember(key: tuple, expires: float, value, oversize_ok: bool = False):
+    global _cache_bytes
+    size = frame_bytes(value)
+    with _cache_lock:
+        if key in _cache:
+            _forget(key, None)
+        if size > SEARCH_CACHE_MAX_ENTRY_BYTES and not oversize_ok:
+            _cache_stats["rejected"] += 1
+            metrics.incr("search_cache_rejected", source=key[0])
+            logger.info(f"Not keeping {key[0]} result in memory: {size / (1024 * 1024):.0f} MB")
+            return
+        _cache[key] = (expires, value, size)
+        _cache_bytes += size
+        # the newest result stays, even alone over the budget
+        while len(_cache) > 1 and (len(_cache) > SEARCH_CACHE_MAX_ENTRIES or _cache_bytes > SEARCH_CACHE_MAX_BYTES):
+            _forget(next(iter(_cache)), "evicted")
+    metrics.incr("search_cache_bytes", size, change="stored")
+
+
+def _forget(key: tuple, reason: Optional[str]):
+    # caller holds _cache_lock
+    global _cache_bytes
+    _, _, size = _cache.pop(key)
+    _cache_bytes -= size
+    metrics.incr("search_cache_bytes", size, change="freed")
+    if reason is not None:
+        _cache_stats[reason] += 1
+        metrics.incr(f"search_cache_{reason}", source=key[0])
+
+
+def frame_bytes(value) -> int:
+    # the frame's real footprint, strings and categories included
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(value)
+
+
+def cache_stats() -> dict:
+    with _cache_lock:
+        counts = dict(_cache_stats)
+        counts.update(entries=len(_cache), bytes=_cache_bytes, max_bytes=SEARCH_CACHE_MAX_BYTES)
+    for what in ("hits", "misses", "evicted", "expired", "rejected"):
+        counts.setdefault(what, 0)
+    return counts
+
+
+def clear_cache(platform: Optional[str] = None, disk: bool = True):
+    # disk=True also retires the platform's results on disk, for every process
+    with _cache_lock:
+        for key in [k for k in _cache if platform is None or k[0] == platform or k[0].startswith(f"{platform} ")]:
+            _forget(key, None)
+    with _source_versions_lock:
+        # the next search looks the data version up again
+        for name in [platform] if platform else list(_source_versions):
+            _source_versions.pop(name, None)
+    if disk and _result_cache is not None:
+        for name in [platform] if platform else PLATFORMS:
+            _result_cache.invalidate(name)
+
+
+def search(platform: str, keyword: str, geography: str = "", filters=None) -> pd.DataFrame:
+    # results are shared between callers through the cache; treat them as read-only.
+    # filters: SearchFilters (or a dict of its fields) to narrow the search at the source
+    if platform not in PLATFORM_SEARCHES:
+        raise ValueError(f"Unknown platform: {platform}")
+    keyword, geography = normalize_query(keyword, geography)
+    filters = normalize_filters(filters)
+    if filters is None:
+        return _cached((platform, keyword, geography), lambda: _fetch(platform, keyword, geography))
+    return _cached((platform, keyword, geography, *filters), lambda: _fetch(platform, keyword, geography, filters))
+
+
+def normalize_filters(filters) -> Optional[SearchFilters]:
+    # None when nothing narrows the search, so it shares the unfiltered cache entry
+    if not filters:
+        return None
+    if isinstance(filters, dict):
+        filters = SearchFilters(**filters)
+    min_spend = float(filters.min_spend) if filters.min_spend else None
+    max_spend = float(filters.max_spend) if filters.max_spend is not None else None
+    advertisers = tuple(sorted({str(a) for a in filters.advertisers or ()}))
+    since, until = _as_date(filters.since), _as_date(filters.until)
+    countries = tuple(sorted(normalize_countries(filters.countries)))
+    if (min_spend is None and max_spend is None and not advertisers and since is None and until is None
+            and not countries):
+        return None
+    return SearchFilters(min_spend, max_spend, advertisers, since, until, countries)
+
+
+def _as_date(value) -> Optional[date]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value.date() if hasattr(value, "date") else value
+
+
+def apply_filters(df: pd.DataFrame, filters: Optional[SearchFilters]) -> pd.DataFrame:
+    # the rows the app's filter widgets keep (filter_engine.FilterIndex.select)
+    if filters is None or df.empty:
+        return df
+    keep = np.ones(len(df), dtype=bool)
+    if filters.min_spend is not None or filters.max_spend is not None:
+        spend = pd.to_numeric(df["Spend"], errors="coerce").fillna(0).to_numpy(dtype="float64")
+        if filters.min_spend is not None:
+            keep &= spend >= filters.min_spend
+        if filters.max_spend is not None:
+            keep &= spend <= filters.max_spend
+    if filters.advertisers:
+        keep &= df["Advertiser Name"].isin(filters.advertisers).to_numpy()
+    # unknown dates don't exclude an ad, as in the BigQuery predicate
+    if filters.since is not None:
+        ends = df["End Date"]
+        keep &= (ends.isna() | (ends >= pd.Timestamp(filters.since))).to_numpy()
+    if filters.until is not None:
+        starts = df["Start Date"]
+        keep &= (starts.isna() | (starts < pd.Timestamp(filters.until + timedelta(days=1)))).to_numpy()
+    return df if keep.all() else df[keep]
+
+
+def recent_ads(platform: str, since: date) -> pd.DataFrame:
+    # shared through the cache like search(); treat as read-only
+    return _cached((f"{platform} recent", since.isoformat()), lambda: _fetch_recent(platform, since))
+
+
+def _fetch_recent(platform: str, since: date) -> pd.DataFrame:
+    df = RECENT_ADS[platform](since)
+    _fetched(platform, df)
+    return df
+
+
+def _fetch(platform: str, keyword: str, geography: str, filters: Optional[SearchFilters] = None) -> pd.DataFrame:
+    if filters is None:
+        df = PLATFORM_SEARCHES[platform](keyword, geography)
+    else:
+        df = apply_filters(PLATFORM_SEARCHES[platform](keyword, geography, filters=filters), filters)
+    _fetched(platform, df)
+    return df
+
+
+def on_fetch(listener):
+    if listener not in _fetch_listeners:
+        _fetch_listeners.append(listener)
+
+
+def _fetched(platform: str, df: pd.DataFrame):
+    metrics.incr("rows_fetched", len(df), platform=platform)
+    for listener in list(_fetch_listeners):
+        # the search itself succeeded; a listener failing must not lose its result
+        try:
+            listener(platform, df)
+        except Exception as e:
+            logger.error(f"{platform} fetch listener failed: {e}")
+
+
+def search_all(keyword: str, geography: str = "", platforms: Optional[list] = None, max_workers: int = 3) -> pd.DataFrame:
+    frames = []
+    for _, _, df, error in search_many([{"keyword": keyword, "geography": geography, "platforms": platforms}], max_workers):
+        if error is not None:
+            raise error
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else empty_ads()
+
+
+def search_many(queries: list, max_workers: int = 8):
+    # yields (query index, platform, frame, error) as each platform search finishes
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ad-search") as pool:
+        futures = {}
+        for i, query in enumerate(queries):
+            for platform in query.get("platforms") or PLATFORMS:
+                future = pool.submit(
+                    search, platform, query.get("keyword", ""), query.get("geography", ""), query.get("filters"),
+                )
+                futures[future] = (i, platform)
+
+        for future in as_completed(futures):
+            i, platform = futures[future]
+            try:
+                yield i, platform, future.result(), None
+            except Exception as e:
+                logger.error(f"{platform} search failed for query {i} {queries[i]}: {e}")
+                yield i, platform, None, e
+
+
+def read_queries(path: Path) -> list:
+    queries = []
+    if path.suffix == ".jsonl":
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    queries.append(_parse_query(json.loads(line)))
+    else:
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                queries.append(_parse_query(row))
+    return queries
+
+
+def _parse_query(raw: dict) -> dict:
+    platforms = raw.get("platforms") or PLATFORMS
+    if isinstance(platforms, str):
+        platforms = [p.strip() for p in platforms.split(",") if p.strip()]
+    advertisers = raw.get("advertisers") or ()
+    if isinstance(advertisers, str):
+        advertisers = [a.strip() for a in advertisers.split("|") if a.strip()]
+    return {
+        "keyword": raw.get("keyword") or "",
+        "geography": raw.get("geography") or "",
+        "platforms": platforms,
+        "filters": normalize_filters(SearchFilters(
+            min_spend=raw.get("min_spend") or None,
+            max_spend=raw.get("max_spend") if raw.get("max_spend") not in (None, "") else None,
+            advertisers=advertisers,
+            since=raw.get("since") or None,
+            until=raw.get("until") or None,
+            countries=raw.get("countries") or (),
+        )),
+    }
+
+
+class ResultWriter:
+    # streams query results into a single Parquet, Arrow IPC or CSV file as they arrive
+
+    def __init__(self, path: Path, fmt: str):
+        import pyarrow as pa
+
+        self.path = path
+        self.fmt = fmt
+        self.schema = pa.schema(
+            [("Query", pa.int64()), ("Query Keyword", pa.string()), ("Query Geography", pa.string())]
+            + list(arrow_schema())
+        )
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        elif fmt == "arrow":
+            self._writer = pa.ipc.new_file(str(path), self.schema)
+        elif fmt == "csv":
+            import pyarrow.csv as pacsv
+            self._writer = pacsv.CSVWriter(str(path), self.schema)
+        else:
+            raise ValueError(f"Unknown output format: {fmt}")
+        self.rows = 0
+
+    def write(self, df: pd.DataFrame, i: int, query: dict):
+        import pyarrow as pa
+
+        if df.empty:
+            return
+        table = to_arrow(df)
+        n = len(df)
+        table = table.add_column(0, "Query", pa.array([i] * n, type=pa.int64()))
+        table = table.add_column(1, "Query Keyword", pa.array([query["keyword"]] * n, type=pa.string()))
+        table = table.add_column(2, "Query Geography", pa.array([query["geography"]] * n, type=pa.string()))
+        self._writer.write_table(table)
+        self.rows += n
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _output_format(path: Path, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow", ".csv": "csv"}.get(path.suffix, "parquet")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search Google, Meta and X political ads without the Streamlit app.")
+    parser.add_argument("--keyword", default="", help="advertiser keyword")
+    parser.add_argument("--geography", default="", help="state or region name or abbreviation")
+    parser.add_argument("--countries", default="", help=f"comma-separated ISO country codes "
+                                                        f"(Meta default: {','.join(META_COUNTRIES)})")
+    parser.add_argument("--platforms", default=",".join(PLATFORMS), help="comma-separated platforms")
+    parser.add_argument("--min-spend", type=float, help="only ads with at least this spend (USD)")
+    parser.add_argument("--max-spend", type=float, help="only ads with at most this spend (USD)")
+    parser.add_argument("--advertiser", action="append", default=[], help="exact advertiser name (repeatable)")
+    parser.add_argument("--since", type=date.fromisoformat, help="only ads delivering on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, help="only ads delivering on or before this date (YYYY-MM-DD)")
+    parser.add_argument("--batch", type=Path, help="CSV or JSONL file of queries (keyword, geography, platforms, "
+                                                   "min_spend, max_spend, advertisers, since, until, countries)")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent platform searches")
+    parser.add_argument("--output", "-o", type=Path, required=True, help="output file (.parquet, .arrow or .csv)")
+    parser.add_argument("--format", choices=["parquet", "arrow", "csv"], help="output format (default: from extension)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.batch:
+        queries = read_queries(args.batch)
+    else:
+        if not (args.keyword or args.geography):
+            parser.error("give --keyword/--geography or --batch")
+        queries = [_parse_query({
+            "keyword": args.keyword, "geography": args.geography, "platforms": args.platforms,
+            "min_spend": args.min_spend, "max_spend": args.max_spend, "advertisers": args.advertiser,
+            "since": args.since, "until": args.until, "countries": args.countries,
+        })]
+
+    started = time.perf_counter()
+    failures = 0
+    with ResultWriter(args.output, _output_format(args.output, args.format)) as writer:
+        for i, platform, df, error in search_many(queries, args.workers):
+            if error is not None:
+                failures += 1
+                continue
+            writer.write(df, i, queries[i])
+
+    logger.info(
+        f"{len(queries)} quer{'y' if len(queries) == 1 else 'ies'}, {writer.rows} rows, "
+        f"{failures} failed searches in {time.perf_counter() - started:.1f}s -> {args.output}"
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Advertiser names from every platform, for type-ahead in the search boxes and for turning a
+# chosen name into exact ids. Rebuilt in the background once older than the refresh interval.
+ADVERTISER_INDEX_REFRESH = int(os.environ.get("ADVERTISER_INDEX_REFRESH", 6 * 3600))
+SUGGESTION_LIMIT = 8
+# prefix matches ranked per lookup; a short prefix like "for" would otherwise rank thousands
+PREFIX_SCAN = 1000
+# share of the typed text's trigrams a fuzzy suggestion must contain
+FUZZY_MIN_SIMILARITY = 0.3
+
+_index = None
+_built_at = 0.0
+_build_lock = threading.Lock()
+_building = None
+
+
+class AdvertiserIndex:
+    # Prefix lookup over each name and each of its words (a sorted list and bisect), and
+    # fuzzy lookup by shared character trigrams (a posting list per trigram).
+
+    def __init__(self, entries):
+        # entries: (name, platform, id); one name may have ids on several platforms
+        ids = defaultdict(lambda: defaultdict(set))
+        for name, platform, ident in entries:
+            name = name.strip() if isinstance(name, str) else ""
+            if name:
+                ids[name][platform].add(str(ident))
+        self.names = sorted(ids)
+        self._ids = [{platform: sorted(found) for platform, found in ids[name].items()} for name in self.names]
+        self._positions = {name: i for i, name in enumerate(self.names)}
+
+        prefixes = set()
+        postings = defaultdict(list)
+        for i, name in enumerate(self.names):
+            lower = name.lower()
+            prefixes.add((lower, i))
+            for word in lower.split()[1:]:
+                prefixes.add((word, i))
+            for gram in _trigrams(lower):
+                postings[gram].append(i)
+        self._prefixes = sorted(prefixes)
+        self._prefix_keys = [key for key, _ in self._prefixes]
+        self._postings = {gram: np.array(found, dtype=np.int32) for gram, found in postings.items()}
+        self._gram_counts = np.array([len(_trigrams(name.lower())) for name in self.names], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    def suggest(self, text: str, limit: int = SUGGESTION_LIMIT) -> list:
+        # names starting with the text (or with a word starting with it) first, shortest first,
+        # then the closest spellings
+        text = " ".join(text.lower().split())
+        if not text:
+            return []
+        start = bisect.bisect_left(self._prefix_keys, text)
+        found = []
+        for key, i in self._prefixes[start:start + PREFIX_SCAN]:
+            if not key.startswith(text):
+                break
+            found.append(i)
+        picked = sorted(set(found), key=lambda i: (len(self.names[i]), self.names[i]))[:limit]
+        if len(picked) < limit:
+            picked += [i for i in self._fuzzy(text, limit * 2) if i not in picked][:limit - len(picked)]
+        return [self.names[i] for i in picked]
+
+    def resolve(self, name: str) -> dict:
+        # platform -> exact ids for a name from suggest(); {} for an unknown name
+        i = self._positions.get(name)
+        return dict(self._ids[i]) if i is not None else {}
+
+    def _fuzzy(self, text: str, limit: int) -> list:
+        grams = _trigrams(text)
+        lists = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not lists:
+            return []
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.names))
+        # how much of the typed text a name covers, then how little else it has
+        coverage = shared / len(grams)
+        best = np.flatnonzero(coverage >= FUZZY_MIN_SIMILARITY)
+        overlap = shared[best] / (len(grams) + self._gram_counts[best] - shared[best])
+        best = best[np.lexsort((-overlap, -coverage[best]))][:limit]
+        return best.tolist()
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def build_index() -> AdvertiserIndex:
+    # Google's advertiser table, the X screen names in the current file and the Meta pages
+    # seen in results; a source that fails (no credentials, say) is left out
+    import ad_search
+
+    entries = []
+    try:
+        google = ad_search.google_advertisers()
+        entries += zip(google["advertiser_name"], ["Google"] * len(google), google["advertiser_id"])
+    except Exception as e:
+        logger.warning(f"Advertiser index: no Google advertisers ({e})")
+    try:
+        names = ad_search.x_snapshot()["Advertiser Name"].dropna().unique()
+        entries += ((name, "X", name) for name in names)
+    except Exception as e:
+        logger.warning(f"Advertiser index: no X advertisers ({e})")
+    for name, page_ids in ad_search.meta_pages().items():
+        entries += ((name, "Meta", page_id) for page_id in page_ids)
+
+    started = time.perf_counter()
+    index = AdvertiserIndex(entries)
+    logger.info(f"Advertiser index: {len(index):,} names in {time.perf_counter() - started:.2f}s")
+    return index
+
+
+def advertiser_index(wait: bool = False):
+    # the current index, refreshed in the background when stale. Until the first build
+    # finishes this is None, unless wait=True.
+    global _building
+    with _build_lock:
+        stale = _index is None or time.monotonic() - _built_at > ADVERTISER_INDEX_REFRESH
+        if stale and _building is None:
+            _building = threading.Thread(target=_rebuild, name="advertiser-index", daemon=True)
+            _building.start()
+        building = _building
+    if _index is None and wait and building is not None:
+        building.join()
+    return _index
+
+
+def _rebuild():
+    global _index, _built_at, _building
+    try:
+        index = build_index()
+        with _build_lock:
+            _index, _built_at = index, time.monotonic()
+    except Exception as e:
+        logger.error(f"Advertiser index build failed: {e}")
+    finally:
+        with _build_lock:
+            _building = None
+
+
+def suggest(text: str, limit: int = SUGGESTION_LIMIT) -> list:
+    index = advertiser_index()
+    return index.suggest(text, limit) if index is not None else []
+
+
+def resolve(name: str) -> dict:
+    index = advertiser_index()
+    return index.resolve(name) if index is not None else {}
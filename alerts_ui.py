@@ -5,6 +5,7 @@ from subscription_manager import (
     get_subscriptions_for_email,
     is_sheets_configured,
     remove_subscription,
+    set_sheets_config_from_app,
 )
 
 
@@ -12,7 +13,23 @@ def is_valid_email(email: str) -> bool:
     return bool(re.match(r"^[^@\s]+@[^@\s]+\.[^@\s]+$", email))
 
 
+def _parse_countries(text: str):
+    # None when the text isn't a list of country codes
+    from regions import normalize_countries
+
+    try:
+        return normalize_countries(text)
+    except ValueError:
+        return None
+
+
 def show_alerts_ui():
+    if st.secrets:
+        set_sheets_config_from_app(
+            st.secrets.get("spreadsheet_id"),
+            st.secrets.get("gcp_service_account"),
+        )
+
     st.markdown("---")
     st.markdown("## Email Alerts")
 
@@ -30,9 +47,13 @@ def show_alerts_ui():
             )
         with col2:
             alert_geo = st.text_input(
-                "Geography (state name or abbreviation)",
+                "Geography (state or region name, or abbreviation)",
                 key="alert_geo",
             )
+            alert_countries = st.text_input(
+                "Countries (ISO codes, e.g. US, CA; blank for US)",
+                key="alert_countries",
+            )
             alert_platforms = st.multiselect(
                 "Platforms to monitor",
                 ["Google", "Meta", "X"],
@@ -47,12 +68,15 @@ def show_alerts_ui():
                 st.error("Please specify at least an advertiser keyword or a geography.")
             elif not alert_platforms:
                 st.error("Please select at least one platform.")
+            elif (countries := _parse_countries(alert_countries)) is None:
+                st.error("Please enter countries as two-letter ISO codes, separated by commas.")
             else:
                 sub_id = add_subscription(
                     email=alert_email,
                     advertiser_keyword=alert_advertiser,
                     geography=alert_geo,
                     platforms=alert_platforms,
+                    countries=list(countries),
                 )
                 if sub_id:
                     st.success(
@@ -83,6 +107,8 @@ def show_alerts_ui():
                             if sub.get("geography"):
                                 parts.append(f"**Geography:** {sub['geography']}")
                             parts.append(f"**Platforms:** {', '.join(sub.get('platforms', []))}")
+                            if sub.get("countries"):
+                                parts.append(f"**Countries:** {', '.join(sub['countries'])}")
                             if sub.get("last_notified_at"):
                                 parts.append(f"**Last notified:** {sub['last_notified_at'][:19]}")
                             st.markdown(" · ".join(parts))
@@ -0,0 +1,387 @@
+import argparse
+import contextlib
+import gc
+import json
+import logging
+import multiprocessing
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from benchmarks.run import Fixtures, _peak_rss_mb, _rss_mb, _wire
+from benchmarks.workloads import Workload
+
+APP_SCRIPT = str(Path(__file__).resolve().parent.parent / "streamlit_app.py")
+SECRETS = {"meta_access_token": "bench-token", "gcp_service_account": {"type": "bench"}}
+PREFIXES = ("google", "meta", "x")
+# the order a report lists interactions in; each is one rerun except download, which is the
+# deferred export a click runs
+INTERACTIONS = ("open", "search_mode", "search", "filter_spend", "filter_advertiser", "sort", "page", "download")
+PERCENTILES = (50, 90, 99)
+
+_session = threading.local()
+
+
+class _SessionRuntime:
+    # AppTest swaps Runtime._instance, st.secrets and a config patch around every run, which is
+    # fine for one test at a time but lets concurrent runs undo each other's. install() sets
+    # them once for every session, with one shared runtime as a server process has. Each
+    # session gets an id of its own, so it keeps its own download buttons in the media file
+    # manager, and all of them share one compiled script: AppTest compiles it on every run,
+    # and concurrent compiles can fail on Python 3.11.
+
+    def __init__(self):
+        from unittest.mock import MagicMock
+
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+        from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+        from streamlit.runtime.media_file_manager import MediaFileManager
+        from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+        from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+        self.runtime = MagicMock(spec=Runtime)
+        self.runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+        self.runtime.dataframe_source_mgr = DataframeSourceManager()
+        self.runtime.cache_storage_manager = MemoryCacheStorageManager()
+        self.media = self.runtime.media_file_mgr
+        self.script_cache = ScriptCache()
+
+    def install(self, log_level: str):
+        import streamlit as st
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.secrets import Secrets
+        from streamlit.testing.v1 import app_test
+        import streamlit.logger
+        from streamlit.testing.v1.util import patch_config_options
+
+        class SessionRuntime(Runtime):
+            # what AppTest assigns per run lands here instead of on the real singleton
+            _instance = None
+
+        script_cache = self.script_cache
+
+        class SessionScriptRunner(app_test.LocalScriptRunner):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self._session_id = _session.id
+                self._script_cache = script_cache
+
+        Runtime._instance = self.runtime
+        self.runtime.bidi_component_registry = _bidi_registry()
+        app_test.Runtime = SessionRuntime
+        app_test.LocalScriptRunner = SessionScriptRunner
+        # AppTest only swaps secrets in when a test brings its own
+        secrets = Secrets()
+        secrets._secrets = dict(SECRETS)
+        st.secrets = secrets
+        self._config = patch_config_options({"global.appTest": True, "logger.level": log_level.lower()})
+        self._config.__enter__()
+        app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+        # the app's own deprecation warnings would otherwise print on every rerun
+        streamlit.logger.set_log_level(log_level)
+
+    def rerun_finished(self):
+        # what a server does when a session's run ends: drop files no session shows any more
+        self.media.remove_orphaned_files()
+
+    def session_closed(self, session_id: str):
+        self.media.clear_session_refs(session_id)
+        self.media.remove_orphaned_files()
+
+
+def _bidi_registry():
+    from streamlit.components.v2.component_manager import BidiComponentManager
+
+    manager = BidiComponentManager()
+    manager.discover_and_register_components(start_file_watching=False)
+    return manager
+
+
+class Journey:
+    # one user's visit: open the app, search every platform, narrow one platform's results,
+    # sort and page through them, then download the filtered export
+
+    def __init__(self, runtime: _SessionRuntime, record, query: dict, seed: float, options):
+        self.runtime = runtime
+        self.record = record
+        self.query = query
+        self.rng = random.Random(seed)
+        self.options = options
+        # exceptions fail the run; error messages the app shows (a failed fetch) are only counted
+        self.errors = []
+        self.shown_errors = []
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(APP_SCRIPT, default_timeout=self.options.timeout)
+        self.rerun("open", at)
+        at.toggle(key="search_all").set_value(True)
+        self.rerun("search_mode", at)
+        at.text_input(key="all_advertiser").set_value(self.query["keyword"])
+        at.text_input(key="all_geo").set_value(self.query["geography"])
+        self.rerun("search", at)
+
+        shown = [p for p in PREFIXES if _has(at.number_input, f"{p}_min_spend")]
+        if not shown:
+            return
+        prefix = self.rng.choice(shown)
+        floor = at.number_input(key=f"{prefix}_max_spend").value * self.rng.choice((0.0, 0.01, 0.05))
+        at.number_input(key=f"{prefix}_min_spend").set_value(floor)
+        self.rerun("filter_spend", at)
+        if not _has(at.multiselect, f"{prefix}_adv_sel"):
+            return
+        options = at.multiselect(key=f"{prefix}_adv_sel").options
+        if options and self.rng.random() < 0.5:
+            at.multiselect(key=f"{prefix}_adv_sel").set_value(self.rng.sample(options, min(len(options), 3)))
+            self.rerun("filter_advertiser", at)
+        if not _has(at.selectbox, f"{prefix}_sort_col"):
+            return
+        columns = at.selectbox(key=f"{prefix}_sort_col").options
+        at.selectbox(key=f"{prefix}_sort_col").set_value(self.rng.choice(columns[1:]))
+        self.rerun("sort", at)
+        page = at.number_input(key=f"{prefix}_page")
+        if page.max and page.max > 1:
+            page.set_value(2)
+            self.rerun("page", at)
+        if _has(at.download_button, f"{prefix}_download_filtered"):
+            self.download(at.download_button(key=f"{prefix}_download_filtered").proto.deferred_file_id)
+
+    def rerun(self, interaction: str, at):
+        self.think()
+        started = time.perf_counter()
+        at.run()
+        self.record(interaction, time.perf_counter() - started)
+        self.runtime.rerun_finished()
+        self.errors += [f"{interaction}: {e.value}" for e in at.exception]
+        self.shown_errors += [f"{interaction}: {e.value}" for e in at.error]
+
+    def download(self, file_id: str):
+        self.think()
+        started = time.perf_counter()
+        self.runtime.media.execute_deferred(file_id)
+        self.record("download", time.perf_counter() - started)
+
+    def think(self):
+        if self.options.think_ms:
+            time.sleep(self.rng.uniform(0.5, 1.5) * self.options.think_ms / 1000)
+
+
+def _has(widgets, key: str) -> bool:
+    try:
+        widgets(key=key)
+    except KeyError:
+        return False
+    return True
+
+
+def _percentile(values: list, p: float) -> float:
+    # nearest rank; the samples are already sorted
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def _cpu_seconds() -> float:
+    # the whole process: every session, its searches and the BigQuery fake; the Graph API and
+    # X servers run in the fixtures process
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_load(sessions: int, options) -> dict:
+    import rollups
+
+    options.result_cache_dir = tempfile.mkdtemp(prefix="ad_tracker_app_load_")
+    started = time.perf_counter()
+    workload = Workload(ads=options.ads, subscriptions=options.subscriptions, seed=options.seed)
+    queries = []
+    for sub in workload.subscriptions().values():
+        query = {"keyword": sub["advertiser_keyword"], "geography": sub["geography"]}
+        if query not in queries:
+            queries.append(query)
+
+    fixtures = Fixtures(workload, options)
+    try:
+        # the app tracks rollups in the background; pointing it at the run's store first
+        # keeps _wire from adding a second, synchronous listener for the same file
+        rollups.ROLLUP_DB = str(Path(options.result_cache_dir) / "rollups.sqlite")
+        rollups.track(background=True)
+        _wire(workload, fixtures, options)
+        logging.getLogger().setLevel(options.log_level)
+        runtime = _SessionRuntime()
+        runtime.install(options.log_level)
+        setup_seconds = time.perf_counter() - started
+
+        samples = defaultdict(list)
+        lock = threading.Lock()
+
+        def record(interaction, seconds):
+            with lock:
+                samples[interaction].append(seconds)
+
+        rng = random.Random(options.seed)
+        waves, errors, shown_errors = [], [], []
+        for wave in range(options.waves):
+            journeys = [Journey(runtime, record, rng.choice(queries), rng.random(), options) for _ in range(sessions)]
+
+            def visit(number):
+                _session.id = f"wave{wave}-session{number}"
+                try:
+                    journeys[number].run()
+                except Exception as e:
+                    journeys[number].errors.append(f"{type(e).__name__}: {e}")
+                finally:
+                    runtime.session_closed(_session.id)
+
+            gc.collect()
+            rss_before, cpu_before, wave_started = _rss_mb(), _cpu_seconds(), time.perf_counter()
+            with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="session") as pool:
+                list(pool.map(visit, range(sessions)))
+            wall = time.perf_counter() - wave_started
+            cpu = _cpu_seconds() - cpu_before
+            errors += [e for journey in journeys for e in journey.errors]
+            shown_errors += [e for journey in journeys for e in journey.shown_errors]
+            del journeys[:]
+            gc.collect()
+            waves.append({
+                "wave": wave + 1,
+                "wall_seconds": round(wall, 3),
+                "cpu_seconds": round(cpu, 3),
+                "rss_before_mb": round(rss_before, 1),
+                "rss_after_mb": round(_rss_mb(), 1),
+            })
+    finally:
+        fixtures.close()
+        shutil.rmtree(options.result_cache_dir, ignore_errors=True)
+
+    interactions = {}
+    for name in INTERACTIONS:
+        values = sorted(samples.get(name, ()))
+        if values:
+            interactions[name] = {"count": len(values), "max_ms": round(values[-1] * 1000, 1),
+                                  **{f"p{p}_ms": round(_percentile(values, p) * 1000, 1) for p in PERCENTILES}}
+    wall = sum(w["wall_seconds"] for w in waves)
+    return {
+        "sessions": sessions,
+        "ads_per_platform": options.ads,
+        "setup_seconds": round(setup_seconds, 2),
+        "wall_seconds": round(wall, 3),
+        "interactions_per_second": round(sum(len(v) for v in samples.values()) / wall, 2) if wall else None,
+        "cpu_seconds": round(sum(w["cpu_seconds"] for w in waves), 3),
+        "rss_growth_mb": round(waves[-1]["rss_after_mb"] - waves[0]["rss_before_mb"], 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "waves": waves,
+        "interactions": interactions,
+        "errors": len(errors),
+        "error_samples": errors[:10],
+        "shown_errors": len(shown_errors),
+        "shown_error_samples": shown_errors[:5],
+    }
+
+
+def _load_process(queue, sessions, options):
+    try:
+        queue.put(run_load(sessions, options))
+    except BaseException as e:
+        queue.put({"sessions": sessions, "error": repr(e)})
+        raise
+
+
+def run_isolated(sessions: int, options) -> dict:
+    # a fresh interpreter per session count, so caches, imports and peak RSS start the same
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_load_process, args=(queue, sessions, options))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def print_result(result: dict, baseline: dict = None):
+    if "error" in result:
+        print(f"\n{result['sessions']} sessions: FAILED {result['error']}")
+        return
+    cpu_share = result["cpu_seconds"] / result["wall_seconds"] * 100 if result["wall_seconds"] else 0
+    print(f"\n{result['sessions']} sessions, {len(result['waves'])} waves — {result['wall_seconds']:.2f}s, "
+          f"{result['interactions_per_second']} interactions/s, CPU {result['cpu_seconds']:.2f}s ({cpu_share:.0f}%), "
+          f"RSS {result['waves'][0]['rss_before_mb']} → {result['waves'][-1]['rss_after_mb']} MB "
+          f"(peak {result['peak_rss_mb']} MB), {result['errors']} errors, {result['shown_errors']} shown")
+    before = _baseline_result(baseline, result["sessions"])
+    print(f"    {'interaction':<18} {'count':>6} " + " ".join(f"{f'p{p}':>9}" for p in PERCENTILES) + f" {'max':>9}")
+    for name, stats in result["interactions"].items():
+        line = f"    {name:<18} {stats['count']:>6,} " + " ".join(
+            f"{stats[f'p{p}_ms']:>7.0f}ms" for p in PERCENTILES) + f" {stats['max_ms']:>7.0f}ms"
+        old = (before or {}).get("interactions", {}).get(name)
+        if old and old["p90_ms"]:
+            line += f"  (p90 {(stats['p90_ms'] - old['p90_ms']) / old['p90_ms'] * 100:+.1f}% vs baseline)"
+        print(line)
+    for wave in result["waves"]:
+        print(f"    wave {wave['wave']}: {wave['wall_seconds']:.2f}s, CPU {wave['cpu_seconds']:.2f}s, "
+              f"RSS {wave['rss_before_mb']} → {wave['rss_after_mb']} MB")
+    for sample in result["error_samples"]:
+        print(f"    error: {sample}")
+    for sample in result["shown_error_samples"]:
+        print(f"    shown: {sample[:200]}")
+    sys.stdout.flush()
+
+
+def _baseline_result(baseline: dict, sessions: int):
+    if not baseline:
+        return None
+    for result in baseline.get("results", []):
+        if result.get("sessions") == sessions and "error" not in result:
+            return result
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit app with concurrent simulated sessions "
+                                                 "against local fakes.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16],
+                        help="concurrent sessions; each count runs in a fresh process (default: 1 4 16)")
+    parser.add_argument("--waves", type=int, default=3, help="rounds of fresh sessions per count; RSS is "
+                                                              "recorded around each to show growth")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause before each interaction")
+    parser.add_argument("--ads", type=int, default=100_000, help="ads per platform")
+    parser.add_argument("--subscriptions", type=int, default=200, help="subscriptions the search terms come from")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds a single rerun may take")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per fake API call")
+    parser.add_argument("--meta-error-rate", type=float, default=0.01, help="share of Graph requests that return 613")
+    parser.add_argument("--meta-error-status", type=int, default=400, help="HTTP status of the 613 responses")
+    parser.add_argument("--x-available-days", type=int, nargs="+", default=[1],
+                        help="days ago for which an X ZIP exists")
+    parser.add_argument("--real-delays", action="store_true", help="keep the Meta page delay and 613 back-off")
+    parser.add_argument("--log-level", default="CRITICAL", help="log level of the app and the code under test")
+    parser.add_argument("--output", "-o", type=Path, help="write the JSON report here")
+    parser.add_argument("--baseline", type=Path, help="earlier JSON report to compare p90 latencies against")
+    options = parser.parse_args(argv)
+    if min(options.sessions) < 1 or options.waves < 1:
+        parser.error("--sessions and --waves must be at least 1")
+
+    baseline = json.loads(options.baseline.read_text()) if options.baseline else None
+    results = []
+    for sessions in options.sessions:
+        result = run_isolated(sessions, options)
+        print_result(result, baseline)
+        results.append(result)
+
+    if options.output:
+        report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "options": {
+            k: (str(v) if isinstance(v, Path) else v) for k, v in vars(options).items()
+        }, "results": results}
+        options.output.write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {options.output}")
+    return 1 if any("error" in r or r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,522 @@
+import gzip
+import json
+import os
+import re
+import socket
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.workloads import AGE_BUCKETS, GENDERS, META_BUCKETS, STATE_NAMES, Workload
+
+# column aliases selected by ad_search.search_google
+GOOGLE_SELECT = {
+    "advertiser_name": "screen_name",
+    "ad_id": "tweet_id",
+    "ad_url": "tweet_url",
+    "date_range_start": "day_of_start_date_adgroup",
+    "date_range_end": "day_of_end_date_adgroup",
+    "ad_type": "targeting_name",
+    "geo_targeting_included": "geo_targeting",
+    "gender_targeting": "gender_targeting",
+    "age_targeting": "age_targeting",
+    "impressions": "impressions",
+    "spend_range_min_usd": "spend_min_usd",
+    "spend_range_max_usd": "spend_max_usd",
+    "spend_usd": "spend_usd",
+}
+
+
+class FakeQueryJob:
+    def __init__(self, rows: list, total_bytes_processed: int):
+        self._rows = rows
+        self.total_bytes_processed = total_bytes_processed
+
+    def result(self):
+        return self._rows
+
+
+class FakeBigQueryClient:
+    # Answers the advertiser_stats/creative_stats joins from ad_search.search_google (advertiser
+    # LIKE, geography regex, regions and pushed-down filters), ad_search.recent_google (ads running since a date) and
+    # the advertiser list for ad_search.google_advertisers against synthetic tables. The tables never change, so
+    # get_table reports one last-modified time for ad_search.google_data_version.
+
+    def __init__(self, advertiser_stats: pd.DataFrame, creative_stats: pd.DataFrame, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.modified = datetime.now(timezone.utc)
+        self._lock = threading.Lock()
+        self.advertiser_ids = advertiser_stats["advertiser_id"].to_numpy()
+        self.advertiser_names = advertiser_stats["advertiser_name"].to_numpy()
+        self._lower_names = pd.Series(self.advertiser_names).str.lower()
+        creatives = creative_stats.copy()
+        creatives["spend_usd"] = (creatives["spend_range_min_usd"] + creatives["spend_range_max_usd"]) / 2
+        self.creatives = creatives
+        self._by_advertiser = creatives.groupby("advertiser_id").indices
+        # BigQuery bills the columns scanned, not the rows returned; without pushdown that is every row
+        self.scan_bytes = int(advertiser_stats.memory_usage(deep=True).sum() + creatives.memory_usage(deep=True).sum())
+
+    def get_table(self, table: str):
+        return SimpleNamespace(table_id=table.rsplit(".", 1)[-1], modified=self.modified)
+
+    def query(self, sql: str, job_config=None):
+        parameters = job_config.query_parameters if job_config is not None else []
+        params = {p.name: p.values if hasattr(p, "values") else p.value for p in parameters}
+        with self._lock:
+            self.calls["queries"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if not params:
+            # ad_search.google_advertisers: the whole advertiser table
+            with self._lock:
+                self.calls["rows"] += len(self.advertiser_ids)
+            rows = [{"advertiser_id": i, "advertiser_name": n} for i, n in zip(self.advertiser_ids, self.advertiser_names)]
+            return FakeQueryJob(rows, self.scan_bytes)
+        if "since" in params:
+            return self._recent(params["since"])
+
+        pattern = params["advertiser_name"].lower().strip("%")
+        matched = self._lower_names.str.contains(pattern, regex=False).to_numpy()
+        if params.get("advertisers"):
+            matched = matched & np.isin(self.advertiser_names, params["advertisers"])
+        if params.get("advertiser_ids"):
+            matched = matched & np.isin(self.advertiser_ids, params["advertiser_ids"])
+        matched = np.flatnonzero(matched)
+        geography = params.get("geography") or ""
+        countries = params.get("countries") or []
+        min_spend, max_spend = params.get("min_spend"), params.get("max_spend")
+        window_start, window_end = params.get("window_start"), params.get("window_end")
+
+        frames = []
+        for i in matched:
+            positions = self._by_advertiser.get(self.advertiser_ids[i])
+            creatives = self.creatives.iloc[positions] if positions is not None else self.creatives.iloc[:0]
+            if geography:
+                creatives = creatives[creatives["geo_targeting_included"].str.contains(geography, case=False, regex=True)]
+            if countries:
+                creatives = creatives[creatives["regions"].str.contains(rf"(?:^|,)\s*(?:{'|'.join(countries)})\s*(?:,|$)")]
+            if creatives.empty:
+                # LEFT JOIN keeps advertisers without creatives as a row of nulls
+                creatives = pd.DataFrame([{col: None for col in creatives.columns}])
+            # the pushed-down filters run after the join
+            if min_spend is not None:
+                creatives = creatives[creatives["spend_usd"].fillna(0) >= min_spend]
+            if max_spend is not None:
+                creatives = creatives[creatives["spend_usd"].fillna(0) <= max_spend]
+            if window_start is not None:
+                ends = pd.to_datetime(creatives["date_range_end"])
+                creatives = creatives[ends.isna() | (ends >= pd.Timestamp(window_start))]
+            if window_end is not None:
+                starts = pd.to_datetime(creatives["date_range_start"])
+                creatives = creatives[starts.isna() | (starts <= pd.Timestamp(window_end))]
+            frames.append(creatives.assign(advertiser_name=self.advertiser_names[i]))
+
+        if not frames:
+            return FakeQueryJob([], self.scan_bytes)
+        return self._job(pd.concat(frames, ignore_index=True))
+
+    def _recent(self, since):
+        ends = pd.to_datetime(self.creatives["date_range_end"])
+        creatives = self.creatives[ends.isna() | (ends >= pd.Timestamp(since))]
+        names = dict(zip(self.advertiser_ids, self.advertiser_names))
+        return self._job(creatives.assign(advertiser_name=creatives["advertiser_id"].map(names)))
+
+    def _job(self, result: pd.DataFrame) -> FakeQueryJob:
+        result = result.sort_values("date_range_start", ascending=False, na_position="last")
+        result = result[list(GOOGLE_SELECT)].rename(columns=GOOGLE_SELECT)
+        with self._lock:
+            self.calls["rows"] += len(result)
+        return FakeQueryJob(result.astype(object).where(result.notna(), None).to_dict("records"), self.scan_bytes)
+
+
+class _FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler, latency: float):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, **counts):
+        with self.lock:
+            self.calls.update(counts)
+
+    def handle_error(self, request, client_address):
+        # clients probing with stream=True hang up without reading the body
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # one handler per accepted socket; keep-alive requests reuse it
+        super().setup()
+        self.server.count(connections=1)
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if content_type == "application/json" and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetaGraphServer(_FixtureServer):
+    # /ads_archive with cursor pagination; a seeded share of requests fail with
+    # the Graph API's rate-limit error (code 613). Every ad reaches the US; a quarter
+    # also reach Canada and another quarter the UK.
+
+    def __init__(self, ads: pd.DataFrame, error_rate: float = 0.0, error_status: int = 400,
+                 latency: float = 0.0, seed: int = 0):
+        super().__init__(_MetaHandler, latency)
+        self.ads = ads
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = np.random.default_rng(seed)
+        self._lower_pages = ads["page_name"].str.lower()
+        self._page_codes, self._page_names = pd.factorize(ads["page_name"])
+        self._matches = OrderedDict()
+        kind = np.arange(len(ads)) % 4
+        self._countries = {"US": np.ones(len(ads), dtype=bool), "CA": kind == 1, "GB": kind == 2}
+
+    def matching(self, term: str) -> np.ndarray:
+        with self.lock:
+            hit = self._matches.get(term)
+            if hit is not None:
+                return hit
+        hit = np.flatnonzero(self._lower_pages.str.contains(term.lower(), regex=False).to_numpy())
+        with self.lock:
+            self._matches[term] = hit
+            while len(self._matches) > 1024:
+                self._matches.popitem(last=False)
+        return hit
+
+    def delivering(self, positions: np.ndarray, since: str, until: str) -> np.ndarray:
+        ads = self.ads.iloc[positions]
+        keep = np.ones(len(positions), dtype=bool)
+        if since:
+            keep &= (ads["stop"].isna() | (ads["stop"] >= pd.Timestamp(since))).to_numpy()
+        if until:
+            keep &= (ads["start"] <= pd.Timestamp(until)).to_numpy()
+        return positions[keep]
+
+    def reaching(self, positions: np.ndarray, countries: list) -> np.ndarray:
+        keep = np.zeros(len(positions), dtype=bool)
+        for country in countries:
+            if country in self._countries:
+                keep |= self._countries[country][positions]
+        return positions[keep]
+
+    def page_id(self, page_name: str) -> str:
+        return str(100_000 + self._page_names.get_loc(page_name))
+
+    def rate_limited(self) -> bool:
+        with self.lock:
+            return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+    def render(self, positions: np.ndarray) -> list:
+        rows = self.ads.iloc[positions]
+        out = []
+        for ad in rows.itertuples(index=False):
+            regions = [STATE_NAMES[(ad.region + k) % len(STATE_NAMES)] for k in range(ad.region_count)]
+            share = f"{1 / len(regions):.2f}"
+            out.append({
+                "id": ad.id,
+                "page_id": self.page_id(ad.page_name),
+                "page_name": ad.page_name,
+                "ad_snapshot_url": f"https://www.facebook.com/ads/archive/render_ad/?id={ad.id}",
+                "ad_delivery_start_time": str(ad.start)[:10],
+                "ad_delivery_stop_time": str(ad.stop)[:10],
+                "spend": _meta_bucket(ad.spend),
+                "impressions": _meta_bucket(ad.impressions),
+                "delivery_by_region": [{"region": r, "percentage": share} for r in regions],
+                "demographic_distribution": [
+                    {"age": AGE_BUCKETS[ad.age], "gender": g, "percentage": "0.33"} for g in GENDERS
+                ],
+            })
+        return out
+
+
+def _meta_bucket(i: int) -> dict:
+    lo, hi = META_BUCKETS[i]
+    bucket = {"lower_bound": str(lo)}
+    if hi is not None:
+        bucket["upper_bound"] = str(hi)
+    return bucket
+
+
+class _MetaHandler(_QuietHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        server.count(requests=1)
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not url.path.endswith("/ads_archive"):
+            self.send_body(404, b'{"error": {"message": "Unknown path", "code": 803}}', "application/json")
+            return
+        if server.rate_limited():
+            server.count(rate_limited=1)
+            body = {"error": {
+                "message": "(#613) Calls to this api have exceeded the rate limit.",
+                "type": "OAuthException", "code": 613, "fbtrace_id": "bench",
+            }}
+            self.send_body(server.error_status, json.dumps(body).encode(), "application/json")
+            return
+
+        term = query.get("search_terms", "")
+        limit = int(query.get("limit", 25))
+        after = int(query.get("after", 0))
+        matches = server.matching(term)
+        if query.get("ad_reached_countries"):
+            matches = server.reaching(matches, json.loads(query["ad_reached_countries"]))
+        if query.get("ad_delivery_date_min") or query.get("ad_delivery_date_max"):
+            matches = server.delivering(matches, query.get("ad_delivery_date_min"), query.get("ad_delivery_date_max"))
+        if query.get("search_page_ids"):
+            pages = [int(page_id) - 100_000 for page_id in json.loads(query["search_page_ids"])]
+            matches = matches[np.isin(server._page_codes[matches], pages)]
+        page = matches[after:after + limit]
+        payload = {"data": server.render(page)}
+        if after + limit < len(matches):
+            next_query = {k: v for k, v in query.items() if k != "after"}
+            next_query["after"] = after + limit
+            payload["paging"] = {
+                "cursors": {"after": str(after + limit)},
+                "next": f"http://{self.headers['Host']}{url.path}?{urlencode(next_query)}",
+            }
+        server.count(rows=len(page))
+        self.send_body(200, json.dumps(payload).encode(), "application/json")
+
+
+class XDownloadServer(_FixtureServer):
+    # serves the dated political-ads ZIP for the days listed in available_days;
+    # other dates 404 like the real disclosure page
+
+    def __init__(self, workload: Workload, available_days=(1,), latency: float = 0.0):
+        super().__init__(_XHandler, latency)
+        content = workload.x_zip()
+        self.files = {workload.x_file_name(d): content for d in available_days}
+
+
+class _XHandler(_QuietHandler):
+    def do_GET(self):
+        server = self.server
+        server.count(requests=1)
+        if server.latency:
+            time.sleep(server.latency)
+        content = server.files.get(self.path.rsplit("/", 1)[-1])
+        if content is None:
+            server.count(not_found=1)
+            self.send_body(404, b"Not Found", "text/plain")
+            return
+        server.count(downloads=1, bytes=len(content))
+        self.send_body(200, content, "application/zip")
+
+
+class FakeWorksheet:
+    # the subset of gspread.Worksheet that subscription_manager uses
+
+    def __init__(self, rows: list, latency: float = 0.0):
+        self.rows = [list(r) for r in rows]
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def get_all_values(self):
+        self._call("reads")
+        with self._lock:
+            return [list(r) for r in self.rows]
+
+    def update(self, *args, **kwargs):
+        # gspread accepts update(values, range) and the older update(range, values)
+        values = kwargs.get("values")
+        range_name = kwargs.get("range_name")
+        for arg in args:
+            if isinstance(arg, str):
+                range_name = arg
+            else:
+                values = arg
+        self._call("writes")
+        self._write(range_name or "A1", values)
+
+    def _call(self, kind: str):
+        with self._lock:
+            self.calls[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _write(self, range_name: str, values: list):
+        m = re.match(r"([A-Z]+)(\d+)", range_name)
+        col = ord(m.group(1)) - ord("A")
+        row = int(m.group(2)) - 1
+        with self._lock:
+            for r, line in enumerate(values):
+                while len(self.rows) <= row + r:
+                    self.rows.append([])
+                target = self.rows[row + r]
+                for c, value in enumerate(line):
+                    while len(target) <= col + c:
+                        target.append("")
+                    target[col + c] = value if isinstance(value, str) else json.dumps(value)
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    # accepts STARTTLS + AUTH and counts messages without delivering them
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.tls = _self_signed_context()
+
+    def count(self, **counts):
+        with self.lock:
+            self.calls.update(counts)
+
+
+class _SMTPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        server.count(connections=1)
+        sock = self.request
+        # without this, Nagle + delayed ACK adds ~40ms per TLS exchange and swamps send timings
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = sock.makefile("rb")
+        reply = lambda line: sock.sendall(line.encode() + b"\r\n")
+        reply("220 bench ESMTP sink")
+        tls = False
+        while True:
+            line = reader.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                lines = ["bench", "AUTH PLAIN LOGIN" if tls else "STARTTLS", "8BITMIME"]
+                reply("\r\n".join(f"250-{e}" for e in lines[:-1]) + f"\r\n250 {lines[-1]}")
+            elif verb == "STARTTLS":
+                reply("220 Ready to start TLS")
+                sock = server.tls.wrap_socket(sock, server_side=True)
+                reader = sock.makefile("rb")
+                tls = True
+            elif verb == "AUTH":
+                reply("235 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                reply("250 OK")
+            elif verb == "DATA":
+                reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data_line in iter(reader.readline, b""):
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                if server.latency:
+                    time.sleep(server.latency)
+                server.count(messages=1, bytes=size)
+                reply("250 Queued")
+            elif verb == "QUIT":
+                reply("221 Bye")
+                return
+            else:
+                reply("502 Command not implemented")
+
+
+def _self_signed_context() -> ssl.SSLContext:
+    cert_dir = Path(tempfile.mkdtemp(prefix="ad_tracker_smtp_"))
+    cert, key = cert_dir / "cert.pem", cert_dir / "key.pem"
+    try:
+        _write_cert_cryptography(cert, key)
+    except ImportError:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", "/CN=localhost", "-keyout", str(key), "-out", str(cert)],
+            check=True, capture_output=True,
+        )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def _write_cert_cryptography(cert_path: Path, key_path: Path):
+    from datetime import datetime, timedelta
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number()).not_valid_before(now - timedelta(minutes=5))
+        .not_valid_after(now + timedelta(days=1)).sign(key, hashes.SHA256())
+    )
+    key_path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()
+    ))
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+
+
+def serve_fixtures(conn, ads: int, seed: int, meta_error_rate: float, meta_error_status: int,
+                   latency: float, x_available_days: tuple):
+    # Runs in its own process so the HTTP and SMTP fakes don't compete with the
+    # code under test for the GIL. Reports ports, then answers "stats" until "stop".
+    workload = Workload(ads=ads, subscriptions=0, seed=seed)
+    servers = {
+        "meta": MetaGraphServer(workload.meta_ads(), meta_error_rate, meta_error_status, latency, seed),
+        "x": XDownloadServer(workload, x_available_days, latency),
+        "smtp": SMTPSink(latency),
+    }
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    conn.send({name: server.server_address[1] for name, server in servers.items()})
+
+    while True:
+        message = conn.recv()
+        if message == "stats":
+            conn.send({name: dict(server.calls) for name, server in servers.items()})
+        elif message == "reset":
+            for server in servers.values():
+                with server.lock:
+                    server.calls.clear()
+            conn.send(True)
+        else:
+            break
+    for server in servers.values():
+        server.shutdown()
+    conn.close()
+    os._exit(0)
+
@@ -0,0 +1,95 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# median milliseconds, roughly twice what a GitHub-hosted runner measures
+IMPORT_BUDGETS_MS = {
+    # first run of streamlit_app.py before any search, on top of importing streamlit
+    "app": 700,
+    "notifier": 1_000,
+    "ad_search": 1_000,
+}
+# heavy modules each entry point must leave for the code path that needs them
+DEFERRED_MODULES = {
+    "app": ("pandas", "pyarrow", "requests", "google.cloud.bigquery", "gspread"),
+    "notifier": ("requests", "google.cloud.bigquery", "gspread", "streamlit"),
+    "ad_search": ("requests", "google.cloud.bigquery", "gspread", "streamlit"),
+}
+
+MODULE_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+print(json.dumps({{"ms": (time.perf_counter() - started) * 1000, "loaded": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+APP_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("streamlit_app.py", default_timeout=60)
+app.secrets["meta_access_token"] = "budget-check"
+started = time.perf_counter()
+app.run()
+ms = (time.perf_counter() - started) * 1000
+if app.exception:
+    raise SystemExit(f"app raised: {{app.exception}}")
+print(json.dumps({{"ms": ms, "loaded": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+
+def measure(entry: str, repeat: int) -> dict:
+    deferred = DEFERRED_MODULES[entry]
+    probe = APP_PROBE.format(deferred=deferred) if entry == "app" else MODULE_PROBE.format(module=entry, deferred=deferred)
+    samples, loaded = [], set()
+    for _ in range(repeat):
+        # a fresh interpreter each time; nothing may be cached in sys.modules
+        out = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["ms"])
+        loaded.update(result["loaded"])
+    return {"ms": statistics.median(samples), "min_ms": min(samples), "loaded": sorted(loaded)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when cold start gets slower or pulls heavy imports forward.")
+    parser.add_argument("entries", nargs="*", help=f"entry points to check (default: all). Known: {', '.join(IMPORT_BUDGETS_MS)}")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per entry point")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, e.g. on a slow machine")
+    parser.add_argument("--output", "-o", type=Path, help="write the measurements as JSON")
+    options = parser.parse_args(argv)
+
+    entries = options.entries or list(IMPORT_BUDGETS_MS)
+    unknown = [e for e in entries if e not in IMPORT_BUDGETS_MS]
+    if unknown:
+        parser.error(f"unknown entry point(s): {', '.join(unknown)}")
+
+    failures = []
+    results = {}
+    for entry in entries:
+        result = results[entry] = measure(entry, options.repeat)
+        budget = IMPORT_BUDGETS_MS[entry] * options.scale
+        status = "ok"
+        if result["ms"] > budget:
+            status = "OVER BUDGET"
+            failures.append(f"{entry} took {result['ms']:.0f} ms, budget {budget:.0f} ms")
+        if result["loaded"]:
+            status = "EAGER IMPORT"
+            failures.append(f"{entry} imported {', '.join(result['loaded'])} at startup")
+        print(f"{entry:<12} {result['ms']:>7.0f} ms  (min {result['min_ms']:.0f}, budget {budget:.0f})  {status}")
+        sys.stdout.flush()
+
+    if options.output:
+        options.output.write_text(json.dumps(results, indent=2))
+    if failures:
+        print("\n" + "\n".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+import argparse
+import functools
+import json
+import logging
+import multiprocessing
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+from benchmarks.fakes import FakeBigQueryClient, FakeWorksheet, serve_fixtures
+from benchmarks.workloads import Workload
+
+SCENARIOS = {
+    "notifier-10": {"kind": "notifier", "subscriptions": 10, "ads": 100_000},
+    "notifier-1k": {"kind": "notifier", "subscriptions": 1_000, "ads": 100_000},
+    "notifier-10k": {"kind": "notifier", "subscriptions": 10_000, "ads": 1_000_000},
+    "daemon-1k": {"kind": "daemon", "subscriptions": 1_000, "ads": 100_000},
+    "search-100k": {"kind": "search", "subscriptions": 200, "ads": 100_000},
+    "search-1m": {"kind": "search", "subscriptions": 200, "ads": 1_000_000},
+}
+DEFAULT_SCENARIOS = ["notifier-10", "notifier-1k", "search-100k"]
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = Counter()
+
+    def wrap(self, stage: str, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - started
+                self.calls[stage] += 1
+        return timed
+
+    def patch(self, module, name: str, stage: str):
+        setattr(module, name, self.wrap(stage, getattr(module, name)))
+
+    def report(self) -> dict:
+        return {stage: {"calls": self.calls[stage], "seconds": round(self.seconds[stage], 4)}
+                for stage in sorted(self.seconds, key=self.seconds.get, reverse=True)}
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _peak_rss_mb()
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Fixtures:
+    def __init__(self, workload: Workload, options):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=serve_fixtures,
+            args=(child, workload.ads, workload.seed, options.meta_error_rate, options.meta_error_status,
+                  options.latency_ms / 1000, tuple(options.x_available_days)),
+            daemon=True,
+        )
+        self.process.start()
+        self.ports = self.conn.recv()
+
+    def stats(self) -> dict:
+        self.conn.send("stats")
+        return self.conn.recv()
+
+    def reset(self):
+        self.conn.send("reset")
+        self.conn.recv()
+
+    def close(self):
+        self.conn.send("stop")
+        self.process.join(timeout=10)
+
+
+def _wire(workload: Workload, fixtures: Fixtures, options):
+    import ad_search
+    import notifier
+    import rollups
+    import subscription_manager
+    import x_ads_scraper
+
+    advertiser_stats, creative_stats = workload.google_tables()
+    bigquery = FakeBigQueryClient(advertiser_stats, creative_stats, options.latency_ms / 1000)
+    sheet = FakeWorksheet(workload.sheet_rows(), options.latency_ms / 1000)
+
+    ad_search.configure(meta_token="bench-token")
+    ad_search.use_result_cache(options.result_cache_dir)
+    ad_search.bigquery_client = lambda: bigquery
+    ad_search.META_GRAPH_URL = f"http://127.0.0.1:{fixtures.ports['meta']}/v17.0"
+    if not options.real_delays:
+        ad_search.META_RATE_LIMIT_WAIT = 0.05
+        ad_search.META_PAGE_DELAY = 0
+    x_ads_scraper.X_DATA_BASE_URL = f"http://127.0.0.1:{fixtures.ports['x']}"
+    subscription_manager._sheet_client = lambda: sheet
+
+    notifier.SMTP_HOST = "127.0.0.1"
+    notifier.SMTP_PORT = fixtures.ports["smtp"]
+    notifier.SMTP_USER = notifier.SMTP_PASS = "bench"
+    notifier.FROM_ADDR = "alerts@example.com"
+
+    timer = StageTimer()
+    for platform, search in list(ad_search.PLATFORM_SEARCHES.items()):
+        ad_search.PLATFORM_SEARCHES[platform] = timer.wrap(f"fetch.{platform.lower()}", search)
+    for platform, fetch in list(ad_search.RECENT_ADS.items()):
+        ad_search.RECENT_ADS[platform] = timer.wrap(f"fetch.{platform.lower()}.recent", fetch)
+    timer.patch(ad_search, "download_and_extract_csv", "fetch.x.download")
+    timer.patch(notifier, "load_subscriptions", "load_subscriptions")
+    timer.patch(notifier, "unseen_ads", "diff")
+    timer.patch(notifier, "build_email_html", "render")
+    timer.patch(notifier, "send_email", "send")
+    timer.patch(notifier, "update_last_seen", "sheet_write")
+
+    # what notifier.main() does: every fetched frame is folded into the rollups on a writer thread
+    store = rollups.RollupStore(Path(options.result_cache_dir) / "rollups.sqlite")
+    timer.patch(store, "ingest", "rollup")
+    rollups.track(store, background=True)
+    return bigquery, sheet, timer
+
+
+def _run_pass(name: str, action, bigquery, sheet, fixtures, timer, options) -> dict:
+    import ad_search
+    import metrics
+    import rollups
+
+    # a restart loses this process's cache but finds what the last pass left on disk
+    ad_search.clear_cache(disk=name != "restart")
+    bigquery.calls.clear()
+    sheet.calls.clear()
+    fixtures.reset()
+    timer.reset()
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    metrics.enable(options.metrics_dir is not None)
+
+    if options.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        action()
+        # notifier.main() waits for the rollup writer before it exits
+        rollups.flush()
+    finally:
+        wall = time.perf_counter() - started
+        traced_peak = tracemalloc.get_traced_memory()[1] if options.trace_memory else None
+        if options.trace_memory:
+            tracemalloc.stop()
+        logging.getLogger().removeHandler(errors)
+
+    if options.metrics_dir is not None:
+        metrics.registry.write_reports(options.metrics_dir, f"{options.scenario_name}-{name}")
+    served = fixtures.stats()
+    result = {
+        "pass": name,
+        "wall_seconds": round(wall, 3),
+        "stages": timer.report(),
+        "api_calls": {
+            "bigquery_queries": bigquery.calls["queries"],
+            "bigquery_rows": bigquery.calls["rows"],
+            "meta_requests": served["meta"].get("requests", 0),
+            "meta_rate_limited": served["meta"].get("rate_limited", 0),
+            "meta_rows": served["meta"].get("rows", 0),
+            "meta_connections": served["meta"].get("connections", 0),
+            "x_requests": served["x"].get("requests", 0),
+            "x_connections": served["x"].get("connections", 0),
+            "x_downloads": served["x"].get("downloads", 0),
+            "sheet_reads": sheet.calls["reads"],
+            "sheet_writes": sheet.calls["writes"],
+            "smtp_messages": served["smtp"].get("messages", 0),
+        },
+        "errors": errors.count,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+    if traced_peak is not None:
+        result["traced_peak_mb"] = round(traced_peak / (1024 * 1024), 1)
+    return result
+
+
+def run_scenario(name: str, spec: dict, options) -> dict:
+    options.scenario_name = name
+    options.result_cache_dir = tempfile.mkdtemp(prefix="ad_tracker_bench_results_")
+    started = time.perf_counter()
+    workload = Workload(ads=spec["ads"], subscriptions=spec["subscriptions"], seed=options.seed)
+    fixtures = Fixtures(workload, options)
+    try:
+        bigquery, sheet, timer = _wire(workload, fixtures, options)
+        logging.getLogger().setLevel(options.log_level)
+        setup_seconds = time.perf_counter() - started
+        setup_rss = _rss_mb()
+
+        if spec["kind"] == "notifier":
+            import notifier
+            # the first run sees every ad as new; the second is the usual steady-state cron run
+            passes = [("initial", notifier.run_notifications), ("steady", notifier.run_notifications)]
+        elif spec["kind"] == "daemon":
+            import notifier
+            # what a resident notifier does between full runs: the hourly Meta-only pass
+            passes = [("initial", notifier.run_notifications),
+                      ("meta", functools.partial(notifier.run_notifications, platforms=["Meta"]))]
+        else:
+            import ad_search
+            queries = []
+            for sub in workload.subscriptions().values():
+                query = {"keyword": sub["advertiser_keyword"], "geography": sub["geography"]}
+                if query not in queries:
+                    queries.append(query)
+
+            # what a user narrows to after a broad search: one advertiser and a spend floor,
+            # pushed into the searches with the caches emptied
+            narrowed = []
+            for query in queries:
+                names = [n for n in workload.advertisers if query["keyword"].lower() in n.lower()]
+                filters = {"advertisers": names[:1], "min_spend": 1_000}
+                narrowed.append({**query, "filters": filters})
+
+            # the most common date window: ads delivering in the last 30 days
+            since = (workload.now - timedelta(days=30)).date().isoformat()
+            recent = [{**query, "filters": {"since": since}} for query in queries]
+
+            # the same searches across three countries; Meta runs one search per country at once
+            countries = [{**query, "filters": {"countries": ["US", "CA", "GB"]}} for query in queries]
+
+            def search_all(batch):
+                for _ in ad_search.search_many(batch, options.workers):
+                    pass
+            passes = [("cold", functools.partial(search_all, queries)),
+                      ("restart", functools.partial(search_all, queries)),
+                      ("narrow", functools.partial(search_all, narrowed)),
+                      ("window", functools.partial(search_all, recent)),
+                      ("countries", functools.partial(search_all, countries))]
+
+        results = [_run_pass(p, action, bigquery, sheet, fixtures, timer, options) for p, action in passes]
+    finally:
+        fixtures.close()
+        shutil.rmtree(options.result_cache_dir, ignore_errors=True)
+
+    return {
+        "scenario": name,
+        "kind": spec["kind"],
+        "subscriptions": spec["subscriptions"],
+        "ads_per_platform": spec["ads"],
+        "setup_seconds": round(setup_seconds, 2),
+        "setup_rss_mb": round(setup_rss, 1),
+        "passes": results,
+    }
+
+
+def _scenario_process(queue, name, spec, options):
+    try:
+        queue.put(run_scenario(name, spec, options))
+    except BaseException as e:
+        queue.put({"scenario": name, "error": repr(e)})
+        raise
+
+
+def run_isolated(name: str, spec: dict, options) -> dict:
+    # a fresh interpreter per scenario keeps peak RSS and import state independent
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_scenario_process, args=(queue, name, spec, options))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def print_result(result: dict, baseline: dict = None):
+    if "error" in result:
+        print(f"\n{result['scenario']}: FAILED {result['error']}")
+        return
+    print(f"\n{result['scenario']} — {result['subscriptions']:,} subscriptions, "
+          f"{result['ads_per_platform']:,} ads/platform (setup {result['setup_seconds']}s, "
+          f"{result['setup_rss_mb']} MB)")
+    for p in result["passes"]:
+        line = f"  {p['pass']:<8} {p['wall_seconds']:>9.2f}s  peak {p['peak_rss_mb']} MB"
+        if "traced_peak_mb" in p:
+            line += f"  traced {p['traced_peak_mb']} MB"
+        if p["errors"]:
+            line += f"  {p['errors']} errors"
+        before = _baseline_pass(baseline, result["scenario"], p["pass"])
+        if before:
+            change = (p["wall_seconds"] - before["wall_seconds"]) / before["wall_seconds"] * 100
+            line += f"  ({change:+.1f}% vs baseline)"
+        print(line)
+        for stage, t in p["stages"].items():
+            print(f"    {stage:<20} {t['seconds']:>9.3f}s  {t['calls']:>7,} calls")
+        calls = ", ".join(f"{k}={v:,}" for k, v in p["api_calls"].items())
+        print(f"    api: {calls}")
+    sys.stdout.flush()
+
+
+def _baseline_pass(baseline: dict, scenario: str, name: str):
+    if not baseline:
+        return None
+    for result in baseline.get("results", []):
+        if result.get("scenario") == scenario:
+            for p in result.get("passes", []):
+                if p["pass"] == name:
+                    return p
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the notifier and search paths against local fakes.")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run (default: {' '.join(DEFAULT_SCENARIOS)}; "
+                                                     f"'all' for every one). Known: {', '.join(SCENARIOS)}")
+    parser.add_argument("--subscriptions", type=int, help="override the scenario's subscription count")
+    parser.add_argument("--ads", type=int, help="override the scenario's ads per platform")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=8, help="concurrent searches for search scenarios")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per fake API call")
+    parser.add_argument("--meta-error-rate", type=float, default=0.01, help="share of Graph requests that return 613")
+    parser.add_argument("--meta-error-status", type=int, default=400, help="HTTP status of the 613 responses")
+    parser.add_argument("--x-available-days", type=int, nargs="+", default=[1],
+                        help="days ago for which an X ZIP exists")
+    parser.add_argument("--real-delays", action="store_true", help="keep the Meta page delay and 613 back-off")
+    parser.add_argument("--trace-memory", action="store_true", help="also report tracemalloc peaks (slower)")
+    parser.add_argument("--metrics-dir", type=Path, help="enable the notifier's metrics and write each pass's "
+                                                          "report here")
+    parser.add_argument("--log-level", default="CRITICAL", help="log level of the code under test "
+                                                                  "(errors are counted either way)")
+    parser.add_argument("--output", "-o", type=Path, help="write the JSON report here")
+    parser.add_argument("--baseline", type=Path, help="earlier JSON report to compare wall times against")
+    options = parser.parse_args(argv)
+
+    names = options.scenarios or DEFAULT_SCENARIOS
+    if names == ["all"]:
+        names = list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    baseline = json.loads(options.baseline.read_text()) if options.baseline else None
+    results = []
+    for name in names:
+        spec = dict(SCENARIOS[name])
+        if options.subscriptions is not None:
+            spec["subscriptions"] = options.subscriptions
+        if options.ads is not None:
+            spec["ads"] = options.ads
+        result = run_isolated(name, spec, options)
+        print_result(result, baseline)
+        results.append(result)
+
+    if options.output:
+        report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "options": {
+            k: (str(v) if isinstance(v, Path) else v) for k, v in vars(options).items()
+        }, "results": results}
+        options.output.write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {options.output}")
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
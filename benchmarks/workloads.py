@@ -0,0 +1,197 @@
+import io
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from subscription_manager import SHEET_HEADERS, _sub_to_row
+from x_ads_scraper import STATE_MAPPING
+
+SURNAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+    "Walker", "Young", "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores",
+    "Green", "Adams", "Nelson", "Baker", "Hall", "Rivera", "Campbell", "Mitchell", "Carter", "Roberts",
+]
+OFFICES = ["for Congress", "for Senate", "for Governor", "for State House", "for Mayor", "Victory Fund"]
+ISSUES = ["Clean Energy", "Safer Streets", "Lower Taxes", "Public Schools", "Health Care", "Working Families"]
+PARTIES = ["Democratic Party", "Republican Party", "Libertarian Party"]
+
+STATES = sorted(STATE_MAPPING.items())
+STATE_NAMES = [name.title() for _, name in STATES]
+
+GOOGLE_AD_TYPES = ["TEXT", "IMAGE", "VIDEO"]
+GOOGLE_IMPRESSIONS = ["≤ 10k", "10k-100k", "100k-1M", "1M-10M", "> 10M"]
+GOOGLE_SPEND = [(0, 100), (100, 1_000), (1_000, 50_000), (50_000, 100_000), (100_000, 250_000)]
+META_BUCKETS = [(0, 99), (100, 199), (200, 499), (500, 999), (1_000, 4_999), (5_000, 9_999), (10_000, None)]
+AGE_BUCKETS = ["18-24", "25-34", "35-44", "45-54", "55-64", "65+"]
+GENDERS = ["female", "male", "unknown"]
+X_TARGETING = ["Followers", "Keywords", "Interests", "Tailored audiences"]
+
+
+def advertiser_names(n: int, rng: np.random.Generator) -> list:
+    names = []
+    seen = set()
+    while len(names) < n:
+        kind = rng.random()
+        if kind < 0.6:
+            name = f"{rng.choice(SURNAMES)} {rng.choice(OFFICES)}"
+        elif kind < 0.8:
+            name = f"{rng.choice(STATE_NAMES)} {rng.choice(PARTIES)}"
+        else:
+            name = f"Americans for {rng.choice(ISSUES)}"
+        if name in seen:
+            name = f"{name} {len(names)}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def _skewed(n_choices: int, size: int, rng: np.random.Generator, exponent: float = 0.8) -> np.ndarray:
+    # a handful of big spenders and a long tail, like the real disclosure data
+    weights = 1.0 / np.arange(1, n_choices + 1) ** exponent
+    return rng.choice(n_choices, size=size, p=weights / weights.sum())
+
+
+def _dates(size: int, rng: np.random.Generator, now: datetime):
+    start = np.datetime64(now.date()) - rng.integers(0, 730, size=size).astype("timedelta64[D]")
+    end = start + rng.integers(1, 90, size=size).astype("timedelta64[D]")
+    return start, end
+
+
+class Workload:
+    # Synthetic ads for every platform plus a subscription list. Everything is derived
+    # from the seed, so the fixture process can rebuild the same data without pickling it.
+
+    def __init__(self, ads: int, subscriptions: int, seed: int = 7, now: datetime = None):
+        self.ads = ads
+        self.n_subscriptions = subscriptions
+        self.seed = seed
+        self.now = now or datetime.utcnow()
+        rng = np.random.default_rng(seed)
+        self.advertisers = advertiser_names(max(100, min(5_000, ads // 200)), rng)
+
+    def _rng(self, stream: int) -> np.random.Generator:
+        return np.random.default_rng([self.seed, stream])
+
+    def google_tables(self):
+        rng = self._rng(1)
+        n = self.ads
+        advertiser_stats = pd.DataFrame({
+            "advertiser_id": [f"AR{i:08d}" for i in range(len(self.advertisers))],
+            "advertiser_name": self.advertisers,
+        })
+        adv = _skewed(len(self.advertisers), n, rng)
+        start, end = _dates(n, rng, self.now)
+        spend = rng.integers(0, len(GOOGLE_SPEND), size=n)
+        states = rng.integers(0, len(STATE_NAMES), size=n)
+        creative_stats = pd.DataFrame({
+            "ad_id": [f"CR{i:011d}" for i in range(n)],
+            "advertiser_id": advertiser_stats["advertiser_id"].to_numpy()[adv],
+            "ad_type": np.array(GOOGLE_AD_TYPES)[rng.integers(0, len(GOOGLE_AD_TYPES), size=n)],
+            "date_range_start": start,
+            "date_range_end": end,
+            "impressions": np.array(GOOGLE_IMPRESSIONS)[_skewed(len(GOOGLE_IMPRESSIONS), n, rng)],
+            "spend_range_min_usd": np.array([lo for lo, _ in GOOGLE_SPEND])[spend],
+            "spend_range_max_usd": np.array([hi for _, hi in GOOGLE_SPEND])[spend],
+            "geo_targeting_included": np.array([f"{s}, United States" for s in STATE_NAMES])[states],
+            "age_targeting": np.array(AGE_BUCKETS)[rng.integers(0, len(AGE_BUCKETS), size=n)],
+            "gender_targeting": np.array(["Male", "Female", "Unknown gender"])[rng.integers(0, 3, size=n)],
+        })
+        # every synthetic creative ran in the US
+        creative_stats["regions"] = "US"
+        creative_stats["ad_url"] = (
+            "https://adstransparency.google.com/advertiser/" + creative_stats["advertiser_id"]
+            + "/creative/" + creative_stats["ad_id"]
+        )
+        return advertiser_stats, creative_stats
+
+    def meta_ads(self) -> pd.DataFrame:
+        # columnar; the Graph fake renders JSON only for the pages it serves
+        rng = self._rng(2)
+        n = self.ads
+        start, end = _dates(n, rng, self.now)
+        return pd.DataFrame({
+            "id": np.arange(10**15, 10**15 + n).astype(str),
+            "page_name": np.array(self.advertisers)[_skewed(len(self.advertisers), n, rng)],
+            "start": start,
+            "stop": end,
+            "spend": _skewed(len(META_BUCKETS), n, rng),
+            "impressions": _skewed(len(META_BUCKETS), n, rng),
+            "region": rng.integers(0, len(STATE_NAMES), size=n),
+            "region_count": rng.integers(1, 4, size=n),
+            "age": rng.integers(0, len(AGE_BUCKETS), size=n),
+        })
+
+    def x_ads(self) -> pd.DataFrame:
+        rng = self._rng(3)
+        n = self.ads
+        start, end = _dates(n, rng, self.now)
+        handles = np.array([name.replace(" ", "").lower()[:15] for name in self.advertisers])
+        tweet_ids = np.arange(10**18, 10**18 + n)
+        return pd.DataFrame({
+            "Screen Name": handles[_skewed(len(handles), n, rng)],
+            "Tweet Id": tweet_ids,
+            "Tweet Url": [f"https://x.com/i/web/status/{t}" for t in tweet_ids],
+            "Day of Start Date Adgroup": pd.Series(start).dt.strftime("%Y-%m-%d"),
+            "Day of End Date Adgroup": pd.Series(end).dt.strftime("%Y-%m-%d"),
+            "Targeting Name": np.array(X_TARGETING)[rng.integers(0, len(X_TARGETING), size=n)],
+            "Interest Targeting": "",
+            "Geo Targeting": np.array([f"{s}, US" for s in STATE_NAMES])[rng.integers(0, len(STATE_NAMES), size=n)],
+            "Gender Targeting": "",
+            "Age Targeting": "",
+            "Impressions": rng.integers(0, 2_000_000, size=n),
+            "Spend_USD": np.round(rng.gamma(1.2, 800, size=n), 2),
+        })
+
+    def x_zip(self) -> bytes:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("political_ads.csv", self.x_ads().to_csv(index=False))
+        return buf.getvalue()
+
+    def x_file_name(self, days_ago: int) -> str:
+        date = self.now - timedelta(days=days_ago)
+        return f"{date.day:02d}-{date.strftime('%B')}-{date.year}-political-ads-data.zip"
+
+    def keywords(self) -> list:
+        words = SURNAMES + [o.lower() for o in OFFICES] + ISSUES + [p.split()[0] for p in PARTIES]
+        return words
+
+    def subscriptions(self) -> dict:
+        rng = self._rng(4)
+        keywords = self.keywords()
+        kw = _skewed(len(keywords), self.n_subscriptions, rng, exponent=1.0)
+        geo_roll = rng.random(self.n_subscriptions)
+        geo_pick = rng.integers(0, len(STATES), size=self.n_subscriptions)
+        platform_roll = rng.random(self.n_subscriptions)
+
+        subs = {}
+        for i in range(self.n_subscriptions):
+            if geo_roll[i] < 0.6:
+                geography = ""
+            elif geo_roll[i] < 0.8:
+                geography = STATES[geo_pick[i]][0].upper()
+            else:
+                geography = STATE_NAMES[geo_pick[i]]
+            if platform_roll[i] < 0.7:
+                platforms = ["Google", "Meta", "X"]
+            else:
+                platforms = [["Google"], ["Meta"], ["X"], ["Google", "Meta"]][int(platform_roll[i] * 40) % 4]
+            sub_id = f"sub-{i:06d}"
+            subs[sub_id] = {
+                "id": sub_id,
+                "email": f"user{i}@example.com",
+                "advertiser_keyword": keywords[kw[i]],
+                "geography": geography,
+                "platforms": platforms,
+                "created_at": self.now.isoformat(),
+                "last_notified_at": None,
+                "last_seen_ad_ids": [],
+            }
+        return subs
+
+    def sheet_rows(self) -> list:
+        return [list(SHEET_HEADERS)] + [_sub_to_row(sub) for sub in self.subscriptions().values()]
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Per-subscription progress through a notifier run:
+#   fetched   - new ads were computed (nothing external happened yet)
+#   sent      - written, and fsync'd, *before* the email goes out, with the ids it covers
+#   failed    - the SMTP call raised, so nothing was delivered
+#   committed - last_seen is written back to the sheet
+#   deferred  - as committed, except for platforms that failed or were skipped, which the
+#               next run catches up on (with the date they were last missed from)
+# A "sent" entry without a later "committed" means the email may have gone out, so a
+# resumed or later run writes its ids back instead of emailing again (at most once).
+STATES = ("fetched", "sent", "failed", "committed", "deferred")
+
+
+class CheckpointStore:
+    def __init__(self, directory, run_id: str, shard: int = 0, shards: int = 1):
+        self.directory = Path(directory)
+        self.run_id = str(run_id)
+        self.path = self.directory / f"shard-{shard}-of-{shards}.jsonl"
+        self.latest = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self._fh = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a crash mid-write leaves at most one torn line at the end
+                    continue
+                self.latest[entry["sub"]] = entry
+
+        # keep this run's progress, unconfirmed sends and owed catch-ups; everything else is history
+        self.latest = {
+            sub: entry for sub, entry in self.latest.items()
+            if entry["run"] == self.run_id or entry["state"] in ("sent", "deferred")
+        }
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, prefix=f".{self.path.name}.", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            for entry in self.latest.values():
+                fh.write(json.dumps(entry) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_name, self.path)
+        pending = sum(1 for e in self.latest.values() if e["state"] == "sent")
+        owed = sum(1 for e in self.latest.values() if e["state"] == "deferred")
+        logger.info(f"Loaded {len(self.latest)} checkpoint(s) from {self.path} "
+                    f"({pending} unconfirmed send(s), {owed} catch-up(s))")
+
+    def get(self, sub_id: str) -> Optional[dict]:
+        return self.latest.get(sub_id)
+
+    def done(self, sub_id: str) -> bool:
+        entry = self.latest.get(sub_id)
+        return entry is not None and entry["run"] == self.run_id and entry["state"] == "committed"
+
+    def pending_send(self, sub_id: str) -> Optional[dict]:
+        entry = self.latest.get(sub_id)
+        return entry if entry is not None and entry["state"] == "sent" else None
+
+    def deferred(self, sub_id: str) -> Optional[dict]:
+        entry = self.latest.get(sub_id)
+        return entry if entry is not None and entry["state"] == "deferred" else None
+
+    def record(self, sub_id: str, state: str, **data):
+        if state not in STATES:
+            raise ValueError(f"Unknown checkpoint state: {state}")
+        entry = {"sub": sub_id, "state": state, "run": self.run_id, "time": time.time(), **data}
+        self._fh.write(json.dumps(entry) + "\n")
+        self._fh.flush()
+        if state == "sent":
+            # must reach the disk before the email is handed to SMTP
+            os.fsync(self._fh.fileno())
+        self.latest[sub_id] = entry
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
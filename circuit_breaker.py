@@ -0,0 +1,71 @@
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# After BREAKER_THRESHOLD failures in a row a platform's breaker opens and its fetches are
+# skipped without waiting out another timeout. Every BREAKER_PROBE_INTERVAL seconds one
+# fetch is let through as a probe; a success closes the breaker again. 0 never probes, so
+# an open platform stays skipped for the rest of the run.
+BREAKER_THRESHOLD = int(os.environ.get("NOTIFIER_BREAKER_THRESHOLD", 3))
+BREAKER_PROBE_INTERVAL = float(os.environ.get("NOTIFIER_BREAKER_PROBE_INTERVAL", 120))
+
+CLOSED, OPEN, PROBING = "closed", "open", "probing"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, probe_interval: float = BREAKER_PROBE_INTERVAL):
+        self.name = name
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.skipped = 0
+        self.probes = 0
+        self.last_error = None
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        # whether to make the call; False means skip it now
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.probe_interval and time.monotonic() - self._opened_at >= self.probe_interval:
+                self.state = PROBING
+                self.probes += 1
+                logger.info(f"Circuit breaker for {self.name}: probing")
+                return True
+            self.skipped += 1
+        metrics.incr("breaker_skipped", platform=self.name)
+        return False
+
+    def succeeded(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit breaker for {self.name}: closed again after a successful probe")
+            self.state = CLOSED
+            self.failures = 0
+
+    def failed(self, error: Exception):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.state == PROBING or (self.state == CLOSED and self.failures >= self.threshold):
+                if self.state == CLOSED:
+                    self.trips += 1
+                    metrics.incr("breaker_trips", platform=self.name)
+                    logger.warning(f"Circuit breaker for {self.name} tripped after {self.failures} failures "
+                                   f"in a row; skipping it{' between probes' if self.probe_interval else ''}")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "trips": self.trips, "skipped": self.skipped, "probes": self.probes,
+                    "last_error": type(self.last_error).__name__ if self.last_error is not None else None}
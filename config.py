@@ -0,0 +1,51 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+import toml
+
+
+def load_config():
+    secrets_path = Path(".streamlit/secrets.toml")
+    secrets = {}
+    if secrets_path.exists():
+        try:
+            secrets = toml.load(secrets_path)
+        except Exception as e:
+            logging.warning(f"Could not load {secrets_path}: {e}")
+
+    email_cfg = secrets.get("email") or {}
+    smtp_host = email_cfg.get("smtp_host") or os.environ.get("SMTP_HOST", "smtp.gmail.com")
+    smtp_port = int(email_cfg.get("smtp_port") or os.environ.get("SMTP_PORT", "587"))
+    smtp_user = email_cfg.get("smtp_user") or os.environ.get("SMTP_USER", "")
+    smtp_pass = email_cfg.get("smtp_password") or os.environ.get("SMTP_PASSWORD", "")
+    from_addr = email_cfg.get("from_address") or os.environ.get("FROM_ADDRESS", smtp_user)
+
+    meta_token = secrets.get("meta_access_token") or os.environ.get("META_ACCESS_TOKEN", "")
+
+    gcp_secrets = secrets.get("gcp_service_account") or {}
+    gcp_json = os.environ.get("GCP_SERVICE_ACCOUNT_JSON")
+    if gcp_json:
+        try:
+            gcp_secrets = json.loads(gcp_json)
+        except json.JSONDecodeError as e:
+            logging.warning(f"GCP_SERVICE_ACCOUNT_JSON invalid JSON: {e}")
+    elif not gcp_secrets:
+        gcp_path = Path(".streamlit/gcp_service_account.json")
+        if gcp_path.exists():
+            try:
+                with open(gcp_path) as f:
+                    gcp_secrets = json.load(f)
+            except Exception as e:
+                logging.warning(f"Could not load {gcp_path}: {e}")
+
+    return {
+        "SMTP_HOST": smtp_host,
+        "SMTP_PORT": smtp_port,
+        "SMTP_USER": smtp_user,
+        "SMTP_PASS": smtp_pass,
+        "FROM_ADDR": from_addr,
+        "META_TOKEN": meta_token,
+        "GCP_SECRETS": gcp_secrets,
+    }
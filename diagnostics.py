@@ -0,0 +1,205 @@
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import http_client
+import metrics
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# samples kept across all sessions for the rolling percentiles
+DIAGNOSTICS_WINDOW = int(os.environ.get("DIAGNOSTICS_WINDOW", 5_000))
+HOT_QUERY_LIMIT = 10
+PERCENTILES = (0.5, 0.9, 0.99)
+RERUN_KEY = "_diagnostics_rerun"
+TOGGLE_KEY = "show_diagnostics"
+
+
+class DiagnosticsStore:
+    def __init__(self, window: int = DIAGNOSTICS_WINDOW):
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, sample: dict):
+        with self._lock:
+            self.samples.append(sample)
+
+    def frame(self) -> "pd.DataFrame":
+        import pandas as pd
+
+        with self._lock:
+            return pd.DataFrame(list(self.samples))
+
+
+# module state rather than st.cache_resource: downloads are generated outside any script run
+_store = DiagnosticsStore()
+
+
+def diagnostics_store() -> DiagnosticsStore:
+    return _store
+
+
+def begin_rerun():
+    st.session_state[RERUN_KEY] = st.session_state.get(RERUN_KEY, 0) + 1
+
+
+def enabled() -> bool:
+    # the panel's toggle, as the session left it; samples are only taken while it is on
+    if get_script_run_ctx() is None:
+        return False
+    return bool(st.session_state.get(TOGGLE_KEY))
+
+
+def _session():
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None, None
+    return ctx.session_id, st.session_state.get(RERUN_KEY)
+
+
+@contextmanager
+def timed(stage: str, query: str = "", session=None):
+    # times the block and collects what ad_search/exports counted on this thread meanwhile;
+    # without a session, only while this session has the panel on
+    if session is None:
+        if not enabled():
+            yield {}
+            return
+        session = _session()
+    session_id, rerun = session
+    sample = {"stage": stage, "query": query}
+    started = time.perf_counter()
+    with metrics.collect() as counters:
+        try:
+            yield sample
+        finally:
+            sample["seconds"] = time.perf_counter() - started
+            sample.update(_counter_details(counters))
+            frame = sample.pop("frame", None)
+            if frame is not None:
+                sample["rows"] = len(frame)
+                sample["memory_mb"] = frame.memory_usage(deep=True).sum() / (1024 * 1024)
+            sample.update(time=time.time(), session=session_id, rerun=rerun)
+            diagnostics_store().record(sample)
+
+
+def _counter_details(counters: dict) -> dict:
+    details = {}
+    misses = metrics.counter_value(counters, "search_cache", result="miss")
+    hits = metrics.counter_value(counters, "search_cache", result="hit")
+    misses += metrics.counter_value(counters, "export_cache", result="miss")
+    hits += metrics.counter_value(counters, "export_cache", result="hit")
+    # waited for the same search started by another session
+    coalesced = metrics.counter_value(counters, "search_cache", result="coalesced")
+    if hits or misses or coalesced:
+        disk_hits = metrics.counter_value(counters, "search_cache", result="hit", tier="disk")
+        details["cache"] = "miss" if misses else "shared" if coalesced else "disk" if disk_hits else "hit"
+    bigquery_bytes = metrics.counter_value(counters, "bigquery_bytes")
+    if bigquery_bytes:
+        details["bigquery_mb"] = bigquery_bytes / (1024 * 1024)
+    meta_pages = metrics.counter_value(counters, "api_calls", platform="Meta")
+    if meta_pages:
+        details["meta_pages"] = meta_pages
+    return details
+
+
+def traced(stage: str):
+    # for fetchers: (keyword, geography) -> DataFrame
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            query = " / ".join(str(a) for a in args if a)
+            with timed(stage, query) as sample:
+                result = fn(*args, **kwargs)
+                sample["frame"] = result
+            return result
+        return wrapper
+    return decorator
+
+
+def traced_download(stage: str, generate, query: str = ""):
+    # download data is produced when the button is clicked, outside the rerun that drew it,
+    # so remember which session and rerun the button belongs to
+    if not enabled():
+        return generate
+    session = _session()
+
+    def wrapper():
+        with timed(stage, query, session=session):
+            return generate()
+    return wrapper
+
+
+def _percentiles(samples: "pd.DataFrame", by) -> "pd.DataFrame":
+    grouped = samples.groupby(by, sort=False)["seconds"]
+    table = grouped.agg(calls="count", total_s="sum", max_s="max")
+    for q in PERCENTILES:
+        table[f"p{int(q * 100)}_s"] = grouped.quantile(q)
+    return table
+
+
+def show_diagnostics_panel():
+    if not st.sidebar.toggle("Performance diagnostics", key=TOGGLE_KEY):
+        return
+
+    samples = diagnostics_store().frame()
+    st.markdown("---")
+    st.markdown("## Performance diagnostics")
+    if samples.empty:
+        st.info("Nothing has been timed yet. Run a search with this panel on to collect samples.")
+        return
+
+    session_id, rerun = _session()
+    mine = samples[samples["session"] == session_id]
+    current = mine[mine["rerun"] == rerun]
+    st.markdown("**This rerun**")
+    if current.empty:
+        st.caption("No timed stages ran in this rerun.")
+    else:
+        st.dataframe(_detail_columns(current), hide_index=True, use_container_width=True)
+
+    downloads = mine[mine["stage"] == "export"].tail(5)
+    if not downloads.empty:
+        st.markdown("**Recent exports in this session**")
+        st.dataframe(_detail_columns(downloads), hide_index=True, use_container_width=True)
+
+    st.markdown(f"**All sessions with diagnostics on, last {len(samples):,} samples**")
+    summary = _percentiles(samples, "stage")
+    if "cache" in samples:
+        summary["hit_rate"] = samples.groupby("stage", sort=False)["cache"].apply(
+            lambda c: c.isin(["hit", "disk", "shared"]).sum() / c.notna().sum() if c.notna().any() else None
+        )
+    st.dataframe(summary.sort_values("total_s", ascending=False), use_container_width=True)
+
+    st.markdown("**Hot queries**")
+    queried = samples[samples["query"] != ""]
+    if not queried.empty:
+        hot = _percentiles(queried, ["stage", "query"]).sort_values("total_s", ascending=False)
+        st.dataframe(hot.head(HOT_QUERY_LIMIT), use_container_width=True)
+
+    import pandas as pd
+
+    import ad_search
+
+    counts = ad_search.cache_stats()
+    st.markdown(f"**Result cache** in this process: {counts['bytes'] / (1024 * 1024):,.0f} of "
+                f"{counts['max_bytes'] / (1024 * 1024):,.0f} MB")
+    st.dataframe(pd.DataFrame([counts]).drop(columns="max_bytes"), hide_index=True, use_container_width=True)
+
+    connections = http_client.stats()
+    if connections:
+        st.markdown("**Connections by host**")
+        st.dataframe(pd.DataFrame.from_dict(connections, orient="index").fillna(0).astype(int), use_container_width=True)
+
+
+def _detail_columns(samples: "pd.DataFrame") -> "pd.DataFrame":
+    columns = ["stage", "query", "seconds", "cache", "rows", "memory_mb", "bigquery_mb", "meta_pages"]
+    return samples[[c for c in columns if c in samples.columns]]
@@ -0,0 +1,230 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import BinaryIO
+
+import pandas as pd
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_ROWS = 50_000
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+EXPORT_CACHE_DIR = Path(os.environ.get("EXPORT_CACHE_DIR", Path(tempfile.gettempdir()) / "ad_tracker_exports"))
+
+# label -> (file extension, mime type)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+_cache_lock = threading.Lock()
+
+
+def export_file_name(stem: str, fmt: str) -> str:
+    return f"{stem}.{EXPORT_FORMATS[fmt][0]}"
+
+
+def export_mime(fmt: str) -> str:
+    return EXPORT_FORMATS[fmt][1]
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    import pyarrow as pa
+
+    h = hashlib.sha256()
+    h.update(repr((list(df.columns), [str(t) for t in df.dtypes], len(df))).encode())
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i]
+        try:
+            arr = pa.array(values, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # Meta rows mix dicts/lists (spend ranges, regions) with strings
+            arr = pa.array(values.astype(str), from_pandas=True)
+        if isinstance(arr, pa.ChunkedArray):
+            arr = arr.combine_chunks()
+        if pa.types.is_dictionary(arr.type):
+            arr = arr.dictionary_decode()
+        h.update(str(arr.type).encode())
+        for buf in arr.buffers():
+            if buf is not None:
+                h.update(buf)
+    return h.hexdigest()[:32]
+
+
+def export_fingerprint(frames: list, fmt: str, platforms: list = None, filter_state=None) -> str:
+    h = hashlib.sha256()
+    for df in frames:
+        h.update(frame_fingerprint(df).encode())
+    h.update(repr((fmt, platforms, filter_state)).encode())
+    return h.hexdigest()[:32]
+
+
+# for st.download_button(data=...): nothing is encoded until the button is clicked.
+# A filtered export is keyed by its unfiltered source frames plus the filter state, and
+# ``frames`` may then be a callable so the filtered copy is only built on a cache miss.
+# The click gets a handle on the cached file rather than its bytes, so the export is read
+# from disk once, by whatever serves it.
+def deferred_export(frames, fmt: str, platforms: list = None, source: list = None, filter_state=None):
+    def generate() -> BinaryIO:
+        if source is not None:
+            fingerprint = export_fingerprint(source, fmt, platforms, filter_state)
+        else:
+            fingerprint = export_fingerprint(frames, fmt, platforms, filter_state)
+        return cached_export(fingerprint, frames, fmt, platforms).open("rb")
+    return generate
+
+
+def cached_export(fingerprint: str, frames, fmt: str, platforms: list = None) -> Path:
+    path = EXPORT_CACHE_DIR / f"{fingerprint}.{EXPORT_FORMATS[fmt][0]}"
+    if path.exists():
+        try:
+            os.utime(path)
+            metrics.incr("export_cache", result="hit")
+            return path
+        except FileNotFoundError:
+            pass
+
+    metrics.incr("export_cache", result="miss")
+    if callable(frames):
+        frames = frames()
+    EXPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=EXPORT_CACHE_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            write_export(fh, frames, fmt, platforms)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    logger.info(f"Built {fmt} export {path.name} ({path.stat().st_size:,} bytes)")
+    _evict_exports(keep=path)
+    return path
+
+
+def _evict_exports(keep: Path):
+    with _cache_lock:
+        files = []
+        for p in EXPORT_CACHE_DIR.iterdir():
+            if p.suffix == ".part" or p == keep:
+                continue
+            try:
+                info = p.stat()
+            except FileNotFoundError:
+                continue
+            files.append((info.st_mtime, info.st_size, p))
+        total = sum(size for _, size, _ in files) + keep.stat().st_size
+        for _, size, p in sorted(files):
+            if total <= EXPORT_CACHE_MAX_BYTES:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+
+
+def export_columns(frames: list, platforms: list = None) -> list:
+    columns = []
+    for df in frames:
+        for col in list(df.columns) + (["Platform"] if platforms is not None else []):
+            if col not in columns:
+                columns.append(col)
+    return columns
+
+
+def iter_export_chunks(frames: list, columns: list, platforms: list = None):
+    for i, df in enumerate(frames):
+        for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+            chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+            if platforms is not None:
+                chunk = chunk.assign(Platform=platforms[i])
+            if list(chunk.columns) != columns:
+                chunk = chunk.reindex(columns=columns)
+            yield chunk
+
+
+def write_export(fh, frames: list, fmt: str, platforms: list = None):
+    columns = export_columns(frames, platforms)
+    if fmt == "CSV":
+        _write_csv(fh, frames, columns, platforms)
+    elif fmt == "CSV (gzip)":
+        with gzip.GzipFile(fileobj=fh, mode="wb", compresslevel=6) as gz:
+            _write_csv(gz, frames, columns, platforms)
+    elif fmt == "Parquet":
+        _write_parquet(fh, frames, columns, platforms)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+
+def _write_csv(fh, frames, columns, platforms):
+    text = io.TextIOWrapper(fh, encoding="utf-8", newline="")
+    pd.DataFrame(columns=columns).to_csv(text, index=False)
+    for chunk in iter_export_chunks(frames, columns, platforms):
+        chunk.to_csv(text, index=False, header=False)
+    text.flush()
+    text.detach()
+
+
+def _as_text(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def _parquet_types(frames, columns, platforms):
+    import pyarrow as pa
+
+    types = {}
+    for col in columns:
+        if col == "Platform" and platforms is not None:
+            types[col] = pa.string()
+            continue
+        dtypes = {df[col].dtype for df in frames if col in df.columns}
+        missing = any(col not in df.columns for df in frames)
+        dtype = dtypes.pop() if len(dtypes) == 1 else None
+        if dtype is None or isinstance(dtype, pd.CategoricalDtype):
+            types[col] = pa.string()
+        elif isinstance(dtype, pd.DatetimeTZDtype):
+            types[col] = pa.timestamp(dtype.unit, tz=str(dtype.tz))
+        elif dtype.kind == "M":
+            types[col] = pa.timestamp("ns")
+        elif dtype.kind == "f" or (dtype.kind in "iu" and missing):
+            types[col] = pa.float64()
+        elif dtype.kind in "iu":
+            types[col] = pa.int64()
+        elif dtype.kind == "b" and not missing:
+            types[col] = pa.bool_()
+        else:
+            types[col] = pa.string()
+    return types
+
+
+def _write_parquet(fh, frames, columns, platforms):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = _parquet_types(frames, columns, platforms)
+    schema = pa.schema([(str(col), types[col]) for col in columns])
+    with pq.ParquetWriter(fh, schema, compression="zstd") as writer:
+        for chunk in iter_export_chunks(frames, columns, platforms):
+            arrays = []
+            for col in columns:
+                values = chunk[col]
+                if pa.types.is_string(types[col]):
+                    arrays.append(pa.array(values.astype(object).map(_as_text), type=pa.string()))
+                else:
+                    if pa.types.is_timestamp(types[col]) and values.dtype.kind != "M":
+                        # column absent from this platform's frame: all-NaN after reindex
+                        values = pd.to_datetime(values)
+                    arrays.append(pa.array(values, type=types[col], from_pandas=True))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
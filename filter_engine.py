@@ -0,0 +1,213 @@
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from exports import frame_fingerprint
+
+KEYWORD_COLUMNS = ("Ad Url", "Ad Type", "Advertiser Name")
+FILTER_COLUMNS = ("Spend",) + KEYWORD_COLUMNS
+FILTER_INDEX_CACHE_SIZE = 16
+REGEX_METACHARS = set(".^$*+?{}[]\\|()")
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+# id(frame) -> (weak reference, {name: value}): search results come back from the result cache
+# as the same object on every rerun, so what is derived from one is worked out once
+_frame_memos = {}
+
+
+class FilterIndex:
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+        self._sort_orders = {}
+
+        self.spend = None
+        self.spend_is_raw = False
+        self.max_spend = 0.0
+        if "Spend" in df.columns:
+            raw = df["Spend"]
+            spend = pd.to_numeric(raw, errors="coerce").fillna(0).to_numpy(dtype="float64")
+            self.spend = spend
+            self.spend_is_raw = raw.dtype == "float64" and not raw.isna().any()
+            self.spend_order = np.argsort(spend, kind="stable")
+            self.spend_sorted = spend[self.spend_order]
+            if self.n_rows:
+                self.max_spend = float(self.spend_sorted[-1])
+
+        self.advertisers = []
+        self.advertiser_codes = None
+        if "Advertiser Name" in df.columns:
+            advertisers = pd.Categorical(df["Advertiser Name"]).remove_unused_categories()
+            self.advertiser_codes = advertisers.codes
+            self.advertisers = advertisers.categories.tolist()
+
+        # str.contains(case=False) per row becomes one match per distinct value plus a code lookup
+        self.text = {}
+        for col in KEYWORD_COLUMNS:
+            if col in df.columns:
+                codes, uniques = pd.factorize(df[col].astype(str))
+                self.text[col] = (codes, pc.utf8_lower(pa.array(np.asarray(uniques, dtype=object), type=pa.string())))
+
+    def spend_mask(self, min_spend: float, max_spend: float) -> np.ndarray:
+        lo = np.searchsorted(self.spend_sorted, min_spend, side="left")
+        hi = np.searchsorted(self.spend_sorted, max_spend, side="right")
+        mask = np.zeros(self.n_rows, dtype=bool)
+        if lo < hi:
+            mask[self.spend_order[lo:hi]] = True
+        return mask
+
+    def advertiser_mask(self, selected: list) -> np.ndarray:
+        if self.advertiser_codes is None:
+            return np.zeros(self.n_rows, dtype=bool)
+        wanted = np.zeros(len(self.advertisers) + 1, dtype=bool)
+        positions = pd.Index(self.advertisers).get_indexer(list(selected))
+        wanted[positions[positions >= 0]] = True
+        # code -1 (missing advertiser) indexes the trailing False slot
+        return wanted[self.advertiser_codes]
+
+    def keyword_mask(self, keyword: str, within: np.ndarray = None) -> np.ndarray:
+        literal = not REGEX_METACHARS.intersection(keyword)
+        pattern = None
+        if not literal:
+            try:
+                pattern = re.compile(keyword, re.IGNORECASE)
+            except re.error:
+                literal = True
+
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for codes, uniques in self.text.values():
+            candidates = None
+            if within is not None and within.sum() < len(uniques):
+                candidates = np.unique(codes[within])
+                candidates = candidates[candidates >= 0]
+                values = uniques.take(candidates)
+            else:
+                values = uniques
+            hits = _match(values, keyword, pattern).to_numpy(zero_copy_only=False)
+            if candidates is not None:
+                table = np.zeros(len(uniques) + 1, dtype=bool)
+                table[candidates] = hits
+            else:
+                table = np.append(hits, False)
+            mask |= table[codes]
+        return mask
+
+    def select(self, min_spend: float = 0.0, max_spend: float = None,
+               advertisers: list = None, keyword: str = "") -> np.ndarray:
+        mask = None
+        if self.spend is not None:
+            upper = self.max_spend if max_spend is None else float(max_spend)
+            mask = self.spend_mask(float(min_spend), upper)
+        if advertisers:
+            adv_mask = self.advertiser_mask(advertisers)
+            mask = adv_mask if mask is None else mask & adv_mask
+        if keyword:
+            kw_mask = self.keyword_mask(keyword, within=mask)
+            mask = kw_mask if mask is None else mask & kw_mask
+
+        if mask is None or mask.all():
+            return None
+        return np.flatnonzero(mask)
+
+    def take(self, df: pd.DataFrame, positions: np.ndarray = None) -> pd.DataFrame:
+        if positions is None:
+            if self.spend is None or self.spend_is_raw:
+                return df
+            return df.assign(Spend=self.spend)
+
+        filtered = df.iloc[positions]
+        if self.spend is not None and not self.spend_is_raw:
+            filtered = filtered.assign(Spend=self.spend[positions])
+        return filtered
+
+    def sort_order(self, df: pd.DataFrame, column: str, ascending: bool = True) -> np.ndarray:
+        # the index is keyed on the whole frame, so a column's order is worked out once per index
+        key = (column, ascending)
+        order = self._sort_orders.get(key)
+        if order is None:
+            if column == "Spend" and self.spend is not None:
+                values = pd.Series(self.spend)
+            else:
+                values = df[column].reset_index(drop=True)
+            try:
+                ranked = values.sort_values(ascending=ascending, kind="stable", na_position="last")
+            except TypeError:
+                # mixed or nested values (e.g. Meta spend ranges) sort by their text form
+                ranked = values.astype(str).sort_values(ascending=ascending, kind="stable", na_position="last")
+            order = ranked.index.to_numpy()
+            self._sort_orders[key] = order
+        return order
+
+    def sorted_positions(self, df: pd.DataFrame, positions: np.ndarray = None,
+                         column: str = None, ascending: bool = True) -> np.ndarray:
+        if not column:
+            return np.arange(self.n_rows) if positions is None else positions
+        order = self.sort_order(df, column, ascending)
+        if positions is None:
+            return order
+        keep = np.zeros(self.n_rows, dtype=bool)
+        keep[positions] = True
+        return order[keep[order]]
+
+
+def _match(values, keyword: str, pattern) -> pa.Array:
+    # values are lowercased; keywords follow str.contains(case=False), so they are regexes
+    if pattern is None:
+        return pc.match_substring(values, keyword.lower())
+    try:
+        return pc.match_substring_regex(values, keyword, ignore_case=True)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # RE2 rejects some Python-only syntax such as lookarounds
+        return pa.array([pattern.search(v) is not None for v in values.to_pylist()], type=pa.bool_())
+
+
+def dataset_fingerprint(df: pd.DataFrame) -> str:
+    return frame_fingerprint(df)
+
+
+def frame_memo(df: pd.DataFrame, name: str, compute):
+    # compute() once per frame object; forgotten when the frame is garbage collected
+    with _index_lock:
+        entry = _frame_memos.get(id(df))
+        if entry is not None and entry[0]() is df and name in entry[1]:
+            return entry[1][name]
+    value = compute()
+    with _index_lock:
+        entry = _frame_memos.get(id(df))
+        if entry is None or entry[0]() is not df:
+            entry = _frame_memos[id(df)] = (weakref.ref(df, _forget_frame(id(df))), {})
+        entry[1][name] = value
+    return value
+
+
+def _forget_frame(frame_id: int):
+    # no lock: this runs wherever the frame is collected, which may be inside frame_memo
+    # with _index_lock held. A memo lost to a race is only worked out again.
+    def forget(ref):
+        entry = _frame_memos.get(frame_id)
+        if entry is not None and entry[0] is ref:
+            _frame_memos.pop(frame_id, None)
+    return forget
+
+
+def get_filter_index(df: pd.DataFrame) -> FilterIndex:
+    # a rerun with the same result frame skips the fingerprint as well as the index build
+    key = frame_memo(df, "fingerprint", lambda: dataset_fingerprint(df))
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    index = FilterIndex(df)
+    with _index_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > FILTER_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
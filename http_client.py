@@ -0,0 +1,200 @@
+import logging
+import os
+import threading
+from collections import Counter, defaultdict, namedtuple
+from urllib.parse import urlsplit
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# connect/read timeouts in seconds, and retries for connection errors and 429/5xx answers.
+# Application-level errors (the Graph API's 613 rate limit) stay with the caller.
+HostPolicy = namedtuple("HostPolicy", "connect_timeout read_timeout retries http2")
+DEFAULT_POLICY = HostPolicy(connect_timeout=5, read_timeout=30, retries=2, http2=False)
+HOST_POLICIES = {
+    "graph.facebook.com": HostPolicy(connect_timeout=5, read_timeout=30, retries=3, http2=True),
+    # the X disclosure ZIP is tens of MB; probes for missing dates are quick 404s
+    "business.x.com": HostPolicy(connect_timeout=5, read_timeout=60, retries=2, http2=False),
+}
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF = 0.5
+# sockets kept open per host; at least as many as searches run in parallel
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 16))
+# HTTP/2 for hosts whose policy allows it; needs httpx with the h2 extra, else requests is used
+HTTP2_ENABLED = os.environ.get("HTTP_CLIENT_HTTP2", "") == "1"
+
+_lock = threading.Lock()
+_session = None
+_http2_clients = {}
+_stats = defaultdict(Counter)
+
+
+def policy(host: str) -> HostPolicy:
+    return HOST_POLICIES.get(host, DEFAULT_POLICY)
+
+
+def get(url: str, params=None, timeout=None, stream: bool = False):
+    # requests.get with a shared keep-alive pool per host; always returns a requests.Response
+    # and raises requests exceptions, whichever transport carried it
+    host = urlsplit(url).hostname or ""
+    host_policy = policy(host)
+    if timeout is None:
+        timeout = (host_policy.connect_timeout, host_policy.read_timeout)
+    _count(host, "requests")
+
+    client = _http2_client(host) if host_policy.http2 and HTTP2_ENABLED else None
+    if client is not None:
+        return _get_http2(client, host, url, params, timeout, stream)
+    return _requests_session().get(url, params=params, timeout=timeout, stream=stream)
+
+
+def stats() -> dict:
+    # host -> requests sent, connections opened and how many requests reused an open one
+    with _lock:
+        counts = {host: dict(c) for host, c in _stats.items()}
+    for c in counts.values():
+        c.setdefault("connections", 0)
+        c["reused"] = max(c.get("requests", 0) - c["connections"], 0)
+    return counts
+
+
+def close():
+    global _session
+    with _lock:
+        session, _session = _session, None
+        clients = [c for c in _http2_clients.values() if c is not None]
+        _http2_clients.clear()
+    if session is not None:
+        session.close()
+    for client in clients:
+        client.close()
+
+
+def _count(host: str, what: str, n: int = 1):
+    with _lock:
+        _stats[host][what] += n
+    metrics.incr(f"http_{what}", n, host=host)
+
+
+def _requests_session():
+    global _session
+    session = _session
+    if session is None:
+        with _lock:
+            if _session is None:
+                _session = _new_session()
+            session = _session
+    return session
+
+
+def _new_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.util.retry import Retry
+
+    # connect() runs once per new socket, so this counts handshakes rather than requests
+    class CountingHTTPConnection(HTTPConnection):
+        def connect(self):
+            _count(self.host, "connections")
+            super().connect()
+
+    class CountingHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            _count(self.host, "connections")
+            super().connect()
+
+    class CountingHTTPPool(HTTPConnectionPool):
+        ConnectionCls = CountingHTTPConnection
+
+    class CountingHTTPSPool(HTTPSConnectionPool):
+        ConnectionCls = CountingHTTPSConnection
+
+    class CountingRetry(Retry):
+        def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+            _count(_pool.host if _pool is not None else "", "retries")
+            return super().increment(method, url, response, error, _pool, _stacktrace)
+
+    def adapter(host_policy):
+        retry = CountingRetry(
+            total=host_policy.retries,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=("GET", "HEAD"),
+            respect_retry_after_header=True,
+            # hand the last 5xx back so raise_for_status reports it as before
+            raise_on_status=False,
+        )
+        mounted = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        mounted.poolmanager.pool_classes_by_scheme = {"http": CountingHTTPPool, "https": CountingHTTPSPool}
+        return mounted
+
+    session = requests.Session()
+    # requests already asks for gzip/deflate and decodes it; spelled out since the payloads depend on it
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    default = adapter(DEFAULT_POLICY)
+    session.mount("http://", default)
+    session.mount("https://", default)
+    for host, host_policy in HOST_POLICIES.items():
+        session.mount(f"https://{host}/", adapter(host_policy))
+    return session
+
+
+def _http2_client(host: str):
+    with _lock:
+        if host in _http2_clients:
+            return _http2_clients[host]
+        client = None
+        try:
+            import h2  # noqa: F401  httpx negotiates HTTP/2 only with it installed
+            import httpx
+        except ImportError:
+            logger.info(f"HTTP/2 requested for {host} but httpx[http2] is not installed; using HTTP/1.1")
+        else:
+            host_policy = policy(host)
+            client = httpx.Client(
+                transport=httpx.HTTPTransport(
+                    http2=True, retries=host_policy.retries, limits=httpx.Limits(max_connections=POOL_MAXSIZE),
+                ),
+                headers={"Accept-Encoding": "gzip, deflate"},
+                follow_redirects=True,
+            )
+        _http2_clients[host] = client
+        return client
+
+
+def _get_http2(client, host: str, url: str, params, timeout, stream: bool):
+    import httpx
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+    def trace(event, info):
+        if event == "connection.connect_tcp.complete":
+            _count(host, "connections")
+
+    try:
+        request = client.build_request(
+            "GET", url, params=params, timeout=httpx.Timeout(read, connect=connect), extensions={"trace": trace},
+        )
+        answer = client.send(request, stream=stream)
+        # a streamed probe only wants the status line; drop the body unread
+        content = b"" if stream else answer.content
+        answer.close()
+    except httpx.TimeoutException as e:
+        raise requests.Timeout(str(e)) from e
+    except httpx.HTTPError as e:
+        raise requests.ConnectionError(str(e)) from e
+
+    response = requests.Response()
+    response.status_code = answer.status_code
+    response.reason = answer.reason_phrase
+    response.url = str(answer.url)
+    response.headers = CaseInsensitiveDict(answer.headers)
+    response.encoding = answer.encoding
+    response._content = content
+    response._content_consumed = True
+    return response
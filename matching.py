@@ -0,0 +1,141 @@
+import re
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+
+from ad_search import normalize_query
+from regions import region_ids
+from x_ads_scraper import STATE_MAPPING
+
+# columns a subscription keyword is looked for in, as ad_search does per query
+MATCH_COLUMNS = {
+    "Google": ("Advertiser Name",),
+    "X": ("Advertiser Name", "Ad Type", "Ad Id", "Ad Url"),
+}
+
+GEO_ALIASES = {"us": "us", "usa": "us", "united states": "us", "united states of america": "us"}
+for _abbr, _name in STATE_MAPPING.items():
+    GEO_ALIASES[_abbr] = GEO_ALIASES[_name] = f"us-{_abbr}"
+for _name, _id in region_ids().items():
+    GEO_ALIASES.setdefault(_name, _id)
+_GEO_SEPARATORS = re.compile(r"[,;|/]")
+
+
+class KeywordAutomaton:
+    # Aho-Corasick over lowercase keywords: one pass over a text finds every keyword it contains
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for i, keyword in enumerate(self.keywords):
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = self._goto[state][ch] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (i,)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> set:
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+def geo_ids(targeting: str) -> frozenset:
+    # "Atlanta, Georgia, United States" -> {"atlanta", "us-ga", "us"}
+    places = (p.strip() for p in _GEO_SEPARATORS.split(targeting.lower()))
+    return frozenset(GEO_ALIASES.get(p, p) for p in places if p)
+
+
+def geo_filter(geography: str):
+    # states and countries compare as canonical ids, so "GA" no longer matches "Michigan";
+    # anything else keeps ad_search's case-insensitive regex over the targeting text
+    canonical = GEO_ALIASES.get(geography)
+    if canonical is not None:
+        return lambda targeting: canonical in geo_ids(targeting)
+    try:
+        pattern = re.compile(geography, re.IGNORECASE)
+    except re.error:
+        pattern = re.compile(re.escape(geography), re.IGNORECASE)
+    return lambda targeting: pattern.search(targeting) is not None
+
+
+class SubscriptionMatcher:
+    # Ad-first matching: each distinct text value in a batch of ads is scanned once for every
+    # subscription keyword, so the cost grows with ads plus subscriptions, not their product.
+
+    def __init__(self, subscriptions: dict):
+        self.queries = defaultdict(list)
+        for sub_id, sub in subscriptions.items():
+            keyword, geography = normalize_query(sub.get("advertiser_keyword", ""), sub.get("geography", ""))
+            if keyword:
+                self.queries[(keyword, geography)].append(sub_id)
+        self.keywords = sorted({keyword for keyword, _ in self.queries})
+        self.automaton = KeywordAutomaton(self.keywords)
+
+    def match(self, ads: pd.DataFrame, platform: str) -> dict:
+        # sub_id -> row positions in ads, in the frame's order
+        by_keyword = self._keyword_rows(ads, MATCH_COLUMNS[platform])
+        geo_codes, geo_values = _factorize(ads["Geography Targeting"])
+        geo_allowed = {}
+
+        matches = {}
+        for (keyword, geography), sub_ids in self.queries.items():
+            rows = by_keyword.get(keyword)
+            if rows is None:
+                continue
+            if geography:
+                if geography not in geo_allowed:
+                    keep = geo_filter(geography)
+                    geo_allowed[geography] = np.array([keep(v) for v in geo_values] + [False], dtype=bool)
+                # code -1 (no targeting) indexes the trailing False
+                rows = rows[geo_allowed[geography][geo_codes[rows]]]
+            for sub_id in sub_ids:
+                matches[sub_id] = rows
+        return matches
+
+    def _keyword_rows(self, ads: pd.DataFrame, columns) -> dict:
+        parts = defaultdict(list)
+        for column in columns:
+            codes, values = _factorize(ads[column])
+            found = [self.automaton.find(str(v).lower()) for v in values]
+            if not any(found):
+                continue
+            # rows grouped by value, so each value's rows are one slice
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            for code, keyword_ids in enumerate(found):
+                for i in keyword_ids:
+                    parts[self.keywords[i]].append(order[bounds[code]:bounds[code + 1]])
+        return {keyword: np.unique(np.concatenate(chunks)) for keyword, chunks in parts.items()}
+
+
+def _factorize(values: pd.Series):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values)
@@ -0,0 +1,237 @@
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# individual span records kept for the JSON report; aggregates are always complete
+MAX_SPAN_RECORDS = 100_000
+PROMETHEUS_PREFIX = "ad_tracker"
+# per-subscription tags stay in the JSON span records only; aggregates and Prometheus drop them
+AGGREGATE_DROP_TAGS = ("subscription",)
+
+_NOOP_SPAN = nullcontext()
+_local = threading.local()
+# collectors can be carried into worker threads, so several threads may add to one
+_collect_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("registry", "name", "tags", "started")
+
+    def __init__(self, registry, name: str, tags: dict):
+        self.registry = registry
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended = time.perf_counter()
+        self.registry._record(self.name, self.tags, self.started, ended - self.started, exc_type is not None)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.utcnow()
+            self._origin = time.perf_counter()
+            self.counters = defaultdict(float)
+            self.span_stats = {}
+            self.spans = []
+            self.dropped_spans = 0
+
+    def span(self, name: str, **tags):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, tags)
+
+    def incr(self, name: str, value: float = 1, **tags):
+        collectors = getattr(_local, "collectors", None)
+        if not (self.enabled or collectors):
+            return
+        key = (name, tuple(sorted(tags.items())))
+        if collectors:
+            with _collect_lock:
+                for counters in collectors:
+                    counters[key] += value
+        if self.enabled:
+            with self._lock:
+                self.counters[key] += value
+
+    def _record(self, name: str, tags: dict, started: float, duration: float, failed: bool):
+        key = (name, tuple(sorted(tags.items())))
+        with self._lock:
+            stats = self.span_stats.get(key)
+            if stats is None:
+                stats = self.span_stats[key] = {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0}
+            stats["count"] += 1
+            stats["errors"] += failed
+            stats["seconds"] += duration
+            stats["max_seconds"] = max(stats["max_seconds"], duration)
+            if len(self.spans) < MAX_SPAN_RECORDS:
+                self.spans.append({
+                    "name": name,
+                    "tags": tags,
+                    "start": round(started - self._origin, 6),
+                    "seconds": round(duration, 6),
+                    "error": failed,
+                })
+            else:
+                self.dropped_spans += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            span_stats = _drop_tags(self.span_stats, _merge_span_stats)
+            return {
+                "started_at": self.started_at.isoformat(),
+                "elapsed_seconds": round(time.perf_counter() - self._origin, 3),
+                # totals per stage and platform; span_records has the per-subscription detail
+                "spans": [
+                    {"name": name, "tags": dict(tags), **{k: round(v, 6) for k, v in stats.items()}}
+                    for (name, tags), stats in sorted(span_stats.items(), key=lambda kv: -kv[1]["seconds"])
+                ],
+                "counters": [
+                    {"name": name, "tags": dict(tags), "value": value}
+                    for (name, tags), value in sorted(self.counters.items())
+                ],
+                "span_records": list(self.spans),
+                "dropped_span_records": self.dropped_spans,
+            }
+
+    def prometheus(self) -> str:
+        with self._lock:
+            span_stats = _drop_tags(self.span_stats, _merge_span_stats)
+            counters = _drop_tags(self.counters, lambda a, b: a + b)
+
+        lines = []
+        for suffix, field, kind, help_text in (
+            ("span_seconds_total", "seconds", "counter", "Time spent in each instrumented stage."),
+            ("span_count_total", "count", "counter", "Number of times each stage ran."),
+            ("span_errors_total", "errors", "counter", "Stages that raised."),
+            ("span_max_seconds", "max_seconds", "gauge", "Slowest single run of each stage."),
+        ):
+            metric = f"{PROMETHEUS_PREFIX}_{suffix}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for (name, tags), stats in sorted(span_stats.items()):
+                lines.append(f"{metric}{_labels(dict(tags, span=name))} {stats[field]:g}")
+
+        for name in sorted({name for name, _ in counters}):
+            metric = f"{PROMETHEUS_PREFIX}_{_metric_name(name)}_total"
+            lines += [f"# TYPE {metric} counter"]
+            for (n, tags), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{metric}{_labels(dict(tags))} {value:g}")
+
+        metric = f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {time.time():.0f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, directory, job: str):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        _atomic_write(directory / f"{job}_report.json", json.dumps(self.report(), indent=2, default=str))
+        # node_exporter's textfile collector only reads *.prom and may read mid-write, hence the rename
+        _atomic_write(directory / f"{job}.prom", self.prometheus())
+        logger.info(f"Wrote {job} metrics to {directory}")
+
+
+def _drop_tags(items: dict, merge) -> dict:
+    out = {}
+    for (name, tags), value in items.items():
+        key = (name, tuple((k, v) for k, v in tags if k not in AGGREGATE_DROP_TAGS))
+        out[key] = merge(out[key], value) if key in out else value
+    return out
+
+
+def _merge_span_stats(a: dict, b: dict) -> dict:
+    return {
+        "count": a["count"] + b["count"],
+        "errors": a["errors"] + b["errors"],
+        "seconds": a["seconds"] + b["seconds"],
+        "max_seconds": max(a["max_seconds"], b["max_seconds"]),
+    }
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _labels(tags: dict) -> str:
+    if not tags:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in tags.values())
+    return "{" + ",".join(f'{_metric_name(k)}="{v}"' for k, v in zip(tags, escaped)) + "}"
+
+
+def _atomic_write(path: Path, text: str):
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            fh.write(text)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+registry = Registry()
+span = registry.span
+incr = registry.incr
+
+
+@contextmanager
+def collect():
+    # counters incremented on this thread inside the block, keyed (name, tags), even while the registry is off
+    counters = defaultdict(float)
+    collectors = getattr(_local, "collectors", None)
+    if collectors is None:
+        collectors = _local.collectors = []
+    collectors.append(counters)
+    try:
+        yield counters
+    finally:
+        collectors.remove(counters)
+
+
+def carry_collectors(fn):
+    # for work handed to a pool: counters it increments reach the submitting thread's collect() blocks
+    collectors = list(getattr(_local, "collectors", None) or ())
+
+    def run(*args, **kwargs):
+        if not collectors:
+            return fn(*args, **kwargs)
+        previous = getattr(_local, "collectors", None)
+        _local.collectors = (previous or []) + collectors
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.collectors = previous
+    return run
+
+
+def counter_value(counters: dict, name: str, **tags) -> float:
+    # sum of a collected counter over every tag set that includes the given tags
+    wanted = set(tags.items())
+    return sum(value for (n, t), value in counters.items() if n == name and wanted <= set(t))
+
+
+def enable(enabled: bool = True):
+    registry.enabled = enabled
+    registry.reset()
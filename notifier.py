@@ -1,86 +1,65 @@
+import argparse
+import functools
+import hashlib
 import smtplib
 import logging
-import json
-import re
-from datetime import datetime
+import os
+import signal
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Optional
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+import numpy as np
 import pandas as pd
-import requests
-import time
 
+import ad_search
+import http_client
+import metrics
+import rollups
+from ad_schema import format_range
+from checkpoints import CheckpointStore
+from circuit_breaker import CircuitBreaker
+from matching import SubscriptionMatcher, geo_filter
 from subscription_manager import load_subscriptions, update_last_seen
-from x_ads_scraper import (
-    download_and_extract_csv,
-    filter_by_advertiser,
-    standardize_columns,
-    expand_geography_search,
-)
 
-import os
-import toml
-from pathlib import Path
+from config import load_config
 
-def _load_config():
-    secrets_path = Path(".streamlit/secrets.toml")
-    secrets = {}
-    if secrets_path.exists():
-        try:
-            secrets = toml.load(secrets_path)
-        except Exception as e:
-            logging.warning(f"Could not load {secrets_path}: {e}")
+# filled from load_config() when the first email goes out; assign them to override
+SMTP_SETTINGS = ("SMTP_HOST", "SMTP_PORT", "SMTP_USER", "SMTP_PASS", "FROM_ADDR")
+SMTP_HOST = SMTP_PORT = SMTP_USER = SMTP_PASS = FROM_ADDR = None
 
-    email_cfg = secrets.get("email") or {}
-    smtp_host = email_cfg.get("smtp_host") or os.environ.get("SMTP_HOST", "smtp.gmail.com")
-    smtp_port = int(email_cfg.get("smtp_port") or os.environ.get("SMTP_PORT", "587"))
-    smtp_user = email_cfg.get("smtp_user") or os.environ.get("SMTP_USER", "")
-    smtp_pass = email_cfg.get("smtp_password") or os.environ.get("SMTP_PASSWORD", "")
-    from_addr = email_cfg.get("from_address") or os.environ.get("FROM_ADDRESS", smtp_user)
+# seconds between passes in --daemon mode; X is only searched again once a new snapshot is published
+DAEMON_INTERVALS = {
+    "Google": int(os.environ.get("NOTIFIER_GOOGLE_INTERVAL", 86400)),
+    "Meta": int(os.environ.get("NOTIFIER_META_INTERVAL", 3600)),
+    "X": int(os.environ.get("NOTIFIER_X_INTERVAL", 900)),
+}
 
-    meta_token = secrets.get("meta_access_token") or os.environ.get("META_ACCESS_TOKEN", "")
-
-    gcp_secrets = secrets.get("gcp_service_account") or {}
-    gcp_json = os.environ.get("GCP_SERVICE_ACCOUNT_JSON")
-    if gcp_json:
-        try:
-            gcp_secrets = json.loads(gcp_json)
-        except json.JSONDecodeError as e:
-            logging.warning(f"GCP_SERVICE_ACCOUNT_JSON invalid JSON: {e}")
-    elif not gcp_secrets:
-        gcp_path = Path(".streamlit/gcp_service_account.json")
-        if gcp_path.exists():
-            try:
-                with open(gcp_path) as f:
-                    gcp_secrets = json.load(f)
-            except Exception as e:
-                logging.warning(f"Could not load {gcp_path}: {e}")
-
-    return {
-        "SMTP_HOST": smtp_host,
-        "SMTP_PORT": smtp_port,
-        "SMTP_USER": smtp_user,
-        "SMTP_PASS": smtp_pass,
-        "FROM_ADDR": from_addr,
-        "META_TOKEN": meta_token,
-        "GCP_SECRETS": gcp_secrets,
-    }
-
-_config = _load_config()
-SMTP_HOST = _config["SMTP_HOST"]
-SMTP_PORT = _config["SMTP_PORT"]
-SMTP_USER = _config["SMTP_USER"]
-SMTP_PASS = _config["SMTP_PASS"]
-FROM_ADDR = _config["FROM_ADDR"]
-META_TOKEN = _config["META_TOKEN"]
-GCP_SECRETS = _config["GCP_SECRETS"]
+# ad-first matching (Google, X) reads the ads that ran within this many days, whenever they
+# started; any of them not in a subscription's last_seen ids is new, as with --per-subscription
+LOOKBACK_DAYS = int(os.environ.get("NOTIFIER_LOOKBACK_DAYS", 14))
+# a catch-up for a platform missed in an earlier run looks back to the day it was missed, up to this
+CATCHUP_MAX_DAYS = int(os.environ.get("NOTIFIER_CATCHUP_MAX_DAYS", 60))
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 logger = logging.getLogger(__name__)
 
 
+def _load_smtp_settings():
+    settings = globals()
+    if all(settings[name] is not None for name in SMTP_SETTINGS):
+        return
+    config = load_config()
+    for name in SMTP_SETTINGS:
+        if settings[name] is None:
+            settings[name] = config[name]
+
 
 def send_email(to_address: str, subject: str, html_body: str):
+    _load_smtp_settings()
     if not (SMTP_USER and SMTP_PASS):
         raise ValueError(
             "Email not configured."
@@ -99,6 +78,12 @@ def send_email(to_address: str, subject: str, html_body: str):
     logger.info(f"Email sent to {to_address}: {subject}")
 
 
+def _cell(value) -> str:
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ""
+    return str(value)
+
+
 def build_email_html(subscription: dict, new_ads: list[dict]) -> str:
     advertiser = subscription.get("advertiser_keyword") or "(any)"
     geography = subscription.get("geography") or "(any)"
@@ -106,16 +91,18 @@ def build_email_html(subscription: dict, new_ads: list[dict]) -> str:
 
     rows_html = ""
     for ad in new_ads[:50]:
-        url = ad.get("Ad Url", "")
+        url = _cell(ad.get("Ad Url"))
         link = f'<a href="{url}">{url[:60]}…</a>' if url else "N/A"
+        start = ad.get("Start Date")
+        start = start.strftime("%Y-%m-%d") if isinstance(start, datetime) and not pd.isna(start) else _cell(start)
         rows_html += f"""
         <tr>
-          <td>{ad.get('Platform','')}</td>
-          <td>{ad.get('Advertiser Name','')}</td>
-          <td>{ad.get('Start Date','')}</td>
-          <td>{ad.get('Geography Targeting','')}</td>
-          <td>{ad.get('Impressions','')}</td>
-          <td>{ad.get('Spend','')}</td>
+          <td>{_cell(ad.get('Platform'))}</td>
+          <td>{_cell(ad.get('Advertiser Name'))}</td>
+          <td>{start}</td>
+          <td>{_cell(ad.get('Geography Targeting'))}</td>
+          <td>{format_range(ad.get('Impressions Min'), ad.get('Impressions Max'))}</td>
+          <td>{format_range(ad.get('Spend Min'), ad.get('Spend Max'))}</td>
           <td>{link}</td>
         </tr>"""
 
@@ -133,7 +120,7 @@ def build_email_html(subscription: dict, new_ads: list[dict]) -> str:
       <thead style="background:#f0f0f0;">
         <tr>
           <th>Platform</th><th>Advertiser</th><th>Start Date</th>
-          <th>Geography</th><th>Impressions</th><th>Spend</th><th>Ad URL</th>
+          <th>Geography</th><th>Impressions</th><th>Spend (USD)</th><th>Ad URL</th>
         </tr>
       </thead>
       <tbody>{rows_html}</tbody>
@@ -145,173 +132,402 @@ def build_email_html(subscription: dict, new_ads: list[dict]) -> str:
     </body></html>"""
 
 
-def fetch_google_ads(advertiser_keyword: str, geography: str) -> pd.DataFrame:
-    from google.oauth2 import service_account
-    from google.cloud import bigquery
-
-    credentials = service_account.Credentials.from_service_account_info(GCP_SECRETS)
-    client = bigquery.Client(credentials=credentials)
-    expanded_geography = expand_geography_search(geography)
-
-    query = """
-    WITH advertiser_base AS (
-      SELECT advertiser_id, advertiser_name
-      FROM `bigquery-public-data.google_political_ads.advertiser_stats`
-      WHERE LOWER(advertiser_name) LIKE LOWER(@advertiser_name)
-    ),
-    creatives AS (
-      SELECT ad_id, advertiser_id, ad_type, ad_url,
-             date_range_start, date_range_end, impressions,
-             (spend_range_min_usd + spend_range_max_usd)/2 AS spend_usd,
-             geo_targeting_included
-      FROM `bigquery-public-data.google_political_ads.creative_stats`
-      WHERE (@geography = "" OR REGEXP_CONTAINS(LOWER(geo_targeting_included), LOWER(@geography)))
-    )
-    SELECT a.advertiser_name AS `Advertiser Name`,
-           c.ad_id AS `Ad Id`, c.ad_url AS `Ad Url`,
-           c.date_range_start AS `Start Date`, c.date_range_end AS `End Date`,
-           c.ad_type AS `Ad Type`, c.geo_targeting_included AS `Geography Targeting`,
-           c.impressions AS `Impressions`, c.spend_usd AS `Spend`
-    FROM advertiser_base a
-    LEFT JOIN creatives c ON a.advertiser_id = c.advertiser_id
-    ORDER BY c.date_range_start DESC
-    """
-    job_config = bigquery.QueryJobConfig(query_parameters=[
-        bigquery.ScalarQueryParameter("advertiser_name", "STRING", f"%{advertiser_keyword}%"),
-        bigquery.ScalarQueryParameter("geography", "STRING", expanded_geography),
-    ])
-    rows = client.query(query, job_config=job_config).result()
-    df = pd.DataFrame([dict(r) for r in rows])
-    if not df.empty:
-        df["Platform"] = "Google"
-    return df
-
-
-def fetch_meta_ads(advertiser_keyword: str, geography: str) -> pd.DataFrame:
-    base_url = "https://graph.facebook.com/v17.0/ads_archive"
-    fields = ("id,page_name,ad_delivery_start_time,ad_delivery_stop_time,"
-              "ad_snapshot_url,spend,impressions,delivery_by_region")
-    params = {
-        "access_token": META_TOKEN,
-        "ad_type": "POLITICAL_AND_ISSUE_ADS",
-        "ad_reached_countries": json.dumps(["US"]),
-        "fields": fields,
-        "limit": 100,
-        "search_terms": advertiser_keyword,
-    }
-    all_ads, url, page_count = [], base_url, 0
-    while page_count < 10:
-        resp = requests.get(url, params=params, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-        for ad in data.get("data", []):
-            if advertiser_keyword.lower() in (ad.get("page_name") or "").lower():
-                all_ads.append(ad)
-        paging = data.get("paging", {})
-        if not paging.get("next"):
-            break
-        url, params, page_count = paging["next"], {}, page_count + 1
-        time.sleep(0.5)
-
-    rows = []
-    for ad in all_ads:
-        regions = [r.get("region", "") for r in (ad.get("delivery_by_region") or []) if isinstance(r, dict)]
-        geo = ", ".join(regions)
-        if geography:
-            exp = expand_geography_search(geography)
-            if not any(re.search(exp, r, re.IGNORECASE) for r in regions):
-                continue
-        rows.append({
-            "Platform": "Meta",
-            "Advertiser Name": ad.get("page_name", ""),
-            "Ad Id": ad.get("id", ""),
-            "Ad Url": ad.get("ad_snapshot_url", ""),
-            "Start Date": ad.get("ad_delivery_start_time", ""),
-            "End Date": ad.get("ad_delivery_stop_time", ""),
-            "Geography Targeting": geo,
-            "Impressions": ad.get("impressions", ""),
-            "Spend": ad.get("spend", ""),
-        })
-    return pd.DataFrame(rows)
-
-
-def fetch_x_ads(advertiser_keyword: str, geography: str) -> pd.DataFrame:
-    df = download_and_extract_csv()
-    df = standardize_columns(df)
-    if advertiser_keyword:
-        df = filter_by_advertiser(df, advertiser_keyword)
-    if geography and "Geography Targeting" in df.columns:
-        exp = expand_geography_search(geography)
-        df = df[df["Geography Targeting"].astype(str).str.contains(exp, case=False, na=False, regex=True)]
-    df["Platform"] = "X"
-    return df
-
-
-
-def run_notifications():
-    subscriptions = load_subscriptions()
+# platforms whose search a subscription's countries narrow; the shared recent-ads read has no
+# country to match on, so country-scoped subscriptions search these themselves
+COUNTRY_SCOPED = ("Google", "Meta")
+
+
+def fetch_google_ads(advertiser_keyword: str, geography: str, countries=()) -> pd.DataFrame:
+    return ad_search.search("Google", advertiser_keyword, geography, {"countries": countries})
+
+
+def fetch_meta_ads(advertiser_keyword: str, geography: str, countries=()) -> pd.DataFrame:
+    # one Ad Library search per country, run at once; no countries means META_COUNTRIES
+    return ad_search.search("Meta", advertiser_keyword, geography, {"countries": countries})
+
+
+def fetch_x_ads(advertiser_keyword: str, geography: str, countries=()) -> pd.DataFrame:
+    # X's disclosure file has no country column
+    return ad_search.search("X", advertiser_keyword, geography)
+
+
+def unseen_ads(df: pd.DataFrame, seen_ids: set) -> pd.DataFrame:
+    ids = df["Ad Id"].fillna("")
+    return df[(ids != "") & ~ids.isin(seen_ids)]
+
+
+def new_ads_for(platform: str, fetch, sub_id: str, advertiser: str, geography: str, seen_ids: set,
+                breaker: Optional[CircuitBreaker] = None) -> Optional[list]:
+    # None when the platform failed or its breaker skipped it, so the caller can defer it
+    if breaker is not None and not breaker.allow():
+        return None
+    try:
+        with metrics.span("fetch", platform=platform, subscription=sub_id):
+            df = fetch(advertiser, geography)
+        with metrics.span("diff", platform=platform, subscription=sub_id):
+            new_ads = unseen_ads(df, seen_ids)
+    except Exception as e:
+        metrics.incr("errors", stage="fetch", platform=platform)
+        logger.error(f"{platform} fetch failed for {sub_id}: {e}")
+        if breaker is not None:
+            breaker.failed(e)
+        return None
+    if breaker is not None:
+        breaker.succeeded()
+    metrics.incr("new_ads", len(new_ads), platform=platform)
+    return new_ads.to_dict("records")
+
+
+def match_recent_ads(subscriptions: dict, platforms, breakers: Optional[dict] = None,
+                     since: Optional[date] = None) -> dict:
+    # one fetch of each platform's recent ads, matched against every subscription in one pass;
+    # platform -> (ads, {sub_id: row positions}), or the exception that stopped it
+    since = since or date.today() - timedelta(days=LOOKBACK_DAYS)
+    matcher = None
+    matched = {}
+    for platform in ad_search.RECENT_ADS:
+        if platform not in platforms:
+            continue
+        breaker = (breakers or {}).get(platform)
+        if breaker is not None and not breaker.allow():
+            matched[platform] = RuntimeError(f"{platform} skipped: circuit breaker open")
+            continue
+        try:
+            with metrics.span("fetch_recent", platform=platform):
+                ads = ad_search.recent_ads(platform, since)
+            with metrics.span("match", platform=platform):
+                matcher = matcher or SubscriptionMatcher(subscriptions)
+                matched[platform] = (ads, matcher.match(ads, platform))
+        except Exception as e:
+            logger.error(f"Fetching recent {platform} ads failed: {e}")
+            matched[platform] = e
+            if breaker is not None:
+                breaker.failed(e)
+            continue
+        if breaker is not None:
+            breaker.succeeded()
+    return matched
+
+
+def matched_ads(result, sub_id: str, advertiser_keyword: str, geography: str) -> pd.DataFrame:
+    if isinstance(result, Exception):
+        raise result
+    ads, matches = result
+    rows = matches.get(sub_id)
+    return ads.iloc[rows] if rows is not None else ads.iloc[:0]
+
+
+def in_geography(fetch):
+    # a search matches geography as a regex over the targeting text ("GA" finds Michigan);
+    # narrow its ads to the places SubscriptionMatcher accepts, so both paths notify the same ads
+    def fetch_in(advertiser_keyword: str, geography: str) -> pd.DataFrame:
+        df = fetch(advertiser_keyword, geography)
+        _, geography = ad_search.normalize_query(advertiser_keyword, geography)
+        if not geography or df.empty:
+            return df
+        keep = geo_filter(geography)
+        codes, values = pd.factorize(df["Geography Targeting"].astype(object))
+        # code -1 (no targeting) indexes the trailing False
+        allowed = np.array([keep(str(v)) for v in values] + [False], dtype=bool)
+        return df[allowed[codes]]
+    return fetch_in
+
+
+def defer(checkpoints: Optional[CheckpointStore], sub_id: str, missed: list, owed: Optional[dict], lookback: date):
+    # the next run searches the missed platforms again, back to the oldest day a run missed
+    for platform in missed:
+        metrics.incr("deferred", platform=platform)
+    if not checkpoints:
+        logger.info(f"{sub_id}: {', '.join(missed)} missed; the next run searches them again")
+        return
+    since = lookback
+    if owed and set(owed["platforms"]) & set(missed):
+        since = min(since, date.fromisoformat(owed["since"]))
+    checkpoints.record(sub_id, "deferred", platforms=sorted(missed), since=since.isoformat())
+    logger.info(f"{sub_id}: {', '.join(missed)} missed; deferred to the next run")
+
+
+def shard_of(sub: dict, shards: int) -> int:
+    # by query rather than subscription id, so subscriptions sharing a search share a shard and its cache
+    keyword, geography = ad_search.normalize_query(sub.get("advertiser_keyword", ""), sub.get("geography", ""))
+    digest = hashlib.sha256(f"{keyword}\0{geography}".encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+def commit_last_seen(sub_id: str, ad_ids: list, sheet_row: int, checkpoints: Optional[CheckpointStore]):
+    with metrics.span("sheet_write", subscription=sub_id):
+        update_last_seen(sub_id, ad_ids, datetime.utcnow().isoformat(), sheet_row_number=sheet_row)
+    if checkpoints:
+        checkpoints.record(sub_id, "committed")
+
+
+def run_notifications(shard: int = 0, shards: int = 1, checkpoints: Optional[CheckpointStore] = None,
+                      platforms: Optional[list] = None, ad_first: bool = True):
+    # platforms limits the pass to those searches; subscriptions to none of them are left alone.
+    # ad_first=False searches each subscription's query on every platform instead.
+    with metrics.span("load_subscriptions"):
+        subscriptions = load_subscriptions()
     if not subscriptions:
         logger.info("No subscriptions found. Exiting.")
         return
 
-    logger.info(f"Processing {len(subscriptions)} subscription(s)...")
+    logger.info(f"Processing {len(subscriptions)} subscription(s)..." if shards == 1 else
+                f"Processing shard {shard + 1}/{shards} of {len(subscriptions)} subscription(s)...")
 
     # Iterate in sheet order so we can pass sheet_row_number (row 2 = first data row)
+    selected = []
+    owed = {}
     for row_index, (sub_id, sub) in enumerate(subscriptions.items()):
+        if shards > 1 and shard_of(sub, shards) != shard:
+            continue
+        # platforms an earlier run missed are caught up on even when this pass is not for them
+        deferred = checkpoints.deferred(sub_id) if checkpoints else None
+        if deferred:
+            owed[sub_id] = deferred
+        catch_up = deferred["platforms"] if deferred else ()
+        sub_platforms = [p for p in sub.get("platforms", ["Google", "Meta", "X"])
+                         if platforms is None or p in platforms or p in catch_up]
+        if sub_platforms:
+            selected.append((row_index, sub_id, sub, sub_platforms))
+
+    # one breaker per platform for the whole run, so an outage costs a few timeouts, not one per subscription
+    breakers = {platform: CircuitBreaker(platform) for platform in ad_search.PLATFORMS}
+    lookback = date.today() - timedelta(days=LOOKBACK_DAYS)
+    matched = {}
+    if ad_first:
+        wanted = {p for _, _, sub, sub_platforms in selected for p in sub_platforms
+                  if not (sub.get("countries") and p in COUNTRY_SCOPED)}
+        # the shared read goes back far enough for the oldest catch-up
+        owed_since = [date.fromisoformat(entry["since"]) for entry in owed.values()
+                      if set(entry["platforms"]) & set(ad_search.RECENT_ADS)]
+        since = max(min([lookback, *owed_since]), date.today() - timedelta(days=CATCHUP_MAX_DAYS))
+        matched = match_recent_ads({sub_id: sub for _, sub_id, sub, _ in selected}, wanted, breakers, since)
+
+    deferred_subs = 0
+    for row_index, sub_id, sub, sub_platforms in selected:
+        metrics.incr("subscriptions")
         email = sub["email"]
         advertiser = sub.get("advertiser_keyword", "")
         geography = sub.get("geography", "")
-        platforms = sub.get("platforms", ["Google", "Meta", "X"])
         seen_ids = set(sub.get("last_seen_ad_ids", []))
+        sheet_row = row_index + 2
+
+        if checkpoints:
+            if checkpoints.done(sub_id):
+                metrics.incr("checkpoint_skipped")
+                continue
+            pending = checkpoints.pending_send(sub_id)
+            if pending:
+                # the email may already be out; record it as seen rather than risk sending it twice
+                logger.info(f"Committing unconfirmed send for {sub_id} from run {pending['run']}")
+                try:
+                    commit_last_seen(sub_id, pending["ad_ids"], sheet_row, checkpoints)
+                except Exception as e:
+                    metrics.incr("errors", stage="sheet_write")
+                    logger.error(f"Failed to commit last seen ads for {sub_id}: {e}")
+                    continue
+                metrics.incr("checkpoint_recommitted")
+                if pending["run"] == checkpoints.run_id:
+                    continue
+                seen_ids = set(pending["ad_ids"])
 
         logger.info(f"Checking subscription {sub_id} for {email} | advertiser={advertiser!r} geo={geography!r}")
 
         all_new_ads = []
-
-        try:
-            if "Google" in platforms and advertiser:
-                df_g = fetch_google_ads(advertiser, geography)
-                for _, row in df_g.iterrows():
-                    ad_id = str(row.get("Ad Id", ""))
-                    if ad_id and ad_id not in seen_ids:
-                        all_new_ads.append(row.to_dict())
-        except Exception as e:
-            logger.error(f"Google fetch failed for {sub_id}: {e}")
-
-        try:
-            if "Meta" in platforms and advertiser:
-                df_m = fetch_meta_ads(advertiser, geography)
-                for _, row in df_m.iterrows():
-                    ad_id = str(row.get("Ad Id", ""))
-                    if ad_id and ad_id not in seen_ids:
-                        all_new_ads.append(row.to_dict())
-        except Exception as e:
-            logger.error(f"Meta fetch failed for {sub_id}: {e}")
-
-        try:
-            if "X" in platforms and advertiser:
-                df_x = fetch_x_ads(advertiser, geography)
-                for _, row in df_x.iterrows():
-                    ad_id = str(row.get("Ad Id", ""))
-                    if ad_id and ad_id not in seen_ids:
-                        all_new_ads.append(row.to_dict())
-        except Exception as e:
-            logger.error(f"X fetch failed for {sub_id}: {e}")
+        missed = []
+        if advertiser:
+            for platform, fetch in (("Google", fetch_google_ads), ("Meta", fetch_meta_ads), ("X", fetch_x_ads)):
+                if platform not in sub_platforms:
+                    continue
+                breaker = breakers[platform]
+                countries = sub.get("countries") or ()
+                fetch = functools.partial(fetch, countries=countries)
+                if platform in matched and not (countries and platform in COUNTRY_SCOPED):
+                    fetch = functools.partial(matched_ads, matched[platform], sub_id)
+                    # the shared fetch already went through the breaker
+                    breaker = None
+                elif platform in ad_search.RECENT_ADS:
+                    fetch = in_geography(fetch)
+                found = new_ads_for(platform, fetch, sub_id, advertiser, geography, seen_ids, breaker)
+                if found is None:
+                    missed.append(platform)
+                else:
+                    all_new_ads.extend(found)
+        if checkpoints:
+            checkpoints.record(sub_id, "fetched", new_ads=len(all_new_ads))
 
         if all_new_ads:
             logger.info(f"Found {len(all_new_ads)} new ads for {email}. Sending email...")
             subject = f"Found {len(all_new_ads)} New Ad(s) — {advertiser or geography}"
-            html = build_email_html(sub, all_new_ads)
+            with metrics.span("render", subscription=sub_id):
+                html = build_email_html(sub, all_new_ads)
+            new_ids = (list(seen_ids) + [str(a.get("Ad Id", "")) for a in all_new_ads])[-5000:]
+            if checkpoints:
+                checkpoints.record(sub_id, "sent", ad_ids=new_ids)
             try:
-                send_email(email, subject, html)
-                new_ids = list(seen_ids) + [str(a.get("Ad Id", "")) for a in all_new_ads]
-                sheet_row = row_index + 2
-                update_last_seen(sub_id, new_ids[-5000:], datetime.utcnow().isoformat(), sheet_row_number=sheet_row)
+                with metrics.span("send", subscription=sub_id):
+                    send_email(email, subject, html)
             except Exception as e:
+                if checkpoints:
+                    checkpoints.record(sub_id, "failed")
+                metrics.incr("errors", stage="email")
                 logger.error(f"Failed to send email to {email}: {e}")
+                continue
+            metrics.incr("emails_sent")
+            try:
+                commit_last_seen(sub_id, new_ids, sheet_row, checkpoints)
+            except Exception as e:
+                metrics.incr("errors", stage="sheet_write")
+                logger.error(f"Failed to update last seen ads for {sub_id}: {e}")
+                continue
         else:
             logger.info(f"No new ads for {email}.")
+            if checkpoints and not missed:
+                checkpoints.record(sub_id, "committed")
+        if missed:
+            defer(checkpoints, sub_id, missed, owed.get(sub_id), lookback)
+            deferred_subs += 1
+
+    _log_breakers(breakers, deferred_subs)
+
+
+def _checkpoint_store(args, run_id: str) -> Optional[CheckpointStore]:
+    if not args.checkpoint_dir:
+        return None
+    return CheckpointStore(args.checkpoint_dir, run_id, args.shard, args.shards)
+
+
+def run_daemon(args, metrics_dir: Optional[str]):
+    # stays resident so clients, the sheet handle and search results stay warm between passes
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+
+    next_due = {platform: 0.0 for platform in DAEMON_INTERVALS}
+    x_version = None
+    logger.info(f"Notifier daemon started; intervals {DAEMON_INTERVALS}")
+    while not stop.is_set():
+        now = time.monotonic()
+        due = [platform for platform, at in next_due.items() if at <= now]
+        for platform in due:
+            next_due[platform] = now + DAEMON_INTERVALS[platform]
+
+        if "X" in due:
+            try:
+                version = ad_search.x_snapshot_version()
+            except Exception as e:
+                logger.error(f"Could not check for a new X snapshot: {e}")
+                version = None
+            if version is None or version == x_version:
+                due.remove("X")
+            else:
+                logger.info(f"New X snapshot: {version}")
+                x_version = version
+
+        if due:
+            for platform in due:
+                # this process's copies only: results on disk older than the platform's interval
+                # are already stale through CACHE_MAX_AGE, and newer ones are shared with the app
+                ad_search.clear_cache(platform, disk=False)
+                metrics.incr("daemon_passes", platform=platform)
+            run_id = f"{args.run_id or 'daemon'}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}"
+            checkpoints = _checkpoint_store(args, run_id)
+            try:
+                with metrics.span("pass"):
+                    run_notifications(args.shard, args.shards, checkpoints, platforms=due,
+                                      ad_first=not args.per_subscription)
+            except Exception as e:
+                metrics.incr("errors", stage="pass")
+                logger.error(f"Notifier pass for {', '.join(due)} failed: {e}")
+            finally:
+                if checkpoints:
+                    checkpoints.close()
+                if metrics_dir:
+                    metrics.registry.write_reports(metrics_dir, _job_name(args, "notifier-daemon"))
+
+        stop.wait(max(0.0, min(next_due.values()) - time.monotonic()))
+    rollups.flush()
+    _log_connections()
+    _log_cache()
+    logger.info("Notifier daemon stopped.")
+
+
+def _log_breakers(breakers: dict, deferred: int):
+    tripped = {platform: breaker.summary() for platform, breaker in breakers.items() if breaker.trips}
+    for platform, summary in tripped.items():
+        logger.warning(f"Circuit breaker for {platform} tripped {summary['trips']} time(s), now {summary['state']}: "
+                       f"{summary['skipped']} fetch(es) skipped, {summary['probes']} probe(s); "
+                       f"last error: {summary['last_error']}")
+    if deferred:
+        logger.warning(f"{deferred} subscription(s) deferred to the next run"
+                       f"{' (tripped: ' + ', '.join(tripped) + ')' if tripped else ''}")
+
+
+def _log_connections():
+    for host, counts in http_client.stats().items():
+        logger.info(f"HTTP {host}: {counts.get('requests', 0)} request(s) over {counts['connections']} connection(s), "
+                    f"{counts.get('retries', 0)} retried")
+
+
+def _log_cache():
+    counts = ad_search.cache_stats()
+    logger.info(f"Result cache: {counts['entries']} result(s), {counts['bytes'] / (1024 * 1024):.1f} MB in memory; "
+                f"{counts['hits']} hit(s), {counts['misses']} miss(es), {counts['evicted']} evicted, "
+                f"{counts['rejected']} too large to keep")
+
+
+def _job_name(args, job: str) -> str:
+    return job if args.shards == 1 else f"{job}-shard-{args.shard}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Email subscribers about new political ads.")
+    parser.add_argument("--shard", type=int, default=int(os.environ.get("NOTIFIER_SHARD", 0)),
+                        help="which shard of the subscriptions to process (0-based)")
+    parser.add_argument("--shards", type=int, default=int(os.environ.get("NOTIFIER_SHARDS", 1)),
+                        help="number of shards the subscriptions are split into")
+    parser.add_argument("--checkpoint-dir", default=os.environ.get("NOTIFIER_CHECKPOINT_DIR"),
+                        help="directory for per-subscription checkpoints; enables resuming")
+    parser.add_argument("--run-id", default=os.environ.get("NOTIFIER_RUN_ID") or os.environ.get("GITHUB_RUN_ID"),
+                        help="runs with the same id resume each other (default: GITHUB_RUN_ID, else a new id)")
+    parser.add_argument("--per-subscription", action="store_true",
+                        help="search every subscription's query on every platform instead of matching "
+                             f"the Google and X ads that ran in the last {LOOKBACK_DAYS} days against all subscriptions")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and check each platform on its own schedule (see DAEMON_INTERVALS)")
+    args = parser.parse_args(argv)
+    if not 0 <= args.shard < args.shards:
+        parser.error(f"--shard must be between 0 and {args.shards - 1}")
+
+    # results the app (or an earlier run) left in the shared disk cache are reused while
+    # they are younger than the platform's schedule
+    ad_search.CACHE_MAX_AGE.update(DAEMON_INTERVALS)
+    # every frame a run fetches is folded into the spend rollups (ROLLUP_DB; empty turns it off),
+    # on a writer thread so the fetches don't wait for it
+    rollups.track(background=True)
+
+    # set NOTIFIER_METRICS_DIR to get notifier_report.json and notifier.prom for the run
+    metrics_dir = os.environ.get("NOTIFIER_METRICS_DIR")
+    if metrics_dir:
+        metrics.enable()
+
+    if args.daemon:
+        run_daemon(args, metrics_dir)
+        return
+
+    checkpoints = _checkpoint_store(args, args.run_id or datetime.utcnow().strftime("%Y%m%dT%H%M%S"))
+    try:
+        with metrics.span("run"):
+            run_notifications(args.shard, args.shards, checkpoints, ad_first=not args.per_subscription)
+    finally:
+        if checkpoints:
+            checkpoints.close()
+        rollups.flush()
+        _log_connections()
+        _log_cache()
+        if metrics_dir:
+            metrics.registry.write_reports(metrics_dir, _job_name(args, "notifier"))
 
 
 if __name__ == "__main__":
-    run_notifications()
\ No newline at end of file
+    main()
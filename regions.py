@@ -0,0 +1,70 @@
+import re
+
+from x_ads_scraper import STATE_MAPPING
+
+# First-level regions by ISO country code, abbreviation -> name as the Ad Library reports it
+# in delivery_by_region (lowercase). A country missing here is still searchable; its
+# geography box is then matched against the region names as typed.
+COUNTRY_REGIONS = {
+    "US": dict(STATE_MAPPING),
+    "CA": {
+        "ab": "alberta", "bc": "british columbia", "mb": "manitoba", "nb": "new brunswick",
+        "nl": "newfoundland and labrador", "ns": "nova scotia", "nt": "northwest territories", "nu": "nunavut",
+        "on": "ontario", "pe": "prince edward island", "qc": "quebec", "sk": "saskatchewan", "yt": "yukon",
+    },
+    "GB": {"eng": "england", "sct": "scotland", "wls": "wales", "nir": "northern ireland"},
+    "AU": {
+        "act": "australian capital territory", "nsw": "new south wales", "nt": "northern territory",
+        "qld": "queensland", "sa": "south australia", "tas": "tasmania", "vic": "victoria", "wa": "western australia",
+    },
+}
+COUNTRY_NAMES = {"US": "united states", "CA": "canada", "GB": "united kingdom", "AU": "australia"}
+DEFAULT_COUNTRIES = ("US",)
+
+_COUNTRY_CODE = re.compile(r"^[A-Z]{2}$")
+_SEPARATORS = re.compile(r"[\s,;|/]+")
+
+
+def normalize_countries(countries) -> tuple:
+    # "us, ca" or ["US", "CA"] -> ("US", "CA"): upper case, in order, each once
+    if isinstance(countries, str):
+        countries = _SEPARATORS.split(countries)
+    out = []
+    for country in countries or ():
+        country = str(country).strip().upper()
+        if not country:
+            continue
+        if not _COUNTRY_CODE.match(country):
+            raise ValueError(f"Not a two-letter ISO country code: {country!r}")
+        if country not in out:
+            out.append(country)
+    return tuple(out)
+
+
+def region_pattern(geography: str, countries=DEFAULT_COUNTRIES) -> str:
+    # the geography box as a regex over region names: an abbreviation or name of a region in
+    # one of the countries matches either spelling ("ga" -> "(?:ga|georgia)"); anything else
+    # is used as typed
+    if not geography:
+        return geography
+    place = geography.lower().strip()
+    spellings = []
+    for country in countries or DEFAULT_COUNTRIES:
+        for abbr, name in COUNTRY_REGIONS.get(country, {}).items():
+            if place in (abbr, name):
+                spellings += [s for s in (abbr, name) if s not in spellings]
+    return f"(?:{'|'.join(spellings)})" if spellings else geography
+
+
+def region_ids() -> dict:
+    # region and country names -> canonical ids ("ontario" -> "ca-on", "canada" -> "ca") for
+    # every country but the US, whose abbreviations matching.py adds; abbreviations elsewhere
+    # are ambiguous ("wa", "nt") and left out
+    ids = {}
+    for country, regions in COUNTRY_REGIONS.items():
+        if country == "US":
+            continue
+        ids[COUNTRY_NAMES[country]] = country.lower()
+        for abbr, name in regions.items():
+            ids.setdefault(name, f"{country.lower()}-{abbr}")
+    return ids
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+import metrics
+from ad_schema import empty_ads
+
+logger = logging.getLogger(__name__)
+
+# Search results on disk, shared by every process on the host: the app's replicas and
+# restarts, and the notifier. One Arrow IPC file per query; the write time lives in the
+# file, the last use in its mtime (for LRU eviction).
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", str(Path(tempfile.gettempdir()) / "ad_tracker_results"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# bump when the stored frame layout changes; older files are then never read and age out
+RESULT_CACHE_FORMAT = 1
+# seconds between full scans of the directory; in between, each process only adds up what it
+# wrote itself, so other processes' files are noticed at the next scan
+RESULT_CACHE_RESCAN = int(os.environ.get("RESULT_CACHE_RESCAN", 300))
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        # bytes in the directory as of the last scan, plus what this process wrote since
+        self._bytes = None
+        self._scanned = 0.0
+
+    def path(self, key: tuple) -> Path:
+        # taken before the result is computed, so one fetched under an older generation
+        # is written where the current generation never looks
+        platform = key[0].split()[0]
+        ident = json.dumps([RESULT_CACHE_FORMAT, self.generation(platform), *key], default=str)
+        return self.directory / f"{hashlib.sha256(ident.encode()).hexdigest()[:32]}.arrow"
+
+    def get(self, path: Path, max_age: float) -> Optional[tuple]:
+        # (frame, seconds since it was written), or None
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+
+        try:
+            with pa.memory_map(str(path)) as source:
+                table = ipc.open_file(source).read_all()
+                age = time.time() - float((table.schema.metadata or {}).get(b"written", 0))
+                if age > max_age:
+                    return None
+                # an empty frame loses its categories on the way through Arrow
+                df = table.to_pandas() if table.num_rows else empty_ads()
+        except (FileNotFoundError, pa.ArrowInvalid, OSError):
+            # not cached, or evicted meanwhile
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return df, age
+
+    def put(self, path: Path, df: pd.DataFrame):
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            logger.warning(f"Not caching {path.name} on disk: {e}")
+            return
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"written": str(time.time()).encode()})
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                with ipc.new_file(fh, table.schema, options=ipc.IpcWriteOptions(compression="zstd")) as writer:
+                    writer.write_table(table)
+                written = fh.tell()
+            try:
+                written -= path.stat().st_size
+            except FileNotFoundError:
+                pass
+            # readers see the old file or the new one, never a partial write
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        if self._bytes is not None:
+            self._bytes += written
+        if (self._bytes is None or self._bytes > self.max_bytes
+                or time.monotonic() - self._scanned > RESULT_CACHE_RESCAN):
+            self._evict()
+
+    def generation(self, platform: str) -> str:
+        try:
+            return (self.directory / f"generation-{platform}").read_text().strip()
+        except FileNotFoundError:
+            return "0"
+
+    def invalidate(self, platform: str):
+        # a new generation changes every key of the platform; the old files are never
+        # read again and go when the byte budget needs the room
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        with os.fdopen(fd, "w") as fh:
+            fh.write(str(time.time_ns()))
+        os.replace(tmp_name, self.directory / f"generation-{platform}")
+
+    def _evict(self):
+        # several processes may evict at once; each unlink is allowed to lose the race
+        files = []
+        for p in self.directory.glob("*.arrow"):
+            try:
+                info = p.stat()
+            except FileNotFoundError:
+                continue
+            files.append((info.st_mtime, info.st_size, p))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            for _, size, p in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                p.unlink(missing_ok=True)
+                metrics.incr("result_cache_evictions")
+                total -= size
+        self._bytes = total
+        self._scanned = time.monotonic()
@@ -0,0 +1,380 @@
+import argparse
+import functools
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Spend and impression bounds summed per platform, advertiser, canonical geography and day
+# (the ad's start day), kept in SQLite next to each ad's last contribution. Every fetched
+# frame is folded in as it arrives: ads seen before with the same numbers are skipped, a
+# changed ad takes its old contribution out and puts the new one in. Nothing is recomputed.
+ROLLUP_DB = os.environ.get("ROLLUP_DB", str(Path(tempfile.gettempdir()) / "ad_tracker_rollups.sqlite"))
+# a refresh re-reads this many days before the last one, for ads whose numbers moved since
+ROLLUP_OVERLAP_DAYS = int(os.environ.get("ROLLUP_OVERLAP_DAYS", 14))
+# how far back the first refresh of an empty store reads
+ROLLUP_BACKFILL_DAYS = int(os.environ.get("ROLLUP_BACKFILL_DAYS", 365))
+# fetched frames waiting for the background writer; past this the oldest is dropped rather than
+# held in memory (a later --refresh picks up the Google and X ads it had)
+ROLLUP_QUEUE_SIZE = int(os.environ.get("ROLLUP_QUEUE_SIZE", 32))
+
+DIMENSIONS = {"Platform": "platform", "Advertiser": "advertiser", "Geography": "geo", "Day": "day"}
+# an ad without targeting text is counted under NO_GEOGRAPHY; every ad is also counted once
+# under ALL_GEOGRAPHIES, so totals that are not split by place count each ad once
+NO_GEOGRAPHY = ""
+ALL_GEOGRAPHIES = "*"
+_CONTRIBUTION = ["platform", "ad_id", "fingerprint", "advertiser", "geos", "day",
+                 "spend_min", "spend_max", "impressions_min", "impressions_max"]
+_MEASURES = ["spend_min", "spend_max", "impressions_min", "impressions_max"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ads (
+    platform TEXT NOT NULL, ad_id TEXT NOT NULL, fingerprint INTEGER NOT NULL,
+    advertiser TEXT NOT NULL, geos TEXT NOT NULL, day TEXT NOT NULL,
+    spend_min REAL NOT NULL, spend_max REAL NOT NULL, impressions_min REAL NOT NULL, impressions_max REAL NOT NULL,
+    PRIMARY KEY (platform, ad_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollups (
+    platform TEXT NOT NULL, advertiser TEXT NOT NULL, geo TEXT NOT NULL, day TEXT NOT NULL,
+    ads INTEGER NOT NULL, spend_min REAL NOT NULL, spend_max REAL NOT NULL,
+    impressions_min REAL NOT NULL, impressions_max REAL NOT NULL,
+    PRIMARY KEY (platform, advertiser, geo, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollups_day ON rollups (day);
+CREATE INDEX IF NOT EXISTS rollups_geo_day ON rollups (geo, day);
+CREATE TABLE IF NOT EXISTS refreshed (platform TEXT PRIMARY KEY, through TEXT NOT NULL, at REAL NOT NULL);
+"""
+
+
+class RollupStore:
+    def __init__(self, path=ROLLUP_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # a connection per call: the app's search threads and the notifier share the file
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return _Closing(conn)
+
+    def ingest(self, df: pd.DataFrame) -> dict:
+        # folds a normalized ads frame in; counts of new, changed and unchanged ads
+        incoming = contributions(df)
+        counts = {"new": 0, "changed": 0, "unchanged": 0}
+        if incoming.empty:
+            return counts
+        with self._connect() as conn:
+            # one writer at a time, so the comparison and the update see the same rows
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS incoming AS SELECT * FROM ads WHERE 0")
+                conn.execute("DELETE FROM incoming")
+                conn.executemany(
+                    f"INSERT INTO incoming VALUES ({', '.join('?' * len(_CONTRIBUTION))})",
+                    _rows(incoming),
+                )
+                old = pd.read_sql_query(
+                    "SELECT a.* FROM ads a JOIN incoming i USING (platform, ad_id) WHERE a.fingerprint != i.fingerprint",
+                    conn,
+                )
+                fresh = pd.read_sql_query(
+                    "SELECT i.* FROM incoming i LEFT JOIN ads a USING (platform, ad_id) "
+                    "WHERE a.fingerprint IS NULL OR a.fingerprint != i.fingerprint",
+                    conn,
+                )
+                if not fresh.empty:
+                    _apply(conn, pd.concat([_exploded(fresh, 1), _exploded(old, -1)], ignore_index=True))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO ads SELECT i.* FROM incoming i LEFT JOIN ads a USING (platform, ad_id) "
+                        "WHERE a.fingerprint IS NULL OR a.fingerprint != i.fingerprint"
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        counts["changed"] = len(old)
+        counts["new"] = len(fresh) - len(old)
+        counts["unchanged"] = len(incoming) - len(fresh)
+        for change, n in counts.items():
+            metrics.incr("rollup_ads", n, change=change)
+        return counts
+
+    def query(self, by=("Advertiser",), platforms=None, advertiser: str = "", geography: str = "",
+              since: Optional[date] = None, until: Optional[date] = None, limit: Optional[int] = None) -> pd.DataFrame:
+        # summed bounds grouped by the named DIMENSIONS, largest spend first. Grouped by
+        # geography, an ad targeting several places counts in each of them.
+        from matching import GEO_ALIASES
+
+        where, params = [], []
+        if platforms:
+            where.append(f"platform IN ({', '.join('?' * len(platforms))})")
+            params += list(platforms)
+        if advertiser:
+            where.append("advertiser LIKE ?")
+            params.append(f"%{advertiser}%")
+        if geography:
+            place = geography.strip().lower()
+            where.append("geo = ?")
+            params.append(GEO_ALIASES.get(place, place))
+        elif "Geography" in by:
+            where.append("geo != ?")
+            params.append(ALL_GEOGRAPHIES)
+        else:
+            where.append("geo = ?")
+            params.append(ALL_GEOGRAPHIES)
+        if since is not None:
+            where.append("day >= ?")
+            params.append(since.isoformat())
+        if until is not None:
+            where.append("day <= ?")
+            params.append(until.isoformat())
+        columns = [DIMENSIONS[name] for name in by]
+        select = ", ".join(f"{col} AS \"{name}\"" for name, col in zip(by, columns))
+        sql = (f"SELECT {select + ', ' if select else ''}SUM(ads) AS \"Ads\", "
+               "SUM(spend_min) AS \"Spend Min\", SUM(spend_max) AS \"Spend Max\", "
+               "SUM(impressions_min) AS \"Impressions Min\", SUM(impressions_max) AS \"Impressions Max\" "
+               f"FROM rollups {'WHERE ' + ' AND '.join(where) if where else ''} "
+               f"{'GROUP BY ' + ', '.join(columns) if columns else ''} "
+               f"ORDER BY {'day' if columns == ['day'] else 'SUM(spend_max) DESC'}"
+               f"{' LIMIT ?' if limit else ''}")
+        if limit:
+            params.append(limit)
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def refresh(self, platforms=None) -> dict:
+        # new and changed ads since the last refresh (less the overlap), for platforms that
+        # can list recent ads; Meta only arrives through searches
+        import ad_search
+
+        today = date.today()
+        done = {}
+        for platform in platforms or ad_search.RECENT_ADS:
+            through = self.refreshed(platform)
+            since = (through - timedelta(days=ROLLUP_OVERLAP_DAYS) if through
+                     else today - timedelta(days=ROLLUP_BACKFILL_DAYS))
+            with metrics.span("rollup_refresh", platform=platform):
+                done[platform] = self.ingest(ad_search.recent_ads(platform, since))
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO refreshed VALUES (?, ?, ?)", (platform, today.isoformat(), time.time()))
+            logger.info(f"Rollups: {platform} since {since}: {done[platform]}")
+        return done
+
+    def refreshed(self, platform: str) -> Optional[date]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT through FROM refreshed WHERE platform = ?", (platform,)).fetchone()
+        return date.fromisoformat(row[0]) if row else None
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            ads = conn.execute("SELECT COUNT(*) FROM ads").fetchone()[0]
+            rows = conn.execute("SELECT COUNT(*) FROM rollups").fetchone()[0]
+            days = conn.execute("SELECT MIN(day), MAX(day) FROM rollups WHERE day != ''").fetchone()
+        return {"ads": ads, "rollups": rows, "first_day": days[0], "last_day": days[1]}
+
+
+class _Closing:
+    # sqlite3's own context manager commits but never closes
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, *exc):
+        self.conn.close()
+
+
+def contributions(df: pd.DataFrame) -> pd.DataFrame:
+    # one row per ad with an id: what it adds to the rollups, and a fingerprint of that.
+    # An open-ended upper bound (Meta's top bucket) counts at its lower bound.
+    from matching import geo_ids
+
+    df = df[df["Ad Id"].notna() & (df["Ad Id"] != "")]
+    if df.empty:
+        return pd.DataFrame(columns=_CONTRIBUTION)
+    out = pd.DataFrame({
+        "platform": df["Platform"].astype(str).to_numpy(),
+        "ad_id": df["Ad Id"].astype(str).to_numpy(),
+        "advertiser": df["Advertiser Name"].astype(object).fillna("").astype(str).to_numpy(),
+        "day": df["Start Date"].dt.strftime("%Y-%m-%d").fillna("").to_numpy(),
+    })
+    # targeting texts repeat a lot; canonicalize each distinct one once
+    codes, texts = pd.factorize(df["Geography Targeting"].astype(object).fillna("").astype(str))
+    canonical = ["|".join(sorted(geo_ids(text))) for text in texts]
+    out["geos"] = pd.Series(canonical, dtype=object).iloc[codes].to_numpy() if len(texts) else ""
+    for col, lo, hi in (("spend", "Spend Min", "Spend Max"), ("impressions", "Impressions Min", "Impressions Max")):
+        low = df[lo].astype("float64").fillna(0).to_numpy()
+        out[f"{col}_min"] = low
+        out[f"{col}_max"] = df[hi].astype("float64").fillna(pd.Series(low, index=df.index)).to_numpy()
+    out = out.drop_duplicates(["platform", "ad_id"], keep="last")
+    hashed = pd.util.hash_pandas_object(out[["advertiser", "geos", "day", *_MEASURES]], index=False)
+    out["fingerprint"] = hashed.to_numpy().view("int64")
+    return out[_CONTRIBUTION].reset_index(drop=True)
+
+
+def _rows(df: pd.DataFrame):
+    # plain Python values; iterating Arrow-backed strings row by row is several times slower
+    return zip(*(df[col].tolist() for col in df.columns))
+
+
+def _exploded(ads: pd.DataFrame, sign: int) -> pd.DataFrame:
+    # one row per (ad, geography) it counts in, ALL_GEOGRAPHIES included, signed
+    if ads.empty:
+        return pd.DataFrame(columns=["platform", "advertiser", "geo", "day", "ads", *_MEASURES])
+    out = ads.assign(geo=(ads["geos"] + "|" + ALL_GEOGRAPHIES).str.split("|")).explode("geo")
+    out["ads"] = sign
+    for col in _MEASURES:
+        out[col] = out[col] * sign
+    return out[["platform", "advertiser", "geo", "day", "ads", *_MEASURES]]
+
+
+def _apply(conn, deltas: pd.DataFrame):
+    keys = ["platform", "advertiser", "geo", "day"]
+    summed = deltas.groupby(keys, sort=False)[["ads", *_MEASURES]].sum().reset_index()
+    summed = summed[summed[["ads", *_MEASURES]].ne(0).any(axis=1)]
+    conn.executemany(
+        "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (platform, advertiser, geo, day) DO UPDATE SET "
+        "ads = ads + excluded.ads, spend_min = spend_min + excluded.spend_min, spend_max = spend_max + excluded.spend_max, "
+        "impressions_min = impressions_min + excluded.impressions_min, "
+        "impressions_max = impressions_max + excluded.impressions_max",
+        _rows(summed.astype({"ads": "int64"})),
+    )
+    conn.execute("DELETE FROM rollups WHERE ads <= 0")
+    metrics.incr("rollup_rows", len(summed))
+
+
+_store = None
+_ingesters = {}
+
+
+def rollup_store() -> Optional[RollupStore]:
+    # the process's store, or None with an empty ROLLUP_DB
+    global _store
+    if _store is None and ROLLUP_DB:
+        _store = RollupStore(ROLLUP_DB)
+    return _store
+
+
+def track(store: Optional[RollupStore] = None, background: bool = False):
+    # fold every frame the searches fetch into the store from now on. background=True hands
+    # the work to a writer thread, so a search returns before its rows are folded in.
+    import ad_search
+
+    store = store or rollup_store()
+    if store is None:
+        return None
+    ad_search.on_fetch(_ingester(store, background))
+    return store
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    # waits for the background writers to fold in what they were handed; False on timeout
+    writers = [listener for listener in _ingesters.values() if isinstance(listener, _Writer)]
+    return all(writer.flush(timeout) for writer in writers)
+
+
+def _ingester(store: RollupStore, background: bool):
+    # one listener per store, so calling track() again adds nothing
+    listener = _ingesters.get(store.path)
+    if listener is None:
+        listener = _ingesters[store.path] = _Writer(store) if background else functools.partial(_ingest, store)
+    return listener
+
+
+def _ingest(store: RollupStore, platform: str, df: pd.DataFrame):
+    with metrics.span("rollup", platform=platform):
+        store.ingest(df)
+
+
+class _Writer:
+    # Folds fetched frames into a store on its own thread. Frames that arrive while an ingest
+    # runs are folded in together next time, per platform, so searches that overlap cost one
+    # pass over their distinct ads instead of one per search.
+
+    def __init__(self, store: RollupStore):
+        self.store = store
+        self.pending = deque()
+        self.busy = False
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="rollups", daemon=True).start()
+
+    def __call__(self, platform: str, df: pd.DataFrame):
+        with self._cond:
+            if len(self.pending) >= ROLLUP_QUEUE_SIZE:
+                dropped_platform, dropped = self.pending.popleft()
+                metrics.incr("rollup_dropped", len(dropped), platform=dropped_platform)
+                logger.warning(f"Rollups: {len(self.pending) + 1} frames waiting; "
+                               f"dropped {len(dropped):,} {dropped_platform} ads")
+            self.pending.append((platform, df))
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.pending and not self.busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.pending)
+                batch = list(self.pending)
+                self.pending.clear()
+                self.busy = True
+            try:
+                for platform in dict.fromkeys(platform for platform, _ in batch):
+                    frames = [df for p, df in batch if p == platform]
+                    try:
+                        _ingest(self.store, platform, frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True))
+                    except Exception as e:
+                        logger.error(f"Rollups: folding in {sum(map(len, frames)):,} {platform} ads failed: {e}")
+            finally:
+                with self._cond:
+                    self.busy = False
+                    self._cond.notify_all()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Refresh or query the spend rollups.")
+    parser.add_argument("--db", default=ROLLUP_DB, help="rollup database (default: ROLLUP_DB)")
+    parser.add_argument("--refresh", action="store_true", help="fold in new and changed Google and X ads")
+    parser.add_argument("--by", default="Advertiser", help=f"comma-separated dimensions: {', '.join(DIMENSIONS)}")
+    parser.add_argument("--advertiser", default="")
+    parser.add_argument("--geography", default="")
+    parser.add_argument("--since", type=date.fromisoformat)
+    parser.add_argument("--until", type=date.fromisoformat)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+    by = [name.strip().title() for name in args.by.split(",") if name.strip()]
+    unknown = [name for name in by if name not in DIMENSIONS]
+    if unknown:
+        parser.error(f"unknown dimension(s): {', '.join(unknown)}")
+
+    store = RollupStore(args.db)
+    if args.refresh:
+        import ad_search
+
+        ad_search.configure()
+        store.refresh()
+    table = store.query(by, advertiser=args.advertiser, geography=args.geography,
+                        since=args.since, until=args.until, limit=args.limit)
+    print(table.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import time
+
+import streamlit as st
+
+# rows of the grouped table sent to the browser
+DASHBOARD_ROWS = 200
+DASHBOARD_WINDOW_DAYS = 30
+
+
+def show_rollups_dashboard():
+    if not st.sidebar.toggle("Spend dashboard", key="show_rollups"):
+        return
+
+    # pandas and the store load only once the dashboard is switched on
+    from datetime import date, timedelta
+
+    import rollups
+    from ad_schema import PLATFORMS
+
+    st.markdown("---")
+    st.markdown("## Spend dashboard")
+    store = rollups.rollup_store()
+    if store is None:
+        st.info("Rollups are turned off (ROLLUP_DB is empty).")
+        return
+
+    st.caption("Spend and impression ranges summed from every ad fetched so far: Google and X ads from the "
+               "notifier's daily reads, Meta ads from searches. Ads count on the day they started, and in "
+               "each place they target.")
+    cols = st.columns(4)
+    with cols[0]:
+        platforms = st.multiselect("Platforms", PLATFORMS, key="rollups_platforms")
+    with cols[1]:
+        advertiser = st.text_input("Advertiser contains", key="rollups_advertiser")
+    with cols[2]:
+        geography = st.text_input("Geography (state, abbreviation or country)", key="rollups_geo")
+    with cols[3]:
+        today = date.today()
+        picked = st.date_input("Started between", value=(today - timedelta(days=DASHBOARD_WINDOW_DAYS), today),
+                               key="rollups_days")
+    since, until = (tuple(picked) + (None, None))[:2]
+    by = st.multiselect("Group by", list(rollups.DIMENSIONS), default=["Advertiser"], key="rollups_by")
+
+    started = time.perf_counter()
+    table = store.query(by, platforms=platforms, advertiser=advertiser.strip(), geography=geography,
+                        since=since, until=until)
+    seconds = time.perf_counter() - started
+    if table.empty or not table["Ads"].notna().any():
+        st.info("No rolled-up ads match. Searches and notifier runs add to the rollups as they fetch.")
+        return
+
+    # a geography split counts some ads several times; the totals come from the unsplit rows
+    totals = store.query([], platforms=platforms, advertiser=advertiser.strip(), geography=geography,
+                         since=since, until=until).iloc[0] if "Geography" in by else table.sum(numeric_only=True)
+    metric_cols = st.columns(3)
+    metric_cols[0].metric("Ads", f"{int(totals['Ads']):,}")
+    metric_cols[1].metric("Spend", f"${totals['Spend Min']:,.0f} – ${totals['Spend Max']:,.0f}")
+    metric_cols[2].metric("Impressions", f"{totals['Impressions Min']:,.0f} – {totals['Impressions Max']:,.0f}")
+    if "Geography" in by:
+        st.caption("An ad targeting several places is counted under each of them.")
+
+    if by == ["Day"]:
+        st.bar_chart(table.set_index("Day")[["Spend Min", "Spend Max"]], stack=False)
+    st.dataframe(table.head(DASHBOARD_ROWS), hide_index=True, use_container_width=True)
+    st.caption(f"{len(table):,} groups in {seconds * 1000:,.0f} ms")
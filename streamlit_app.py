@@ -1,479 +1,476 @@
 import streamlit as st
-from google.oauth2 import service_account
-from google.cloud import bigquery
-import pandas as pd
-import requests
-import time
-import json
-import re
-from x_ads_scraper import download_and_extract_csv, filter_by_advertiser, standardize_columns, expand_geography_search
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import diagnostics
 
 st.set_page_config(layout="wide")
+diagnostics.begin_rerun()
 
-# cap rows sent to browser to stay under Streamlit's 200MB websocket limit
-DISPLAY_ROW_LIMIT = 10_000
+# rows sent to the browser per page; the full filtered set stays on the server
+RESULT_PAGE_SIZE = 500
+UNSORTED = "(original order)"
 
-st.markdown("<h1 style='text-align: center;'>Ads Tracker</h1>", unsafe_allow_html=True)
+FILTER_WIDGETS = ("min_spend", "max_spend", "keyword", "adv_sel")
+# filter widget key prefix of each platform's results
+PLATFORM_PREFIXES = {"Google": "google", "Meta": "meta", "X": "x"}
+# date windows offered next to each search, in days back from today; None searches all history
+DATE_WINDOWS = {"Any time": None, "Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "Last year": 365}
+CUSTOM_WINDOW = "Custom range"
 
-st.markdown("<h2 style='text-align: left;'><span style='color: #4285F4;'>G</span><span style='color: #EA4335;'>o</span><span style='color: #FBBC05;'>o</span><span style='color: #4285F4;'>g</span><span style='color: #EA4335;'>l</span><span style='color: #FBBC05;'>e</span></h2>", unsafe_allow_html=True)
+GOOGLE_HEADER_HTML = "<h2 style='text-align: left;'><span style='color: #4285F4;'>G</span><span style='color: #EA4335;'>o</span><span style='color: #FBBC05;'>o</span><span style='color: #4285F4;'>g</span><span style='color: #EA4335;'>l</span><span style='color: #FBBC05;'>e</span></h2>"
+META_HEADER_HTML = "<h2 style='text-align: left;'><span style='color: #0084F3;'>M</span><span style='color: #0084F3;'>e</span><span style='color: #0084F3;'>t</span><span style='color: #0084F3;'>a</span></h2>"
+X_EMPTY_MESSAGE = "No X political ads found for this advertiser. Data is updated every 2 days from X's official disclosure page."
 
-credentials = service_account.Credentials.from_service_account_info(
-    st.secrets["gcp_service_account"]
+st.markdown("<h1 style='text-align: center;'>Ads Tracker</h1>", unsafe_allow_html=True)
+st.sidebar.toggle(
+    "Apply filters in the search", key="pushdown",
+    help="Send spend and advertiser filters with the search, so only matching ads are fetched. "
+         "The keyword filter still runs on the fetched results.",
+)
+st.sidebar.text_input(
+    "Countries", key="countries", placeholder="US",
+    help="ISO country codes, separated by commas. Meta is searched in each country at once, and Google "
+         "keeps ads shown in any of them. X's data has no country.",
 )
-client = bigquery.Client(credentials=credentials)
 
-from subscription_manager import set_sheets_config_from_app
-if hasattr(st, "secrets") and st.secrets:
-    set_sheets_config_from_app(
-        st.secrets.get("spreadsheet_id"),
-        st.secrets.get("gcp_service_account"),
-    )
 
-search_cols = st.columns([1, 1])
-with search_cols[0]:
-    advertiser_name = st.text_input("Search by Keyword", "")
-with search_cols[1]:
-    google_geo = st.text_input("Search by Geography", "")
-
-
-@st.cache_data(ttl=86400)
-def run_query(advertiser_name, geography=""):
-    expanded_geography = expand_geography_search(geography)
-
-    query = """
-    WITH advertiser_base AS (
-      SELECT
-        advertiser_id,
-        advertiser_name
-      FROM `bigquery-public-data.google_political_ads.advertiser_stats`
-      WHERE LOWER(advertiser_name) LIKE LOWER(@advertiser_name)
-    ),
-
-    creatives AS (
-      SELECT
-        ad_id,
-        advertiser_id,
-        ad_type,
-        ad_url,
-        date_range_start,
-        date_range_end,
-        impressions,
-        spend_range_min_usd,
-        spend_range_max_usd,
-        (spend_range_min_usd + spend_range_max_usd)/2 AS spend_usd,
-        geo_targeting_included,
-        age_targeting,
-        gender_targeting
-      FROM `bigquery-public-data.google_political_ads.creative_stats`
-      WHERE (@geography = "" OR REGEXP_CONTAINS(LOWER(geo_targeting_included), LOWER(@geography)))
-    )
+def searcher():
+    # pandas, requests and the search code load on the first search, not on the first page view;
+    # after that the import is a dict lookup and configure() keeps the existing clients
+    import ad_search
 
-    SELECT
-      a.advertiser_name AS screen_name,
-      c.ad_id AS tweet_id,
-      c.ad_url AS tweet_url,
-      c.date_range_start AS day_of_start_date_adgroup,
-      c.date_range_end AS day_of_end_date_adgroup,
-      c.ad_type AS targeting_name,
-      c.geo_targeting_included AS geo_targeting,
-      c.gender_targeting AS gender_targeting,
-      c.age_targeting AS age_targeting,
-      c.impressions AS impressions,
-      c.spend_usd AS spend_usd
-    FROM advertiser_base a
-    LEFT JOIN creatives c
-      ON a.advertiser_id = c.advertiser_id
-    ORDER BY c.date_range_start DESC
-    """
-
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter(
-                "advertiser_name", "STRING", f"%{advertiser_name}%"
-            ),
-            bigquery.ScalarQueryParameter(
-                "geography", "STRING", expanded_geography
-            ),
-        ]
+    ad_search.configure(
+        meta_token=st.secrets.get("meta_access_token"),
+        gcp_service_account=st.secrets.get("gcp_service_account"),
     )
+    import rollups
 
-    query_job = client.query(query, job_config=job_config)
-    rows = query_job.result()
+    rollups.track(background=True)
+    return ad_search
 
-    df = pd.DataFrame([dict(row) for row in rows])
 
+def pushed_filters(prefix):
+    # the platform's filter widget values, for the search itself when pushdown is on
+    state = st.session_state
+    if not state.get("pushdown"):
+        return None
+    return {
+        "min_spend": state.get(f"{prefix}_min_spend"),
+        "max_spend": state.get(f"{prefix}_max_spend"),
+        "advertisers": state.get(f"{prefix}_adv_sel") or (),
+    }
 
-    df = df.rename(columns={
-        "screen_name": "Advertiser Name",
-        "tweet_id": "Ad Id",
-        "tweet_url": "Ad Url",
-        "day_of_start_date_adgroup": "Start Date",
-        "day_of_end_date_adgroup": "End Date",
-        "targeting_name": "Ad Type",
-        "geo_targeting": "Geography Targeting",
-        "gender_targeting": "Gender Targeting",
-        "age_targeting": "Age Targeting",
-        "impressions": "Impressions",
-        "spend_usd": "Spend"
-    })
 
-    return df
+def date_window_input(key):
+    # (since, until) for the search, either of them None
+    from datetime import date, timedelta
 
+    choice = st.selectbox("Ads running in", list(DATE_WINDOWS) + [CUSTOM_WINDOW], key=key)
+    if choice == CUSTOM_WINDOW:
+        picked = st.date_input("From – to", value=(), key=f"{key}_range")
+        return (tuple(picked) + (None, None))[:2]
+    days = DATE_WINDOWS[choice]
+    return (date.today() - timedelta(days=days), None) if days else (None, None)
 
-def apply_simple_filters(df, prefix):
-    if df is None or df.empty:
-        return df
 
-    if "Spend" in df.columns:
-        df = df.copy()
-        df["Spend"] = pd.to_numeric(df["Spend"], errors="coerce").fillna(0)
-    else:
-        df = df.copy()
+def selected_countries():
+    # the sidebar's countries; empty searches Meta in its default countries
+    text = st.session_state.get("countries", "")
+    if not text.strip():
+        return ()
+    from regions import normalize_countries
+
+    try:
+        return normalize_countries(text)
+    except ValueError as e:
+        st.sidebar.error(str(e))
+        return ()
+
+
+sidebar_countries = selected_countries()
+
+
+def search_filters(prefix, window, exact=None):
+    # the date window, countries and a picked advertiser always narrow the search; spend and
+    # the advertiser filter only with pushdown on
+    filters = pushed_filters(prefix) or {}
+    since, until = window
+    if since or until:
+        filters.update(since=since, until=until)
+    if exact:
+        filters["advertisers"] = [exact]
+    if sidebar_countries:
+        filters["countries"] = sidebar_countries
+    return filters or None
+
+
+def advertiser_picker(keyword, key):
+    # type-ahead from the local advertiser name index; a picked name is searched as that exact
+    # advertiser (by id on Google) instead of every name containing the keyword
+    keyword = keyword.strip()
+    if len(keyword) < 2:
+        return None
+    searcher()
+    from advertiser_index import resolve, suggest
+
+    names = suggest(keyword)
+    if not names:
+        return None
+    # one widget per keyword, so a pick never outlives the suggestions it came from
+    picked = st.pills("Matching advertisers", names, key=f"{key}_{keyword.lower()}")
+    if picked:
+        st.caption(f"Searching exactly **{picked}** ({', '.join(sorted(resolve(picked))) or 'by name'})")
+    return picked
+
+
+@diagnostics.traced("run_query")
+def run_query(advertiser_name, geography="", filters=None):
+    return searcher().search("Google", advertiser_name, geography, filters)
+
+
+def filter_widgets(df, prefix):
+    from filter_engine import get_filter_index
+
+    with diagnostics.timed("filter_index", prefix) as sample:
+        index = get_filter_index(df)
+        sample["frame"] = df
 
     cols = st.columns([1, 1, 1])
     with cols[0]:
         min_spend = st.number_input("Min Spend (USD)", min_value=0.0, value=0.0, format="%.2f", key=f"{prefix}_min_spend")
     with cols[1]:
-        max_default = float(df["Spend"].max()) if "Spend" in df.columns and not df["Spend"].empty else 0.0
-        max_spend = st.number_input("Max Spend (USD)", min_value=0.0, value=max_default, format="%.2f", key=f"{prefix}_max_spend")
+        max_spend = st.number_input("Max Spend (USD)", min_value=0.0, value=index.max_spend, format="%.2f", key=f"{prefix}_max_spend")
     with cols[2]:
         keyword = st.text_input("Keyword (Ad Url / Ad Type / Advertiser)", key=f"{prefix}_keyword")
 
-    advertisers = []
-    if "Advertiser Name" in df.columns:
-        advertisers = sorted(df["Advertiser Name"].dropna().unique().tolist())
+    advertisers = index.advertisers
+    selected = st.session_state.get(f"{prefix}_adv_sel")
+    if st.session_state.get("pushdown") and selected:
+        # a pushed-down selection leaves only the chosen advertisers in the results;
+        # keep offering the others the search found before
+        advertisers = sorted(set(advertisers) | set(selected) | set(st.session_state.get(f"{prefix}_adv_options", ())))
+    st.session_state[f"{prefix}_adv_options"] = advertisers
     adv_sel = st.multiselect("Advertiser", advertisers, key=f"{prefix}_adv_sel")
 
-    filtered = df
-    if "Spend" in filtered.columns:
-        filtered = filtered[(filtered["Spend"] >= float(min_spend)) & (filtered["Spend"] <= float(max_spend))]
-    if adv_sel:
-        filtered = filtered[filtered.get("Advertiser Name", "").isin(adv_sel)]
-    if keyword:
-        mask = (
-            filtered.get("Ad Url", "").astype(str).str.contains(keyword, case=False, na=False)
-            | filtered.get("Ad Type", "").astype(str).str.contains(keyword, case=False, na=False)
-            | filtered.get("Advertiser Name", "").astype(str).str.contains(keyword, case=False, na=False)
-        )
-        filtered = filtered[mask]
-
-    return filtered
-
-
-if advertiser_name or google_geo:
-    with st.spinner("Fetching advertiser data..."):
-        df = run_query(advertiser_name, google_geo)
-    if not df.empty:
-        st.success(f"Returned {len(df)} records")
-
-        st.markdown("**Filters (Google)**")
-        df_filtered = apply_simple_filters(df, "google")
-
-        if df_filtered is None or df_filtered.empty:
-            st.warning("No results match the filters")
-        else:
-            n_total = len(df_filtered)
-            df_show = df_filtered.head(DISPLAY_ROW_LIMIT)
-            cap_note = f" (first {DISPLAY_ROW_LIMIT:,} shown; download CSV for full data)" if n_total > DISPLAY_ROW_LIMIT else ""
-            st.markdown(f"**Showing {len(df_show)} of {n_total} records**{cap_note}")
-            st.dataframe(df_show, column_config={
-                "Ad Url": st.column_config.LinkColumn()
-            }, height=400, use_container_width=True)
-
-            csv = df_filtered.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="Download Filtered CSV",
-                data=csv,
-                file_name=f"google_ads_filtered.csv",
-                mime="text/csv",
-            )
-
-            csv_full = df.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="Download Full CSV",
-                data=csv_full,
-                file_name=f"google_ads_full.csv",
-                mime="text/csv",
-            )
-    else:
-        st.warning("No results found.")
+    with diagnostics.timed("apply_simple_filters", prefix):
+        positions = index.select(min_spend, max_spend, adv_sel, keyword)
+    return index, positions
 
-st.markdown("<h2 style='text-align: left;'><span style='color: #0084F3;'>M</span><span style='color: #0084F3;'>e</span><span style='color: #0084F3;'>t</span><span style='color: #0084F3;'>a</span></h2>", unsafe_allow_html=True)
-
-meta_cols = st.columns([1, 1])
-with meta_cols[0]:
-    meta_advertiser_name = st.text_input("Search by Keyword", "", key="meta_advertiser")
-with meta_cols[1]:
-    meta_geo = st.text_input("Search by Geography", "", key="meta_geo")
-
-@st.cache_data(ttl=86400)
-def fetch_meta_ads(advertiser_name, geography=""):
-    meta_access_token = st.secrets["meta_access_token"]
-
-    base_url = "https://graph.facebook.com/v17.0/ads_archive"
-    fields = (
-        "id,page_id,page_name,bylines,"
-        "ad_creation_time,ad_delivery_start_time,ad_delivery_stop_time,"
-        "ad_creative_bodies,ad_creative_link_titles,ad_snapshot_url,"
-        "spend,impressions,currency,"
-        "ad_reached_countries,delivery_by_region,publisher_platforms,demographic_distribution"
-    )
 
-    try:
-        countries_param = json.dumps(["US"])
-
-        params = {
-            "access_token": meta_access_token,
-            "ad_type": "POLITICAL_AND_ISSUE_ADS",
-            "ad_reached_countries": countries_param,
-            "fields": fields,
-            "limit": 100,
-            "search_terms": advertiser_name,
-        }
-
-        all_ads = []
-        url = base_url
-        page_count = 0
-        max_pages = 10
-
-        while True:
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-
-            if "error" in data:
-                code = data["error"].get("code")
-                if code == 613:
-                    time.sleep(60)
-                    response = requests.get(url, params=params, timeout=30)
-                    response.raise_for_status()
-                    data = response.json()
-                else:
-                    st.error(f"API Error: {data['error'].get('message')}")
-                    return pd.DataFrame()
-
-            batch = data.get("data", [])
-
-            matched = []
-            for ad in batch:
-                page_name = (ad.get("page_name") or "").lower()
-                if advertiser_name.lower() in page_name:
-                    matched.append(ad)
-
-            if matched:
-                all_ads.extend(matched)
-
-            page_count += 1
-
-            paging = data.get("paging", {})
-            next_url = paging.get("next")
-            if not next_url or page_count >= max_pages:
-                break
-
-            url = next_url
-            params = {}
-            time.sleep(0.5)
-
-        if not all_ads:
-            return pd.DataFrame()
-
-        rows = []
-        for ad in all_ads:
-            demo = ad.get("demographic_distribution") or {}
-            gender_targeting = None
-            age_targeting = None
-            if isinstance(demo, dict):
-                gender_targeting = demo.get("gender") or demo.get("genders")
-                age_targeting = demo.get("age") or demo.get("ages")
-                if gender_targeting is None:
-                    gender_targeting = json.dumps(demo)
-                if age_targeting is None:
-                    age_targeting = json.dumps(demo)
-            else:
-                gender_targeting = str(demo)
-                age_targeting = str(demo)
-            delivery_by_region = ad.get("delivery_by_region") or []
-            geo_targeting = ""
-            if isinstance(delivery_by_region, list):
-                regions = [region.get("region", "") for region in delivery_by_region if isinstance(region, dict)]
-                geo_targeting = ", ".join(regions) if regions else ""
-
-            if geography:
-                expanded_geo = expand_geography_search(geography)
-                if not any(re.search(expanded_geo, region, re.IGNORECASE) for region in regions):
-                    continue
 
-            row = {
-                "Advertiser Name": ad.get("page_name") or advertiser_name,
-                "Ad Id": ad.get("id", ""),
-                "Ad Url": ad.get("ad_snapshot_url", ""),
-                "Start Date": ad.get("ad_delivery_start_time", ""),
-                "End Date": ad.get("ad_delivery_stop_time", ""),
-                "Ad Type": "POLITICAL_AND_ISSUE_ADS",
-                "Geography Targeting": geo_targeting,
-                "Gender Targeting": gender_targeting,
-                "Age Targeting": age_targeting,
-                "Impressions": ad.get("impressions", ""),
-                "Spend": ad.get("spend", ""),
-            }
-            rows.append(row)
-
-        df = pd.DataFrame(rows)
-        try:
-            df["Start Date"] = pd.to_datetime(df["Start Date"]) 
-        except Exception:
-            pass
-        return df
+@diagnostics.traced("fetch_meta_ads")
+def fetch_meta_ads(advertiser_name, geography="", filters=None):
+    import pandas as pd
+    import requests
 
+    ad_search = searcher()
+    try:
+        return ad_search.search("Meta", advertiser_name, geography, filters)
+    except ad_search.MetaAPIError as e:
+        st.error(f"API Error: {e}")
     except requests.exceptions.RequestException as e:
         st.error(f"Error fetching Meta ads: {e}")
-        return pd.DataFrame()
-
-if meta_advertiser_name or meta_geo:
-    with st.spinner("Fetching Meta advertiser data..."):
-        df_meta = fetch_meta_ads(meta_advertiser_name, meta_geo)
-    
-    if not df_meta.empty:
-        st.success(f"Returned {len(df_meta)} records")
-        df_meta = df_meta.sort_values("Start Date", ascending=False)
-        st.markdown("**Filters (Meta)**")
-        df_meta_filtered = apply_simple_filters(df_meta, "meta")
-
-        if df_meta_filtered is None or df_meta_filtered.empty:
-            st.warning("No results match the filters")
-        else:
-            n_total = len(df_meta_filtered)
-            df_show = df_meta_filtered.head(DISPLAY_ROW_LIMIT)
-            cap_note = f" (first {DISPLAY_ROW_LIMIT:,} shown; download CSV for full data)" if n_total > DISPLAY_ROW_LIMIT else ""
-            st.markdown(f"**Showing {len(df_show)} of {n_total} records**{cap_note}")
-            st.dataframe(df_show, column_config={
-                "Ad Url": st.column_config.LinkColumn()
-            }, height=400, use_container_width=True)
-
-            csv = df_meta_filtered.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="Download Filtered CSV",
-                data=csv,
-                file_name=f"meta_political_ads_filtered.csv",
-                mime="text/csv",
-            )
-
-            csv_full = df_meta.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="Download Full CSV",
-                data=csv_full,
-                file_name=f"meta_political_ads_full.csv",
-                mime="text/csv",
-            )
-    else:
-        st.warning("No results found.")
+    return pd.DataFrame()
 
 
-st.header("X")
+@diagnostics.traced("fetch_x_ads")
+def fetch_x_ads(advertiser_name, geography="", filters=None):
+    import pandas as pd
 
-x_cols = st.columns([1, 1])
-with x_cols[0]:
-    x_advertiser_name = st.text_input("Search by Keyword", "", key="x_advertiser")
-with x_cols[1]:
-    x_geo = st.text_input("Search by Geography", "", key="x_geo")
-
-@st.cache_data(ttl=86400)
-def fetch_x_ads(advertiser_name, geography=""):
     try:
-        df = download_and_extract_csv()
-        df = standardize_columns(df)
-        
-        if advertiser_name:
-            df = filter_by_advertiser(df, advertiser_name)
-        
-        if geography and "Geography Targeting" in df.columns:
-            expanded_geo = expand_geography_search(geography)
-            df = df[df["Geography Targeting"].astype(str).str.contains(expanded_geo, case=False, na=False, regex=True)]
-        
-        if 'Start Date' in df.columns:
-            try:
-                df['Start Date'] = pd.to_datetime(df['Start Date'])
-                df = df.sort_values('Start Date', ascending=False)
-            except Exception as e:
-                st.warning(f"Could not parse dates: {e}")
-        
-        return df
-    
+        return searcher().search("X", advertiser_name, geography, filters)
     except Exception as e:
         st.error(f"Error fetching X political ads data: {e}")
         return pd.DataFrame()
 
-if x_advertiser_name or x_geo:
-    with st.spinner("Fetching X advertiser data..."):
-        df_x_filtered = fetch_x_ads(x_advertiser_name, x_geo)
-    
-    if not df_x_filtered.empty:
-        st.success(f"Returned {len(df_x_filtered)} records")
-        st.markdown("**Filters (X)**")
-        df_x_display = apply_simple_filters(df_x_filtered, "x")
-
-        if df_x_display is None or df_x_display.empty:
-            st.warning("No results match the filters")
-        else:
-            n_total = len(df_x_display)
-            df_show = df_x_display.head(DISPLAY_ROW_LIMIT)
-            cap_note = f" (first {DISPLAY_ROW_LIMIT:,} shown; download CSV for full data)" if n_total > DISPLAY_ROW_LIMIT else ""
-            st.markdown(f"**Showing {len(df_show)} of {n_total} records**{cap_note}")
-            st.dataframe(df_show, column_config={
-                "Ad Url": st.column_config.LinkColumn()
-            }, height=400, use_container_width=True)
-
-            csv = df_x_display.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="Download Filtered CSV",
-                data=csv,
-                file_name=f"x_political_ads_filtered.csv",
-                mime="text/csv",
-            )
-
-            csv_full = df_x_filtered.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label="Download Full CSV",
-                data=csv_full,
-                file_name=f"x_political_ads_full.csv",
-                mime="text/csv",
-            )
-    else:
-        st.warning("No X political ads found for this advertiser. Data is updated every 2 days from X's official disclosure page.")
 
+def show_filtered_results(df, prefix, file_stem):
+    index, positions = filter_widgets(df, prefix)
+    n_total = index.n_rows if positions is None else len(positions)
+
+    if n_total == 0:
+        st.warning("No results match the filters")
+        return
+
+    show_result_page(df, index, positions, prefix)
+    show_downloads(df, index, positions, prefix, file_stem)
+
+
+def show_result_page(df, index, positions, prefix):
+    n_total = index.n_rows if positions is None else len(positions)
+    n_pages = -(-n_total // RESULT_PAGE_SIZE)
+    page_key = f"{prefix}_page"
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+
+    cols = st.columns([2, 1, 1])
+    with cols[0]:
+        sort_col = st.selectbox("Sort by", [UNSORTED] + list(df.columns), key=f"{prefix}_sort_col")
+    with cols[1]:
+        descending = st.toggle("Descending", key=f"{prefix}_sort_desc")
+    with cols[2]:
+        page = st.number_input("Page", min_value=1, max_value=n_pages, step=1, key=page_key)
+
+    # the sort order is computed once per dataset and column, then reused for every filter and page
+    order = index.sorted_positions(df, positions, None if sort_col == UNSORTED else sort_col, not descending)
+    start = (page - 1) * RESULT_PAGE_SIZE
+    page_positions = order[start:start + RESULT_PAGE_SIZE]
+
+    st.markdown(f"**Showing {start + 1:,}–{start + len(page_positions):,} of {n_total:,} records** (page {page} of {n_pages})")
+    st.dataframe(index.take(df, page_positions), column_config={
+        "Ad Url": st.column_config.LinkColumn()
+    }, height=400, use_container_width=True)
+
+
+def show_downloads(df, index, positions, prefix, file_stem):
+    from exports import EXPORT_FORMATS, deferred_export, export_file_name, export_mime
+
+    fmt = st.selectbox("Export format", list(EXPORT_FORMATS), key=f"{prefix}_export_format")
+    filter_state = tuple(repr(st.session_state.get(f"{prefix}_{name}")) for name in FILTER_WIDGETS)
+
+    st.download_button(
+        label=f"Download Filtered {fmt}",
+        data=diagnostics.traced_download(
+            "export",
+            deferred_export(lambda: [index.take(df, positions)], fmt, source=[df], filter_state=filter_state),
+            f"{file_stem}_filtered {fmt}",
+        ),
+        file_name=export_file_name(f"{file_stem}_filtered", fmt),
+        mime=export_mime(fmt),
+        on_click="ignore",
+        key=f"{prefix}_download_filtered",
+    )
+
+    st.download_button(
+        label=f"Download Full {fmt}",
+        data=diagnostics.traced_download("export", deferred_export([df], fmt), f"{file_stem}_full {fmt}"),
+        file_name=export_file_name(f"{file_stem}_full", fmt),
+        mime=export_mime(fmt),
+        on_click="ignore",
+        key=f"{prefix}_download_full",
+    )
+
+
+def show_google_results(df):
+    if df.empty:
+        st.warning("No results found.")
+        return
+    st.success(f"Returned {len(df)} records")
+
+    st.markdown("**Filters (Google)**")
+    show_filtered_results(df, "google", "google_ads")
+
+
+def sort_meta_results(df_meta):
+    from filter_engine import frame_memo
 
-st.markdown("**Download combined CSV**")
+    if df_meta.empty:
+        return df_meta
+    # the same sorted frame on every rerun, so its filter index is found without re-hashing
+    return frame_memo(df_meta, "newest_first", lambda: df_meta.sort_values("Start Date", ascending=False))
+
+
+def show_meta_results(df_meta):
+    if df_meta.empty:
+        st.warning("No results found.")
+        return
+    st.success(f"Returned {len(df_meta)} records")
+    st.markdown("**Filters (Meta)**")
+    show_filtered_results(df_meta, "meta", "meta_political_ads")
+
+
+def show_x_results(df_x_filtered):
+    if df_x_filtered.empty:
+        st.warning(X_EMPTY_MESSAGE)
+        return
+    st.success(f"Returned {len(df_x_filtered)} records")
+    st.markdown("**Filters (X)**")
+    show_filtered_results(df_x_filtered, "x", "x_political_ads")
+
+
+PLATFORM_SEARCHES = {
+    "Google": run_query,
+    "Meta": fetch_meta_ads,
+    "X": fetch_x_ads,
+}
+
+
+def _with_script_ctx(fn):
+    # fetchers call st.error, which needs the session's script context
+    ctx = get_script_run_ctx()
+
+    def run(*args, **kwargs):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args, **kwargs)
+    return run
+
+
+def show_platform_header(platform):
+    if platform == "Google":
+        st.markdown(GOOGLE_HEADER_HTML, unsafe_allow_html=True)
+    elif platform == "Meta":
+        st.markdown(META_HEADER_HTML, unsafe_allow_html=True)
+    else:
+        st.header(platform)
+
+
+def search_all_platforms(keyword, geography, window=(None, None), exact=None):
+    sections = {}
+    for platform in PLATFORM_SEARCHES:
+        section = st.container()
+        with section:
+            show_platform_header(platform)
+            status = st.empty()
+        sections[platform] = (section, status)
+
+    results = {}
+    if not (keyword or geography):
+        return results
+
+    # a pool per search, so one session stuck in a Meta back-off never holds up another's
+    # Google and X searches
+    with ThreadPoolExecutor(max_workers=len(PLATFORM_SEARCHES), thread_name_prefix="ad-search") as executor:
+        futures = {}
+        for platform, search in PLATFORM_SEARCHES.items():
+            sections[platform][1].info(f"Fetching {platform} advertiser data...")
+            filters = search_filters(PLATFORM_PREFIXES[platform], window, exact)
+            futures[executor.submit(_with_script_ctx(search), exact or keyword, geography, filters=filters)] = platform
+
+        for future in as_completed(futures):
+            platform = futures[future]
+            section, status = sections[platform]
+            status.empty()
+            with section:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    st.error(f"Error fetching {platform} ads: {e}")
+                    continue
+                if platform == "Google":
+                    show_google_results(result)
+                elif platform == "Meta":
+                    result = sort_meta_results(result)
+                    show_meta_results(result)
+                else:
+                    show_x_results(result)
+            results[platform] = result
+    return results
+
+
+search_all = st.toggle("Search all platforms at once", key="search_all")
+
+if search_all:
+    all_cols = st.columns([1, 1, 1])
+    with all_cols[0]:
+        all_advertiser_name = st.text_input("Search by Keyword", "", key="all_advertiser")
+    with all_cols[1]:
+        all_geo = st.text_input("Search by Geography", "", key="all_geo")
+    with all_cols[2]:
+        all_window = date_window_input("all_window")
+    all_exact = advertiser_picker(all_advertiser_name, "all_pick")
+
+    platform_results = search_all_platforms(all_advertiser_name, all_geo, all_window, all_exact)
+    if "Google" in platform_results:
+        df = platform_results["Google"]
+    if "Meta" in platform_results:
+        df_meta = platform_results["Meta"]
+    if "X" in platform_results:
+        df_x_filtered = platform_results["X"]
+else:
+    st.markdown(GOOGLE_HEADER_HTML, unsafe_allow_html=True)
+
+    search_cols = st.columns([1, 1, 1])
+    with search_cols[0]:
+        advertiser_name = st.text_input("Search by Keyword", "")
+    with search_cols[1]:
+        google_geo = st.text_input("Search by Geography", "")
+    with search_cols[2]:
+        google_window = date_window_input("google_window")
+    google_exact = advertiser_picker(advertiser_name, "google_pick")
+
+    if advertiser_name or google_geo:
+        with st.spinner("Fetching advertiser data..."):
+            df = run_query(google_exact or advertiser_name, google_geo,
+                           filters=search_filters("google", google_window, google_exact))
+        show_google_results(df)
+
+    st.markdown(META_HEADER_HTML, unsafe_allow_html=True)
+
+    meta_cols = st.columns([1, 1, 1])
+    with meta_cols[0]:
+        meta_advertiser_name = st.text_input("Search by Keyword", "", key="meta_advertiser")
+    with meta_cols[1]:
+        meta_geo = st.text_input("Search by Geography", "", key="meta_geo")
+    with meta_cols[2]:
+        meta_window = date_window_input("meta_window")
+    meta_exact = advertiser_picker(meta_advertiser_name, "meta_pick")
+
+    if meta_advertiser_name or meta_geo:
+        with st.spinner("Fetching Meta advertiser data..."):
+            df_meta = fetch_meta_ads(meta_exact or meta_advertiser_name, meta_geo,
+                                     filters=search_filters("meta", meta_window, meta_exact))
+        df_meta = sort_meta_results(df_meta)
+        show_meta_results(df_meta)
+
+    st.header("X")
+
+    x_cols = st.columns([1, 1, 1])
+    with x_cols[0]:
+        x_advertiser_name = st.text_input("Search by Keyword", "", key="x_advertiser")
+    with x_cols[1]:
+        x_geo = st.text_input("Search by Geography", "", key="x_geo")
+    with x_cols[2]:
+        x_window = date_window_input("x_window")
+    x_exact = advertiser_picker(x_advertiser_name, "x_pick")
+
+    if x_advertiser_name or x_geo:
+        with st.spinner("Fetching X advertiser data..."):
+            df_x_filtered = fetch_x_ads(x_exact or x_advertiser_name, x_geo,
+                                        filters=search_filters("x", x_window, x_exact))
+        show_x_results(df_x_filtered)
+
+
+st.markdown("**Download combined results**")
 
 
 def _gather_datasets():
     parts = []
-    if "df" in globals() and isinstance(globals().get("df"), pd.DataFrame) and not globals().get("df").empty:
-        df_copy = globals().get("df").copy()
-        df_copy["Platform"] = "Google"
-        parts.append(df_copy)
-    if "df_meta" in globals() and isinstance(globals().get("df_meta"), pd.DataFrame) and not globals().get("df_meta").empty:
-        df_meta_copy = globals().get("df_meta").copy()
-        df_meta_copy["Platform"] = "Meta"
-        parts.append(df_meta_copy)
-    if "df_x_filtered" in globals() and isinstance(globals().get("df_x_filtered"), pd.DataFrame) and not globals().get("df_x_filtered").empty:
-        df_x_copy = globals().get("df_x_filtered").copy()
-        df_x_copy["Platform"] = "X"
-        parts.append(df_x_copy)
+    for platform, name in (("Google", "df"), ("Meta", "df_meta"), ("X", "df_x_filtered")):
+        dataset = globals().get(name)
+        if dataset is not None and not dataset.empty:
+            parts.append((platform, dataset))
     return parts
 
 all_parts = _gather_datasets()
 if all_parts:
-    combined = pd.concat(all_parts, ignore_index=True, sort=False)
-    csv_all = combined.to_csv(index=False).encode("utf-8")
+    from exports import EXPORT_FORMATS, deferred_export, export_file_name, export_mime
+
+    combined_fmt = st.selectbox("Export format", list(EXPORT_FORMATS), key="combined_export_format")
     st.download_button(
-        label="Download combined CSV",
-        data=csv_all,
-        file_name="all_ads_combined.csv",
-        mime="text/csv",
+        label=f"Download combined {combined_fmt}",
+        data=diagnostics.traced_download(
+            "export",
+            deferred_export(
+                [part for _, part in all_parts],
+                combined_fmt,
+                platforms=[platform for platform, _ in all_parts],
+            ),
+            f"all_ads_combined {combined_fmt}",
+        ),
+        file_name=export_file_name("all_ads_combined", combined_fmt),
+        mime=export_mime(combined_fmt),
+        on_click="ignore",
+        key="combined_download",
     )
 else:
     st.info("No datasets available to combine. Fetch Google, Meta, or X results first.")
 
 
+from rollups_ui import show_rollups_dashboard
+show_rollups_dashboard()
+
 from alerts_ui import show_alerts_ui
-show_alerts_ui()
\ No newline at end of file
+show_alerts_ui()
+
+diagnostics.show_diagnostics_panel()
@@ -9,11 +9,15 @@ import toml
 
 SHEET_HEADERS = [
     "id", "email", "advertiser_keyword", "geography", "platforms",
-    "created_at", "last_notified_at", "last_seen_ad_ids",
+    "created_at", "last_notified_at", "last_seen_ad_ids", "countries",
 ]
+# sheets created before the countries column; read as searching the default countries
+LEGACY_HEADERS = SHEET_HEADERS[:8]
 
 _injected_spreadsheet_id = None
 _injected_gcp = None
+# authenticating and opening the sheet costs two round trips, so reuse the worksheet
+_worksheets = {}
 
 
 def set_sheets_config_from_app(spreadsheet_id: Optional[str], gcp_service_account: Optional[dict]):
@@ -69,12 +73,24 @@ def _sheet_client():
             "(Streamlit: spreadsheet_id + gcp_service_account in secrets; "
             "GitHub Actions: SPREADSHEET_ID + GCP_SERVICE_ACCOUNT_JSON)."
         )
-    gc = gspread.service_account_from_dict(gcp)
-    return gc.open_by_key(_id).sheet1
+    key = (_id, gcp.get("client_email"), gcp.get("private_key_id"))
+    if key not in _worksheets:
+        gc = gspread.service_account_from_dict(gcp)
+        _worksheets[key] = gc.open_by_key(_id).sheet1
+    return _worksheets[key]
+
+
+def _has_headers(rows: list) -> bool:
+    if not rows:
+        return False
+    header = list(rows[0][:len(SHEET_HEADERS)])
+    while header and not header[-1]:
+        header.pop()
+    return header in (SHEET_HEADERS, LEGACY_HEADERS)
 
 
 def _row_to_sub(row: list) -> Optional[dict]:
-    if len(row) < len(SHEET_HEADERS):
+    if len(row) < len(LEGACY_HEADERS):
         return None
     try:
         platforms_str = row[4] or "Google,Meta,X"
@@ -93,6 +109,7 @@ def _row_to_sub(row: list) -> Optional[dict]:
             "created_at": row[5] or "",
             "last_notified_at": row[6] if len(row) > 6 and row[6] else None,
             "last_seen_ad_ids": last_seen_ids,
+            "countries": [c.strip() for c in (row[8] if len(row) > 8 else "").split(",") if c.strip()],
         }
     except (IndexError, TypeError):
         return None
@@ -108,13 +125,14 @@ def _sub_to_row(sub: dict) -> list:
         sub.get("created_at", ""),
         sub.get("last_notified_at") or "",
         json.dumps(sub.get("last_seen_ad_ids", [])),
+        ",".join(sub.get("countries", [])),
     ]
 
 
 def _load_from_sheets() -> dict:
     sh = _sheet_client()
     rows = sh.get_all_values()
-    if not rows or rows[0] != SHEET_HEADERS:
+    if not _has_headers(rows):
         return {}
     out = {}
     for r in rows[1:]:
@@ -136,7 +154,7 @@ def _save_to_sheets(subscriptions: dict):
 def _ensure_sheet_headers():
     sh = _sheet_client()
     rows = sh.get_all_values()
-    if not rows or rows[0] != SHEET_HEADERS:
+    if not rows or rows[0][:len(SHEET_HEADERS)] != SHEET_HEADERS:
         sh.update([SHEET_HEADERS], "A1")
 
 
@@ -153,6 +171,7 @@ def add_subscription(
     advertiser_keyword: str = "",
     geography: str = "",
     platforms: list = None,
+    countries: list = None,
 ) -> Optional[str]:
     subscriptions = load_subscriptions()
 
@@ -161,6 +180,7 @@ def add_subscription(
             sub["email"].lower() == email.lower()
             and (sub.get("advertiser_keyword") or "").lower() == (advertiser_keyword or "").lower()
             and (sub.get("geography") or "").lower() == (geography or "").lower()
+            and sorted(sub.get("countries") or []) == sorted(countries or [])
         ):
             return None
 
@@ -174,6 +194,7 @@ def add_subscription(
         "created_at": datetime.utcnow().isoformat(),
         "last_notified_at": None,
         "last_seen_ad_ids": [],
+        "countries": list(countries or []),
     }
     _ensure_sheet_headers()
     save_subscriptions(subscriptions)
@@ -209,7 +230,7 @@ def update_last_seen(sub_id: str, ad_ids: list, timestamp: str, sheet_row_number
         return
 
     rows = sh.get_all_values()
-    if not rows or rows[0] != SHEET_HEADERS:
+    if not _has_headers(rows):
         return
     _update_last_seen_by_id(sh, sub_id, payload, rows)
 
@@ -217,7 +238,7 @@ def update_last_seen(sub_id: str, ad_ids: list, timestamp: str, sheet_row_number
 def _update_last_seen_by_id(sh, sub_id: str, payload: list, rows: Optional[list] = None):
     if rows is None:
         rows = sh.get_all_values()
-    if not rows or rows[0] != SHEET_HEADERS:
+    if not _has_headers(rows):
         return
     try:
         id_col = rows[0].index("id")
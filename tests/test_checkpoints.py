@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from checkpoints import CheckpointStore
+
+
+def lines(store):
+    with open(store.path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_transitions_within_a_run(tmp_path):
+    with CheckpointStore(tmp_path, "run-1") as store:
+        store.record("a", "fetched", new_ads=2)
+        assert not store.done("a")
+        assert store.pending_send("a") is None
+
+        store.record("a", "sent", ad_ids=["1", "2"])
+        assert store.pending_send("a")["ad_ids"] == ["1", "2"]
+        assert not store.done("a")
+
+        store.record("a", "committed")
+        assert store.done("a")
+        assert store.pending_send("a") is None
+
+        store.record("b", "failed")
+        assert store.get("b")["state"] == "failed"
+        assert not store.done("b")
+
+        store.record("c", "deferred", platforms=["Meta"], since="2026-10-01")
+        assert store.deferred("c")["platforms"] == ["Meta"]
+        assert store.deferred("c")["since"] == "2026-10-01"
+        assert not store.done("c")
+
+    assert [(e["sub"], e["state"]) for e in lines(store)] == [
+        ("a", "fetched"), ("a", "sent"), ("a", "committed"), ("b", "failed"), ("c", "deferred"),
+    ]
+
+
+def test_unknown_state_rejected(tmp_path):
+    with CheckpointStore(tmp_path, "run-1") as store:
+        with pytest.raises(ValueError):
+            store.record("a", "emailed")
+
+
+def test_resumed_run_keeps_its_progress(tmp_path):
+    with CheckpointStore(tmp_path, "run-1") as store:
+        store.record("a", "committed")
+        store.record("b", "fetched", new_ads=0)
+
+    with CheckpointStore(tmp_path, "run-1") as store:
+        assert store.done("a")
+        assert store.get("b")["state"] == "fetched"
+
+
+def test_load_compacts_to_what_a_new_run_needs(tmp_path):
+    with CheckpointStore(tmp_path, "run-1") as store:
+        store.record("committed", "fetched", new_ads=0)
+        store.record("committed", "committed")
+        store.record("unconfirmed", "sent", ad_ids=["9"])
+        store.record("owed", "deferred", platforms=["X"], since="2026-10-01")
+        store.record("failed", "failed")
+
+    with CheckpointStore(tmp_path, "run-2") as store:
+        # finished and failed subscriptions from the old run are history; a later run redoes them
+        assert store.get("committed") is None
+        assert store.get("failed") is None
+        assert not store.done("committed")
+        assert store.pending_send("unconfirmed")["ad_ids"] == ["9"]
+        assert store.deferred("owed")["platforms"] == ["X"]
+        assert sorted((e["sub"], e["state"]) for e in lines(store)) == [
+            ("owed", "deferred"), ("unconfirmed", "sent"),
+        ]
+
+
+def test_load_skips_a_torn_last_line(tmp_path):
+    with CheckpointStore(tmp_path, "run-1") as store:
+        store.record("a", "sent", ad_ids=["1"])
+    with open(store.path, "a", encoding="utf-8") as f:
+        f.write('{"sub": "b", "sta')
+
+    with CheckpointStore(tmp_path, "run-1") as store:
+        assert store.pending_send("a") is not None
+        assert store.get("b") is None
+        assert [e["sub"] for e in lines(store)] == ["a"]
+
+
+def test_shards_keep_separate_files(tmp_path):
+    with CheckpointStore(tmp_path, "run-1", shard=0, shards=2) as first, \
+            CheckpointStore(tmp_path, "run-1", shard=1, shards=2) as second:
+        first.record("a", "committed")
+        assert second.get("a") is None
+        assert first.path != second.path
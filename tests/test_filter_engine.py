@@ -0,0 +1,39 @@
+import gc
+import threading
+
+import pandas as pd
+
+import filter_engine
+
+
+def test_frame_memo_computes_once_per_frame():
+    df = pd.DataFrame({"x": [1, 2]})
+    calls = []
+    for _ in range(3):
+        filter_engine.frame_memo(df, "n", lambda: calls.append(1) or len(df))
+    assert calls == [1]
+
+    frame_id = id(df)
+    del df
+    gc.collect()
+    assert frame_id not in filter_engine._frame_memos
+
+
+def test_frame_memo_replacing_a_memoized_frame_does_not_deadlock():
+    # two reruns race to memoize a derived frame; the loser's value replaces the winner's,
+    # which is collected (and forgotten) while the memo lock is held
+    source = pd.DataFrame({"x": [1]})
+
+    def derived():
+        frame = pd.DataFrame({"x": [2]})
+        filter_engine.frame_memo(frame, "n", lambda: 1)
+        return frame
+
+    def racing():
+        filter_engine.frame_memo(source, "derived", derived)
+        return pd.DataFrame({"x": [3]})
+
+    worker = threading.Thread(target=filter_engine.frame_memo, args=(source, "derived", racing), daemon=True)
+    worker.start()
+    worker.join(5)
+    assert not worker.is_alive()
@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.import_time import DEFERRED_MODULES, ROOT
+
+
+def imported(module, cwd):
+    # -X importtime lists every module the interpreter loaded, one "self | cumulative | name" line each
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")]))}
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=cwd, env=env, capture_output=True, text=True)
+    assert out.returncode == 0, out.stderr[-2000:]
+    return {line.split("|")[-1].strip() for line in out.stderr.splitlines()
+            if line.startswith("import time:") and not line.endswith("imported package")}
+
+
+@pytest.mark.parametrize("entry", sorted(DEFERRED_MODULES))
+def test_entry_point_leaves_heavy_modules_unloaded(entry, tmp_path):
+    # timings stay in CI (benchmarks.import_time); which modules load doesn't depend on the machine
+    (tmp_path / ".streamlit").mkdir()
+    (tmp_path / ".streamlit" / "secrets.toml").write_text('meta_access_token = "import-check"\n')
+    module = "streamlit_app" if entry == "app" else entry
+    loaded = sorted(set(DEFERRED_MODULES[entry]) & imported(module, tmp_path))
+    assert not loaded, f"{module} imported {', '.join(loaded)} at startup"
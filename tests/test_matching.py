@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from matching import KeywordAutomaton, SubscriptionMatcher
+
+
+def found(keywords, text):
+    automaton = KeywordAutomaton(keywords)
+    return {automaton.keywords[i] for i in automaton.find(text)}
+
+
+def test_overlapping_keywords_all_found():
+    assert found(["he", "she", "his", "hers"], "ushers") == {"he", "she", "hers"}
+
+
+def test_nested_keywords_share_a_prefix():
+    assert found(["a", "ab", "abc"], "xabcx") == {"a", "ab", "abc"}
+
+
+def test_keyword_reached_through_a_failure_link():
+    # "abcd" is abandoned at "x"; "bc" still has to be reported from the path through it
+    assert found(["abcd", "bc"], "abcx") == {"bc"}
+
+
+def test_repeated_keyword_reported_once():
+    automaton = KeywordAutomaton(["ab", "ab"])
+    assert automaton.find("abab") == {0, 1}
+
+
+def test_matches_inside_words_like_str_contains():
+    # keywords are substrings, not whole words, as in ad_search's str.contains
+    keywords = ["art", "acme"]
+    for text in ("smart", "art", "state of the art", "acmecorp", "the acme"):
+        expected = {k for k in keywords if k in text}
+        assert found(keywords, text) == expected
+
+
+def test_keyword_across_a_space():
+    assert found(["acme co"], "the acme corp") == {"acme co"}
+    assert found(["acme co"], "acme  co") == set()
+
+
+def test_no_keywords_finds_nothing():
+    assert KeywordAutomaton([]).find("anything") == set()
+
+
+def ads(names, geographies):
+    return pd.DataFrame({"Advertiser Name": names, "Geography Targeting": geographies})
+
+
+def test_matcher_returns_rows_per_subscription():
+    matcher = SubscriptionMatcher({
+        "a": {"advertiser_keyword": "Acme"},
+        "b": {"advertiser_keyword": "me"},
+        "c": {"advertiser_keyword": "zzz"},
+    })
+    matches = matcher.match(ads(["ACME Corp", "Other", "Homes Ltd"], ["", "", ""]), "Google")
+    np.testing.assert_array_equal(matches["a"], [0])
+    np.testing.assert_array_equal(matches["b"], [0, 2])
+    assert "c" not in matches
+
+
+def test_state_geography_matches_whole_places_only():
+    # "GA" is Georgia, not the "ga" inside "Michigan"
+    matcher = SubscriptionMatcher({"a": {"advertiser_keyword": "acme", "geography": "GA"}})
+    frame = ads(["acme", "acme", "acme"], ["Atlanta, Georgia, United States", "Michigan, United States", None])
+    np.testing.assert_array_equal(matcher.match(frame, "Google")["a"], [0])
@@ -0,0 +1,162 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import ad_search
+import notifier
+from ad_schema import normalize_ads
+from checkpoints import CheckpointStore
+
+
+class Crash(BaseException):
+    # the process dying: nothing in run_notifications catches it
+    pass
+
+
+class World:
+    def __init__(self, monkeypatch):
+        self.sheet = {
+            "sub-1": {"id": "sub-1", "email": "a@example.com", "advertiser_keyword": "acme", "geography": "",
+                      "platforms": ["Google", "Meta"], "last_seen_ad_ids": []},
+        }
+        # platform -> ad ids, or rows of ad fields
+        self.ads = {"Google": ["g1"], "Meta": ["m1"], "X": []}
+        self.failing = set()
+        self.fetches = []
+        self.emails = []
+        self.crash_on_commit = False
+        monkeypatch.setattr(notifier, "load_subscriptions", lambda: {k: dict(v) for k, v in self.sheet.items()})
+        monkeypatch.setattr(notifier, "update_last_seen", self.update_last_seen)
+        monkeypatch.setattr(notifier, "send_email", lambda to, subject, html: self.emails.append((to, subject)))
+        monkeypatch.setattr(notifier, "fetch_google_ads", self.fetcher("Google"))
+        monkeypatch.setattr(notifier, "fetch_meta_ads", self.fetcher("Meta"))
+        monkeypatch.setattr(notifier, "fetch_x_ads", self.fetcher("X"))
+        for platform in ad_search.RECENT_ADS:
+            monkeypatch.setitem(ad_search.RECENT_ADS, platform, self.recent(platform))
+        # each run is a fresh process: nothing cached in memory or on disk
+        monkeypatch.setattr(ad_search, "_result_cache", None)
+        monkeypatch.setattr(ad_search, "SOURCE_VERSIONS", {})
+
+    def frame(self, platform):
+        rows = [{"Ad Id": ad} if isinstance(ad, str) else ad for ad in self.ads[platform]]
+        rows = [{"Advertiser Name": "Acme", **row} for row in rows]
+        return normalize_ads(pd.DataFrame(rows, columns=sorted({k for row in rows for k in row})), platform)
+
+    def recent(self, platform):
+        # the shared read: every ad still running on or after since
+        def recent(since):
+            self.fetches.append(f"{platform} recent")
+            df = self.frame(platform)
+            return df[df["End Date"].isna() | (df["End Date"] >= pd.Timestamp(since))].reset_index(drop=True)
+        return recent
+
+    def fetcher(self, platform):
+        def fetch(advertiser_keyword, geography, countries=()):
+            self.fetches.append(platform)
+            if platform in self.failing:
+                raise RuntimeError(f"{platform} is down")
+            return self.frame(platform)
+        return fetch
+
+    def update_last_seen(self, sub_id, ad_ids, when, sheet_row_number=None):
+        if self.crash_on_commit:
+            self.crash_on_commit = False
+            raise Crash()
+        self.sheet[sub_id]["last_seen_ad_ids"] = list(ad_ids)
+
+    def run(self, checkpoint_dir, run_id, ad_first=False, **kwargs):
+        ad_search.clear_cache(disk=False)
+        with CheckpointStore(checkpoint_dir, run_id) as checkpoints:
+            notifier.run_notifications(checkpoints=checkpoints, ad_first=ad_first, **kwargs)
+            return checkpoints.get("sub-1")
+
+
+@pytest.fixture
+def world(monkeypatch):
+    yield World(monkeypatch)
+    ad_search.clear_cache(disk=False)
+
+
+def test_crash_between_send_and_commit_resumes_without_resending(world, tmp_path):
+    world.crash_on_commit = True
+    with pytest.raises(Crash):
+        world.run(tmp_path, "run-1")
+    assert len(world.emails) == 1
+    assert world.sheet["sub-1"]["last_seen_ad_ids"] == []
+
+    entry = world.run(tmp_path, "run-1")
+    assert len(world.emails) == 1
+    assert entry["state"] == "committed"
+    assert sorted(world.sheet["sub-1"]["last_seen_ad_ids"]) == ["g1", "m1"]
+
+
+def test_later_run_commits_an_unconfirmed_send_and_only_mails_new_ads(world, tmp_path):
+    world.crash_on_commit = True
+    with pytest.raises(Crash):
+        world.run(tmp_path, "run-1")
+
+    world.run(tmp_path, "run-2")
+    assert len(world.emails) == 1
+    assert sorted(world.sheet["sub-1"]["last_seen_ad_ids"]) == ["g1", "m1"]
+
+    world.ads["Google"] = ["g1", "g2"]
+    world.run(tmp_path, "run-3")
+    assert len(world.emails) == 2
+    assert "Found 1 New Ad(s)" in world.emails[-1][1]
+
+
+def test_committed_subscription_is_skipped_in_the_same_run(world, tmp_path):
+    world.run(tmp_path, "run-1")
+    fetches = len(world.fetches)
+    entry = world.run(tmp_path, "run-1")
+    assert entry["state"] == "committed"
+    assert len(world.fetches) == fetches
+    assert len(world.emails) == 1
+
+
+def test_missed_platform_is_deferred_and_replayed_by_the_next_pass(world, tmp_path):
+    world.failing = {"Meta"}
+    entry = world.run(tmp_path, "run-1")
+    assert entry["state"] == "deferred"
+    assert entry["platforms"] == ["Meta"]
+    assert world.sheet["sub-1"]["last_seen_ad_ids"] == ["g1"]
+
+    # a Google-only pass still catches up on the Meta search the last run missed
+    world.failing = set()
+    world.fetches.clear()
+    entry = world.run(tmp_path, "run-2", platforms=["Google"])
+    assert "Meta" in world.fetches
+    assert entry["state"] == "committed"
+    assert sorted(world.sheet["sub-1"]["last_seen_ad_ids"]) == ["g1", "m1"]
+    assert len(world.emails) == 2
+
+
+def days_ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+@pytest.mark.parametrize("ad_first", [True, False])
+def test_ad_published_late_is_still_new(world, tmp_path, ad_first):
+    # started long before the lookback but still running: every unseen ad counts, as it always did
+    world.sheet["sub-1"]["platforms"] = ["Google"]
+    world.ads["Google"] = [{"Ad Id": "g1", "Start Date": days_ago(90)}]
+    world.run(tmp_path, "run-1", ad_first=ad_first)
+    assert ("Google recent" in world.fetches) == ad_first
+    assert world.sheet["sub-1"]["last_seen_ad_ids"] == ["g1"]
+
+    world.ads["Google"].append({"Ad Id": "g2", "Start Date": days_ago(60), "End Date": days_ago(1)})
+    world.run(tmp_path, "run-2", ad_first=ad_first)
+    assert world.sheet["sub-1"]["last_seen_ad_ids"] == ["g1", "g2"]
+    assert len(world.emails) == 2
+
+
+@pytest.mark.parametrize("ad_first", [True, False])
+def test_both_paths_match_geography_the_same_way(world, tmp_path, ad_first):
+    world.sheet["sub-1"].update(platforms=["Google", "X"], geography="GA")
+    targeting = {"1": "Atlanta, Georgia, United States", "2": "Michigan, United States", "3": None}
+    for platform in ("Google", "X"):
+        world.ads[platform] = [{"Ad Id": f"{platform[0].lower()}{n}", "Geography Targeting": geo}
+                               for n, geo in targeting.items()]
+    world.run(tmp_path, "run-1", ad_first=ad_first)
+    assert sorted(world.sheet["sub-1"]["last_seen_ad_ids"]) == ["g1", "x1"]
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+import ad_search
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def disk(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path)
+    monkeypatch.setattr(ad_search, "_result_cache", cache)
+    ad_search.clear_cache(disk=False)
+    yield cache
+    ad_search.clear_cache(disk=False)
+
+
+def test_new_source_version_is_fetched_afresh(disk, monkeypatch):
+    version = {"X": "snapshot-1"}
+    monkeypatch.setattr(ad_search, "SOURCE_VERSIONS", {"X": lambda: version["X"]})
+    monkeypatch.setattr(ad_search, "SOURCE_VERSION_TTL", 0)
+    fetches = []
+
+    def fetch():
+        fetches.append(version["X"])
+        return pd.DataFrame({"Ad Id": [version["X"]]})
+
+    assert ad_search._cached(("X", "acme", ""), fetch)["Ad Id"].tolist() == ["snapshot-1"]
+    ad_search.clear_cache(disk=False)
+    # another process (or a restart) finds the same version on disk
+    assert ad_search._cached(("X", "acme", ""), fetch)["Ad Id"].tolist() == ["snapshot-1"]
+    assert fetches == ["snapshot-1"]
+
+    version["X"] = "snapshot-2"
+    assert ad_search._cached(("X", "acme", ""), fetch)["Ad Id"].tolist() == ["snapshot-2"]
+    assert fetches == ["snapshot-1", "snapshot-2"]
+
+
+def test_eviction_keeps_the_directory_under_budget(tmp_path):
+    cache = ResultCache(tmp_path)
+    frame = pd.DataFrame({"Ad Id": [str(i) for i in range(100)]})
+    cache.put(cache.path(("X", "a")), frame)
+    size = next(tmp_path.glob("*.arrow")).stat().st_size
+
+    cache = ResultCache(tmp_path, max_bytes=int(size * 2.5))
+    for keyword in "abcd":
+        cache.put(cache.path(("X", keyword)), frame)
+    assert len(list(tmp_path.glob("*.arrow"))) == 2
+    assert cache._bytes == 2 * size
@@ -1,14 +1,19 @@
-import requests
 import pandas as pd
 import zipfile
 import io
 from datetime import datetime, timedelta
 import logging
+import os
+
+import http_client
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-X_DATA_BASE_URL = "https://business.x.com/content/dam/business-twitter/political-ads-data"
+X_DATA_BASE_URL = os.environ.get(
+    "X_DATA_BASE_URL", "https://business.x.com/content/dam/business-twitter/political-ads-data"
+)
 
 STATE_MAPPING = {
     'al': 'alabama', 'ak': 'alaska', 'az': 'arizona', 'ar': 'arkansas',
@@ -40,6 +45,8 @@ def generate_possible_dates(days_back=7):
 
 
 def find_latest_data_file():
+    import requests
+
     possible_dates = generate_possible_dates(days_back=7)
     
     for date_str, date_obj in possible_dates:
@@ -47,8 +54,13 @@ def find_latest_data_file():
         
         try:
             logger.info(f"Checking for file: {date_str}")
-            response = requests.get(url, timeout=10, stream=True, allow_redirects=True)
-            
+            metrics.incr("api_calls", platform="X")
+            response = http_client.get(url, stream=True)
+            if response.status_code != 200:
+                # reading the short error page to the end hands the connection back to the pool
+                response.content
+            response.close()
+
             if response.status_code == 200:
                 logger.info(f"Found latest data file: {date_str}")
                 return url, date_str
@@ -60,15 +72,19 @@ def find_latest_data_file():
     return None, None
 
 
-def download_and_extract_csv():
-    url, date_str = find_latest_data_file()
+def download_and_extract_csv(url=None):
+    import requests
+
+    if not url:
+        url, date_str = find_latest_data_file()
 
     if not url:
         raise Exception("Could not find latest X political ads data file")
 
     try:
         logger.info(f"Downloading X political ads data from: {url}")
-        response = requests.get(url, timeout=30)
+        metrics.incr("api_calls", platform="X")
+        response = http_client.get(url)
         response.raise_for_status()
 
         logger.info(f"Extracting file from ZIP")